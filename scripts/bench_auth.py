@@ -0,0 +1,94 @@
+"""Time the bearer token check with and without the in-memory TokenHolder.
+
+Needs a redis server. Compares the redis-cached retrieve_token every request
+used to await, a key file read on a cache miss, TokenHolder.get and the full
+get_token dependency, then checks that a token rotated by another worker is
+picked up over pub/sub.
+
+    python scripts/bench_auth.py --redis-url redis://localhost:6379
+"""
+
+import os
+import time
+import asyncio
+import tempfile
+
+from benchlib import run, summarize
+
+
+async def timed(check, runs):
+    for _ in range(200):
+        await check()
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await check()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def measure_async(args, key_file):
+    from fastapi.security.http import HTTPAuthorizationCredentials
+    from fastapi_cache import FastAPICache
+    from fastapi_cache.backends.redis import RedisBackend
+    from redis import asyncio as aioredis
+
+    import auth
+
+    redis = aioredis.from_url(args.redis_url)
+    FastAPICache.init(RedisBackend(redis), prefix="bench")
+    await FastAPICache.clear(namespace="token")
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials="token-1")
+
+    async def cached():
+        assert await auth.retrieve_token() == "token-1"
+
+    async def key_file_read():
+        assert await auth.run_io(auth.key_manager.get_key) == "token-1"
+
+    async def holder():
+        assert await auth.token_holder.get() == "token-1"
+
+    async def dependency():
+        await auth.get_token(credentials)
+
+    for name, check in (
+        ("redis cached retrieve_token", cached),
+        ("key file read", key_file_read),
+        ("TokenHolder.get", holder),
+        ("get_token dependency", dependency),
+    ):
+        print(f"{name}: {await timed(check, args.runs)}")
+
+    watch = asyncio.create_task(auth.token_holder.watch(redis))
+    await asyncio.sleep(0.2)
+    # another worker rotates the token: writes the file, clears the cache
+    # and publishes
+    with open(key_file, "w") as file:
+        file.write("token-2")
+    await FastAPICache.clear(namespace="token")
+    await redis.publish(auth.TOKEN_CHANNEL, "another-worker")
+    await asyncio.sleep(0.1)
+    print(f"after a remote update: {await auth.token_holder.get()}")
+    watch.cancel()
+    await FastAPICache.clear(namespace="token")
+    await redis.close()
+
+
+def measure(args):
+    with tempfile.TemporaryDirectory() as directory:
+        key_file = os.path.join(directory, "key.txt")
+        with open(key_file, "w") as file:
+            file.write("token-1")
+        os.environ["KEY_FILE"] = key_file
+        os.environ.pop("ENVIRONMENT", None)
+        asyncio.run(measure_async(args, key_file))
+
+
+def add_arguments(parser):
+    parser.add_argument("--redis-url", default="redis://localhost:6379")
+    parser.add_argument("--runs", type=int, default=5000)
+
+
+if __name__ == "__main__":
+    run(measure, __doc__, add_arguments)
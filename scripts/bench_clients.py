@@ -0,0 +1,163 @@
+"""Compare separate ChatOpenAI clients with the shared ClientRegistry pools.
+
+Starts a local TLS stub of the chat completions endpoint, then replays
+bursts of concurrent chat requests, each making the expand and rewrite
+calls in parallel followed by the answer call, with an idle gap between
+bursts longer than httpx's default keep-alive. Reports call latency and
+the number of TLS handshakes for both setups.
+
+    python scripts/bench_clients.py --bursts 5 --concurrency 4 --idle 6.5
+"""
+
+import os
+import ssl
+import sys
+import time
+import socket
+import asyncio
+import tempfile
+import subprocess
+
+from benchlib import free_port, run, summarize
+
+STUB = """
+import time
+import asyncio
+
+from fastapi import FastAPI, Request
+
+app = FastAPI()
+
+
+@app.post("/v1/chat/completions")
+async def chat(request: Request):
+    body = await request.json()
+    await asyncio.sleep({delay})
+    return {{
+        "id": "stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body["model"],
+        "choices": [
+            {{
+                "index": 0,
+                "message": {{"role": "assistant", "content": "ok"}},
+                "finish_reason": "stop",
+            }}
+        ],
+        "usage": {{"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}},
+    }}
+"""
+
+
+def wait_for(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"stub server did not start on port {port}")
+
+
+def start_stub(directory: str, delay: float) -> subprocess.Popen:
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes"]
+        + ["-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost"]
+        + ["-days", "1", "-keyout", "key.pem", "-out", "cert.pem"],
+        cwd=directory,
+        check=True,
+        capture_output=True,
+    )
+    with open(os.path.join(directory, "stub.py"), "w") as file:
+        file.write(STUB.format(delay=delay))
+    port = free_port()
+    # uvicorn drops idle connections after 5s, the api's edge keeps them longer
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "stub:app", "--log-level", "warning"]
+        + ["--port", str(port), "--timeout-keep-alive", "75"]
+        + ["--ssl-keyfile", "key.pem", "--ssl-certfile", "cert.pem"],
+        cwd=directory,
+    )
+    wait_for(port)
+    os.environ["OPENAI_BASE_URL"] = f"https://localhost:{port}/v1"
+    os.environ["SSL_CERT_FILE"] = os.path.join(directory, "cert.pem")
+    return process
+
+
+def measure(args):
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_stub(directory, args.delay_ms / 1000)
+        os.environ.setdefault("OPENAI_API_KEY", "stub")
+        os.environ["EMBED_CACHE_PATH"] = os.path.join(directory, "embeddings.sqlite")
+        try:
+            for name in ("separate", "registry"):
+                latencies, handshakes = asyncio.run(load(name, args))
+                print(
+                    f"{name}: {len(latencies)} calls {summarize(latencies)}, "
+                    f"{handshakes} TLS handshakes"
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+async def load(name, args):
+    from langchain_openai.chat_models import ChatOpenAI
+
+    from clients import ClientRegistry
+
+    handshakes = 0
+    wrap_bio = ssl.SSLContext.wrap_bio
+
+    def counting_wrap_bio(self, *wrap_args, **kwargs):
+        nonlocal handshakes
+        handshakes += 1
+        return wrap_bio(self, *wrap_args, **kwargs)
+
+    if name == "separate":
+        clients = None
+        answer = ChatOpenAI(model="gpt-4.1", temperature=0)
+        expand = ChatOpenAI(model="gpt-4.1-mini", temperature=0.7)
+        rewrite = ChatOpenAI(model="gpt-4.1-mini", temperature=0.7)
+    else:
+        clients = ClientRegistry()
+        answer = clients.chat_model("gpt-4.1", temperature=0)
+        expand = rewrite = clients.chat_model("gpt-4.1-mini", temperature=0.7)
+
+    latencies = []
+
+    async def call(llm):
+        start = time.perf_counter()
+        await llm.ainvoke("hi")
+        latencies.append(time.perf_counter() - start)
+
+    async def request():
+        await asyncio.gather(call(expand), call(rewrite))
+        await call(answer)
+
+    ssl.SSLContext.wrap_bio = counting_wrap_bio
+    try:
+        for burst in range(args.bursts):
+            if burst:
+                await asyncio.sleep(args.idle)
+            await asyncio.gather(*[request() for _ in range(args.concurrency)])
+    finally:
+        ssl.SSLContext.wrap_bio = wrap_bio
+        if clients is not None:
+            await clients.aclose()
+    return latencies, handshakes
+
+
+def add_arguments(parser):
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--idle", type=float, default=6.5, help="seconds between bursts"
+    )
+    parser.add_argument("--delay-ms", type=float, default=30, help="stub response time")
+
+
+if __name__ == "__main__":
+    run(measure, __doc__, add_arguments)
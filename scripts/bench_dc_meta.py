@@ -0,0 +1,119 @@
+"""Time DCMetaLoader.load on a synthetic pair of metadata parquet files.
+
+--unused-columns pads both files with text columns the loader never uses,
+and --http serves them from a local server instead of reading from disk.
+
+    python scripts/bench_dc_meta.py --datasets 10000 --fields 200000 --baseline HEAD~1
+"""
+
+import os
+import time
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from benchlib import digest, run, serve_directory
+
+
+def write_parquets(directory: str, datasets: int, fields: int, unused_columns: int):
+    ids = [f"ds_{i}" for i in range(datasets)]
+    meta = pd.DataFrame(
+        {
+            "id": ids,
+            "dataset_begin": [str(1950 + i % 50) for i in range(datasets)],
+            "dataset_end": [str(1950 + i % 50 + i % 3) for i in range(datasets)],
+            "geography": "x",
+            "demography": "y",
+            "data_source_primary": "z",
+            "frequency": ["DAILY", "MONTHLY"] * (datasets // 2)
+            + ["YEARLY"] * (datasets % 2),
+            "methodology_en": "methodology",
+            "caveat_en": [None if i % 7 == 0 else "caveat" for i in range(datasets)],
+            "category_en": "category",
+            "subcategory_en": "subcategory",
+            "description_en": [f"description {i}" for i in range(datasets)],
+            "data_source": "DOSM",
+            "exclude_openapi": [i % 5 == 0 for i in range(datasets)],
+        }
+    )
+    field_ids = np.repeat(ids, max(1, fields // datasets))
+    metafields = pd.DataFrame(
+        {
+            "id": field_ids,
+            "var_name": [f"v{i}" for i in range(len(field_ids))],
+            "var_title_en": [f" Title {i} " for i in range(len(field_ids))],
+            "var_description_en": [
+                "[int] count of things" if i % 4 else " no type here "
+                for i in range(len(field_ids))
+            ],
+        }
+    ).sample(frac=1, random_state=0)
+    for i in range(unused_columns):
+        meta[f"unused_{i}"] = [f"{'lorem ipsum ' * 20}{j}" for j in range(len(meta))]
+        metafields[f"unused_{i}"] = [
+            f"{'dolor sit amet ' * 10}{j}" for j in range(len(metafields))
+        ]
+    meta_path = os.path.join(directory, "meta.parquet")
+    fields_path = os.path.join(directory, "metafields.parquet")
+    meta.to_parquet(meta_path, row_group_size=2000)
+    metafields.to_parquet(fields_path, row_group_size=20000)
+    return [meta_path, fields_path]
+
+
+def measure(args):
+    from loaders import DCMetaLoader
+
+    with tempfile.TemporaryDirectory() as directory:
+        # written in a child process so peak rss only covers the load
+        with ProcessPoolExecutor(1, multiprocessing.get_context("spawn")) as pool:
+            sources = pool.submit(
+                write_parquets,
+                directory,
+                args.datasets,
+                args.fields,
+                args.unused_columns,
+            ).result()
+        file_bytes = sum(os.path.getsize(source) for source in sources)
+        server = None
+        if args.http:
+            server = serve_directory(directory)
+            sources = [f"{server.url}/{os.path.basename(s)}" for s in sources]
+        start = time.perf_counter()
+        dfm = DCMetaLoader(sources).load()
+        elapsed = time.perf_counter() - start
+        if server is not None:
+            server.shutdown()
+    # ru_maxrss is in KiB on linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    print(
+        f"load: {elapsed:.2f}s for {len(dfm)} datasets, peak rss {peak_rss}MB, "
+        f"output {digest(dfm[['content_embed', 'header', 'source']].to_json())}"
+    )
+    if server is not None:
+        print(f"http: {server.bytes_sent} of {file_bytes} file bytes transferred")
+
+
+def add_arguments(parser):
+    parser.add_argument("--datasets", type=int, default=10_000)
+    parser.add_argument("--fields", type=int, default=200_000)
+    parser.add_argument("--unused-columns", type=int, default=0)
+    parser.add_argument("--http", action="store_true")
+
+
+def drop_include_groups(tree: str):
+    # the pre-vectorised loader passed include_groups to groupby, which
+    # pandas rejects; it belongs to apply, and dropping it keeps the output
+    path = os.path.join(tree, "loaders.py")
+    with open(path) as file:
+        source = file.read()
+    source = source.replace('"id", include_groups=False', '"id"')
+    with open(path, "w") as file:
+        file.write(source)
+
+
+if __name__ == "__main__":
+    run(measure, __doc__, add_arguments, prepare_baseline=drop_include_groups)
@@ -0,0 +1,70 @@
+"""Time MdxLoader.load on a synthetic mdx corpus served from a local server.
+
+Files are fetched once to fill the http cache, then each timed load
+revalidates them, so the numbers are dominated by parsing and splitting.
+
+    python scripts/bench_mdx.py --files 2000 --workers 1 2 4 --baseline HEAD~1
+"""
+
+import os
+import time
+import random
+import tempfile
+
+from benchlib import digest, run, serve_directory
+
+WORDS = ["lorem", "ipsum", "dolor", "api", "data", "catalogue", "dashboard"]
+
+
+def write_corpus(directory: str, files: int):
+    rng = random.Random(0)
+    paths = []
+    for i in range(files):
+        path = os.path.join("pages", f"section{i % 10}", f"file{i}.en.mdx")
+        parts = [
+            'import Head from "next/head";\n<Head>\n<title>x</title>\n</Head>\n'
+            f"# Title {i}\n"
+        ]
+        for section in range(6):
+            words = " ".join(rng.choice(WORDS) for _ in range(300))
+            parts.append(
+                f"## Section {section}\n{words}\n### Sub\n"
+                "```python\n# comment\nx = 1\n```\n"
+            )
+        os.makedirs(os.path.join(directory, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(directory, path), "w") as file:
+            file.write("".join(parts))
+        paths.append(path)
+    return paths
+
+
+def measure(args):
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_corpus(os.path.join(directory, "repo"), args.files)
+        server = serve_directory(os.path.join(directory, "repo"))
+        os.environ["FETCH_CACHE_DIR"] = os.path.join(directory, "http_cache")
+        os.environ.pop("GITHUB_TOKEN", None)
+        from loaders import MdxLoader
+
+        urls = [f"{server.url}/{path}" for path in paths]
+        MdxLoader(urls, "docs").load()
+        for workers in args.workers:
+            os.environ["MDX_WORKERS"] = str(workers)
+            start = time.perf_counter()
+            dfm = MdxLoader(urls, "docs").load()
+            elapsed = time.perf_counter() - start
+            output = dfm[["header", "source", "content_embed"]].to_json()
+            print(
+                f"workers={workers}: {elapsed:.2f}s for {len(urls)} files, "
+                f"{len(dfm)} chunks, output {digest(output)}"
+            )
+        server.shutdown()
+
+
+def add_arguments(parser):
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1])
+
+
+if __name__ == "__main__":
+    run(measure, __doc__, add_arguments)
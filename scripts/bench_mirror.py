@@ -0,0 +1,108 @@
+"""Compare retrieval latency of the in-process mirror with querying Chroma.
+
+Needs a running Chroma server. --load first fills the collection with random
+unit vectors, a quarter of them tagged as dc_meta, so the filtered lookup of
+generate_meta can be timed too.
+
+    python scripts/bench_mirror.py --host localhost --port 8000 --load
+    python scripts/bench_mirror.py --host localhost --port 8000
+"""
+
+import json
+import time
+
+import numpy as np
+
+from benchlib import run, summarize
+
+
+def unit(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def load(client, args, rng):
+    try:
+        client.delete_collection(args.collection)
+    except Exception:
+        pass
+    collection = client.create_collection(args.collection)
+    vectors = unit(rng.normal(size=(args.records, args.dims))).astype(np.float32)
+    for start in range(0, args.records, 1000):
+        ids = range(start, min(start + 1000, args.records))
+        collection.add(
+            ids=[f"id{i}" for i in ids],
+            embeddings=vectors[ids.start : ids.stop],
+            documents=[f"chunk {i}" for i in ids],
+            metadatas=[
+                {
+                    "source": "dc_meta" if i % 4 == 0 else f"docs/{i % 50}",
+                    "header": json.dumps({"id": f"id{i}"}),
+                }
+                for i in ids
+            ],
+        )
+    print(f"loaded {collection.count()} records into {args.collection}")
+
+
+def measure(args):
+    import chromadb
+    from langchain_chroma import Chroma
+    from langchain_core.embeddings import FakeEmbeddings
+
+    from mirror import CollectionMirror, query_collection
+
+    rng = np.random.default_rng(0)
+    client = chromadb.HttpClient(host=args.host, port=args.port)
+    if args.load:
+        load(client, args, rng)
+
+    db = Chroma(
+        client=client,
+        collection_name=args.collection,
+        embedding_function=FakeEmbeddings(size=args.dims),
+    )
+    mirror = CollectionMirror(args.collection, client=client)
+    start = time.perf_counter()
+    mirror.sync("bench")
+    mirror.latest_version = "bench"
+    print(f"sync: {time.perf_counter() - start:.2f}s")
+
+    queries = unit(rng.normal(size=(args.queries, args.dims))).tolist()
+    overlap = []
+    for query in queries:
+        exact = mirror.query([query], args.fetch_k)["ids"][0]
+        approx = db._collection.query(query_embeddings=[query], n_results=args.fetch_k)
+        overlap.append(len(set(exact) & set(approx["ids"][0])) / args.fetch_k)
+    print(
+        f"top-{args.fetch_k} overlap of chroma's hnsw with the exact mirror: {overlap}"
+    )
+
+    cases = (
+        (f"{args.queries} queries", queries, None),
+        ("1 query where source=dc_meta", queries[:1], {"source": "dc_meta"}),
+    )
+    for label, batch, where in cases:
+        for name, source in (("chroma", None), ("mirror", mirror)):
+            query_collection(db, batch, args.fetch_k, where=where, mirror=source)
+            samples = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                query_collection(db, batch, args.fetch_k, where=where, mirror=source)
+                samples.append(time.perf_counter() - start)
+            print(f"{label} [{name}]: {summarize(samples)}")
+
+
+def add_arguments(parser):
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--collection", default="dgmy_docs")
+    parser.add_argument("--load", action="store_true", help="refill the collection")
+    parser.add_argument("--records", type=int, default=8000)
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=4)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=200)
+
+
+if __name__ == "__main__":
+    run(measure, __doc__, add_arguments)
@@ -0,0 +1,101 @@
+"""Compare the fused NumPy ranking stage with per-query MMR + EnsembleRetriever.
+
+Both sides rank the same random candidates: the old path runs langchain's
+maximal_marginal_relevance per query and fuses with EnsembleRetriever's
+weighted RRF, the new one is utils.ranking.fuse. Rankings are checked for
+equality over random trials before timing.
+
+    python scripts/bench_ranking.py --queries 4 8 16 --runs 200
+"""
+
+import time
+
+import numpy as np
+
+from benchlib import run, summarize
+
+
+def measure(args):
+    from langchain.retrievers import EnsembleRetriever
+    from langchain_chroma.vectorstores import maximal_marginal_relevance
+    from langchain_core.documents import Document
+    from langchain_core.retrievers import BaseRetriever
+
+    from utils.ranking import fuse, pad_candidates
+
+    class NoRetriever(BaseRetriever):
+        def _get_relevant_documents(self, query):
+            return []
+
+    rng = np.random.default_rng(0)
+    corpus = rng.normal(size=(args.pool, args.dims)).astype(np.float32)
+
+    def make(n_queries):
+        queries = rng.normal(size=(n_queries, args.dims)).astype(np.float32)
+        candidate_ids = [
+            rng.choice(args.pool, size=args.fetch_k, replace=False)
+            for _ in range(n_queries)
+        ]
+        return queries, candidate_ids
+
+    def old(queries, candidate_ids):
+        rankings = []
+        for query, ids in zip(queries, candidate_ids):
+            picks = maximal_marginal_relevance(
+                query, corpus[ids], k=args.k, lambda_mult=0.5
+            )
+            rankings.append(
+                [
+                    Document(page_content=str(ids[j]))
+                    for j in range(len(ids))
+                    if j in picks
+                ]
+            )
+        ensemble = EnsembleRetriever(
+            retrievers=[NoRetriever()], weights=[1 / len(rankings)] * len(rankings)
+        )
+        return [
+            int(doc.page_content) for doc in ensemble.weighted_reciprocal_rank(rankings)
+        ]
+
+    def new(queries, candidate_ids):
+        candidates, valid = pad_candidates([corpus[ids] for ids in candidate_ids])
+        return fuse(
+            queries,
+            candidates,
+            np.stack(candidate_ids),
+            valid,
+            k=args.k,
+            lambda_mult=0.5,
+        )
+
+    mismatches = 0
+    for _ in range(args.trials):
+        queries, candidate_ids = make(int(rng.integers(1, 17)))
+        mismatches += old(queries, candidate_ids) != new(queries, candidate_ids)
+    print(f"mismatches in {args.trials} random trials: {mismatches}")
+
+    for n_queries in args.queries:
+        queries, candidate_ids = make(n_queries)
+        for name, rank in (("old", old), ("new", new)):
+            rank(queries, candidate_ids)
+            samples = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                rank(queries, candidate_ids)
+                samples.append(time.perf_counter() - start)
+            print(f"queries={n_queries} {name}: {summarize(samples)}")
+
+
+def add_arguments(parser):
+    parser.add_argument("--queries", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--trials", type=int, default=300)
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--pool", type=int, default=300)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--k", type=int, default=4)
+
+
+if __name__ == "__main__":
+    run(measure, __doc__, add_arguments)
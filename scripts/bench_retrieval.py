@@ -0,0 +1,337 @@
+"""Compare dense-only retrieval with dense + BM25 fusion on recall@4.
+
+Indexes a small fixed corpus into an in-memory Chroma collection and a BM25
+index: data catalogue pages, each split into near duplicate chunks the way
+ingest splits them, and API guides. A labelled query set then runs through
+DocsRetriever with and without the lexical index. Queries mix exact dataset
+ids and API parameters with paraphrases, each labelled with the documents
+that answer it.
+
+By default documents are embedded with hashed character trigrams, so the
+eval runs offline and is deterministic. Trigrams carry much of the signal
+BM25 does, so that run mostly checks fusion costs no recall; the comparison
+that matters uses the api's embedding model, --embeddings openai, which
+needs OPENAI_API_KEY.
+
+    python scripts/bench_retrieval.py
+    python scripts/bench_retrieval.py --embeddings openai
+"""
+
+import os
+import time
+import uuid
+import hashlib
+import tempfile
+from typing import List
+
+import numpy as np
+
+from benchlib import run, summarize
+
+# (id, title, frequency, description)
+DATASETS = [
+    (
+        "fuelprice",
+        "Price of Petroleum Products",
+        "weekly",
+        "retail prices of RON95 and RON97 petrol and diesel in Peninsular Malaysia",
+    ),
+    (
+        "cpi_headline",
+        "Consumer Price Index",
+        "monthly",
+        "headline CPI for Malaysia by main group of goods and services",
+    ),
+    (
+        "cpi_core",
+        "Core Consumer Price Index",
+        "monthly",
+        "core CPI excluding volatile items and administered prices",
+    ),
+    (
+        "cpi_state",
+        "Consumer Price Index by State",
+        "monthly",
+        "headline CPI for each state by main group",
+    ),
+    (
+        "ppi",
+        "Producer Price Index",
+        "monthly",
+        "prices received by local producers by sector",
+    ),
+    (
+        "gdp_qtr_real",
+        "Quarterly GDP (Constant 2015 Prices)",
+        "quarterly",
+        "gross domestic product at constant prices by economic sector",
+    ),
+    (
+        "gdp_annual_real",
+        "Annual GDP (Constant 2015 Prices)",
+        "annual",
+        "gross domestic product at constant prices by economic sector",
+    ),
+    (
+        "population_malaysia",
+        "Population Table: Malaysia",
+        "annual",
+        "population of Malaysia by sex, age group and ethnicity",
+    ),
+    (
+        "population_state",
+        "Population Table: States",
+        "annual",
+        "population of each state by sex, age group and ethnicity",
+    ),
+    ("births", "Live Births", "annual", "number of live births in Malaysia by sex"),
+    ("deaths", "Deaths", "annual", "number of deaths in Malaysia by sex"),
+    (
+        "lfs_month",
+        "Monthly Principal Labour Force Statistics",
+        "monthly",
+        "labour force, employment and unemployment rate",
+    ),
+    (
+        "lfs_qtr",
+        "Quarterly Principal Labour Force Statistics",
+        "quarterly",
+        "labour force, employment and unemployment rate",
+    ),
+    (
+        "trade_sitc_1d",
+        "Exports and Imports by SITC Section",
+        "monthly",
+        "value of external trade by 1-digit SITC section",
+    ),
+    (
+        "exchangerates",
+        "Exchange Rates",
+        "daily",
+        "ringgit against major currencies including the US dollar",
+    ),
+    (
+        "interestrates",
+        "Interest Rates",
+        "monthly",
+        "overnight policy rate and interbank interest rates",
+    ),
+    (
+        "electricity_supply",
+        "Electricity Supply",
+        "monthly",
+        "electricity generated and supplied in gigawatt hours",
+    ),
+    (
+        "water_consumption",
+        "Water Consumption",
+        "annual",
+        "domestic and non-domestic water consumption by state",
+    ),
+    (
+        "hh_income",
+        "Household Income",
+        "annual",
+        "mean and median monthly household gross income",
+    ),
+    (
+        "arrivals",
+        "Tourist Arrivals",
+        "monthly",
+        "foreign visitors entering Malaysia by country of nationality",
+    ),
+    (
+        "crime_district",
+        "Crimes by District",
+        "annual",
+        "index crimes by district and type of crime",
+    ),
+    (
+        "cars_registered",
+        "New Car Registrations",
+        "daily",
+        "new vehicles registered by maker, model and fuel type",
+    ),
+]
+
+GUIDES = [
+    (
+        "guide/filter",
+        "Filtering rows. Pass filter=column@value to keep only "
+        "rows where a column equals a value, several filters are joined with a "
+        "comma, e.g. filter=state@Selangor,sex@both.",
+    ),
+    (
+        "guide/dates",
+        "Selecting a date range. Use date_start and date_end with "
+        "a column name, e.g. date_start=2023-01-01@date, to return only rows "
+        "between two dates.",
+    ),
+    (
+        "guide/limit",
+        "Limiting results. The limit parameter caps the number of "
+        "rows returned, combine it with sort to get the most recent rows first.",
+    ),
+    (
+        "guide/columns",
+        "Choosing columns. include and exclude take a comma "
+        "separated list of column names to return or leave out.",
+    ),
+    (
+        "guide/token",
+        "Authentication. Request an API token and send it in the "
+        "Authorization header as 'Token <your token>' to raise your rate limit.",
+    ),
+    (
+        "guide/ratelimit",
+        "Rate limits. Requests without a token are limited to "
+        "4 per minute, going over returns HTTP 429 Too Many Requests until the "
+        "window resets.",
+    ),
+    (
+        "guide/catalogue",
+        "Calling the data catalogue API. Send a GET request to "
+        "/data-catalogue with id set to the dataset id shown on its page.",
+    ),
+    (
+        "guide/opendosm",
+        "Calling the OpenDOSM API. Datasets published by DOSM "
+        "are served from /opendosm with the same parameters as the catalogue.",
+    ),
+]
+
+# query, ids of the documents that answer it
+QUERIES = [
+    ("fuelprice api", ["fuelprice"]),
+    ("how much is petrol each week", ["fuelprice"]),
+    ("cpi_state", ["cpi_state"]),
+    ("inflation excluding volatile items", ["cpi_core"]),
+    ("gdp_qtr_real by sector", ["gdp_qtr_real"]),
+    ("how many people live in each state", ["population_state"]),
+    ("babies born per year", ["births"]),
+    ("lfs_month unemployment", ["lfs_month"]),
+    ("ringgit to US dollar", ["exchangerates"]),
+    ("overnight policy rate", ["interestrates"]),
+    ("foreign visitors to Malaysia", ["arrivals"]),
+    ("new car registrations by maker", ["cars_registered"]),
+    ("date_start parameter", ["guide/dates"]),
+    ("only rows between two dates", ["guide/dates"]),
+    ("filter=state@Selangor", ["guide/filter"]),
+    ("I keep getting 429 errors", ["guide/ratelimit"]),
+    ("where do I put my api token", ["guide/token"]),
+    ("return fewer columns", ["guide/columns"]),
+    ("call the catalogue api for fuelprice", ["guide/catalogue", "fuelprice"]),
+    ("opendosm cpi_headline", ["guide/opendosm", "cpi_headline"]),
+]
+
+
+def corpus():
+    ids, documents, metadatas = [], [], []
+    for dataset_id, title, frequency, description in DATASETS:
+        ids.append(dataset_id)
+        documents.append(
+            f"{title}. Dataset id {dataset_id}. {frequency.capitalize()} data, "
+            f"{description}. Available through the API and as a CSV or "
+            f"parquet download."
+        )
+        metadatas.append({"source": f"datasets/{dataset_id}"})
+        # the other chunks of a dataset page, near duplicates across datasets
+        ids += [f"{dataset_id}/columns", f"{dataset_id}/methodology"]
+        documents += [
+            f"{title}. Columns: date, the reporting period, and value, the "
+            f"{frequency} figure, with state and sex breakdowns where available.",
+            f"{title}. Methodology: compiled by the Department of Statistics "
+            f"Malaysia from administrative records and surveys, figures for "
+            f"the latest period are preliminary and revised later.",
+        ]
+        metadatas += [{"source": f"datasets/{dataset_id}"}] * 2
+    for guide_id, text in GUIDES:
+        ids.append(guide_id)
+        documents.append(text)
+        metadatas.append({"source": f"docs/{guide_id}"})
+    return ids, documents, metadatas
+
+
+def trigram_embeddings(dims: int):
+    """Hashed character trigrams, a deterministic offline stand-in"""
+    from langchain_core.embeddings import Embeddings
+
+    class TrigramEmbeddings(Embeddings):
+        def _vector(self, text: str) -> List[float]:
+            vector = np.zeros(dims, dtype=np.float32)
+            text = f" {text.lower()} "
+            for i in range(len(text) - 2):
+                digest = hashlib.md5(text[i : i + 3].encode()).digest()
+                vector[int.from_bytes(digest[:4], "little") % dims] += 1
+            return (vector / (np.linalg.norm(vector) or 1)).tolist()
+
+        def embed_documents(self, texts: List[str]) -> List[List[float]]:
+            return [self._vector(text) for text in texts]
+
+        def embed_query(self, text: str) -> List[float]:
+            return self._vector(text)
+
+    return TrigramEmbeddings()
+
+
+def measure(args):
+    import chromadb
+    from langchain_chroma import Chroma
+
+    from chain import DocsRetriever
+    from utils.bm25 import BM25Index, build_bm25
+
+    if args.embeddings == "openai":
+        from clients import ClientRegistry
+
+        embeddings = ClientRegistry().embeddings()
+    else:
+        embeddings = trigram_embeddings(args.dims)
+
+    ids, documents, metadatas = corpus()
+    db = Chroma(
+        client=chromadb.EphemeralClient(),
+        collection_name=f"eval-{uuid.uuid4().hex}",
+        embedding_function=embeddings,
+    )
+    db.add_texts(documents, metadatas=metadatas, ids=ids)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bm25")
+        build_bm25(ids, documents, metadatas, path, "eval")
+        lexical = BM25Index(path)
+        lexical.load()
+
+        for name, index in (("dense", None), ("fused", lexical)):
+            retriever = DocsRetriever(
+                vectorstore=db, k=args.k, lexical=index, lexical_weight=args.weight
+            )
+            recalls, samples, misses = [], [], []
+            for query, relevant in QUERIES:
+                start = time.perf_counter()
+                docs = retriever.invoke(query)
+                samples.append(time.perf_counter() - start)
+                found = {doc.id for doc in docs} & set(relevant)
+                recalls.append(len(found) / len(relevant))
+                if len(found) < len(relevant):
+                    misses.append(query)
+            print(
+                f"{name}: recall@{args.k} {np.mean(recalls):.3f} over "
+                f"{len(QUERIES)} queries, {summarize(samples)}"
+            )
+            print(f"  missed: {misses}")
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--embeddings", choices=["trigram", "openai"], default="trigram"
+    )
+    parser.add_argument("--dims", type=int, default=256, help="trigram vector size")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument(
+        "--weight", type=float, default=0.5, help="share of the fused weight for BM25"
+    )
+
+
+if __name__ == "__main__":
+    run(measure, __doc__, add_arguments)
@@ -0,0 +1,107 @@
+"""Measure what routing trivial turns around retrieval saves.
+
+Runs a sample of chat turns through TurnRouter, reporting the classifier's
+own cost per turn and the share of turns routed past the rewrite and
+expansion calls. The chain is the same RunnableBranch create_new_chain
+builds, with the LLM and retrieval stages replaced by sleeps of --llm-ms,
+so latency is compared with routing on and off.
+
+    python scripts/bench_router.py --llm-ms 400
+"""
+
+import time
+import asyncio
+import logging
+
+from benchlib import run, summarize
+
+TURNS = [
+    "Thank you!",
+    "ok",
+    "ok thanks",
+    "Terima kasih banyak!!",
+    "hi",
+    "Selamat pagi",
+    "noted, cheers",
+    "yes",
+    "How do I filter by date?",
+    "fuelprice api",
+    "apa itu dosm",
+    "Hello, how do I get CPI data via the API?",
+    "which datasets are updated monthly?",
+    "berapa kadar inflasi terkini",
+]
+
+
+def measure(args):
+    from langchain_core.runnables import (
+        RunnableBranch,
+        RunnableLambda,
+        RunnableParallel,
+        RunnablePassthrough,
+    )
+
+    from router import ROUTE_TRIVIAL, TurnRouter
+
+    logging.disable(logging.INFO)
+    router = TurnRouter()
+
+    samples = []
+    for _ in range(args.runs):
+        for turn in TURNS:
+            start = time.perf_counter()
+            router.route(turn)
+            samples.append(time.perf_counter() - start)
+    print(f"route() per turn: {summarize(samples)}")
+    trivial = [turn for turn in TURNS if router.route(turn) == ROUTE_TRIVIAL]
+    print(f"routed trivial: {len(trivial)}/{len(TURNS)} {trivial}")
+
+    async def llm(inputs):
+        await asyncio.sleep(args.llm_ms / 1000)
+        return ""
+
+    qa_chain = RunnableLambda(llm)
+    retrieval_answer_chain = (
+        RunnableParallel(
+            {
+                "context": RunnableLambda(llm) | RunnableLambda(llm),
+                "query": RunnableLambda(llm),
+                "history": lambda inputs: inputs["history"],
+            }
+        )
+        | qa_chain
+    )
+    routed_chain = RunnableBranch(
+        (
+            RunnableLambda(router.is_trivial, afunc=router.ais_trivial),
+            RunnablePassthrough.assign(context=lambda _: "") | qa_chain,
+        ),
+        retrieval_answer_chain,
+    )
+
+    async def timed(chain):
+        totals = {}
+        for turn in TURNS:
+            start = time.perf_counter()
+            await chain.ainvoke({"query": turn, "history": []})
+            totals[turn] = time.perf_counter() - start
+        return totals
+
+    unrouted = asyncio.run(timed(retrieval_answer_chain))
+    routed = asyncio.run(timed(routed_chain))
+    for label, turns in (("trivial", trivial), ("all", TURNS)):
+        print(
+            f"{label} turns: unrouted {summarize([unrouted[t] for t in turns])}, "
+            f"routed {summarize([routed[t] for t in turns])}"
+        )
+
+
+def add_arguments(parser):
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument(
+        "--llm-ms", type=float, default=400, help="simulated latency per LLM call"
+    )
+
+
+if __name__ == "__main__":
+    run(measure, __doc__, add_arguments)
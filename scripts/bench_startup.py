@@ -0,0 +1,239 @@
+"""Time a worker's cold start: imports, /health, /ready and the first request.
+
+Needs redis and a Chroma server holding the dgmy_docs collection, like the
+api itself. OpenAI is replaced by a local stub answering the chat,
+embedding and model list calls after --delay-ms. Each run starts uvicorn on
+the app with a fresh embedding cache, then reports from process start the
+time until /health answers and until /ready reports OK, followed by the
+latency of the first chat request and of the one after it.
+
+    python scripts/bench_startup.py --redis-url redis://localhost:6379 \\
+        --chroma-host localhost --chroma-port 8000
+"""
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+from benchlib import free_port, run, summarize
+
+STUB = """
+import json
+import time
+import asyncio
+import hashlib
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+app = FastAPI()
+ANSWER = "Consumer price index\\nInflation rate"
+
+
+@app.get("/v1/models")
+async def models():
+    return {{"object": "list", "data": []}}
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    await asyncio.sleep({delay})
+    data = []
+    for i, text in enumerate(texts):
+        seed = int(hashlib.md5(str(text).encode()).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).normal(size={dims})
+        vector /= np.linalg.norm(vector)
+        data.append({{"object": "embedding", "index": i, "embedding": vector.tolist()}})
+    return {{
+        "object": "list",
+        "data": data,
+        "model": body["model"],
+        "usage": {{"prompt_tokens": 1, "total_tokens": 1}},
+    }}
+
+
+@app.post("/v1/chat/completions")
+async def chat(request: Request):
+    body = await request.json()
+    await asyncio.sleep({delay})
+    if not body.get("stream"):
+        return {{
+            "id": "stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [
+                {{
+                    "index": 0,
+                    "message": {{"role": "assistant", "content": ANSWER}},
+                    "finish_reason": "stop",
+                }}
+            ],
+            "usage": {{"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}},
+        }}
+
+    async def chunks():
+        for word in ANSWER.split():
+            chunk = {{
+                "id": "stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [
+                    {{"index": 0, "delta": {{"content": word + " "}}, "finish_reason": None}}
+                ],
+            }}
+            yield f"data: {{json.dumps(chunk)}}\\n\\n"
+        yield "data: [DONE]\\n\\n"
+
+    return StreamingResponse(chunks(), media_type="text/event-stream")
+"""
+
+TOKEN = "bench-token"
+
+
+def import_time(args, env) -> float:
+    code = (
+        "import time; start = time.perf_counter(); import app; "
+        "print(time.perf_counter() - start)"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=args.tree,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return float(out.stdout.splitlines()[-1])
+
+
+def wait_for(client, path: str, deadline: float, process) -> None:
+    import httpx
+
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{path}: the server exited with {process.returncode}")
+        try:
+            response = client.get(path, timeout=1)
+            # revisions before the readiness check only have /health
+            if response.status_code in (200, 404):
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    raise RuntimeError(f"{path} did not report OK in time")
+
+
+def boot(args, env, log):
+    import httpx
+
+    port = free_port()
+    start = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port)],
+        cwd=args.tree,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    marks = {}
+    deadline = start + args.timeout
+    body = {"input": {"messages": [{"role": "user", "content": args.question}]}}
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}") as client:
+            for path in ("/health", "/ready"):
+                wait_for(client, path, deadline, process)
+                marks[path] = time.monotonic() - start
+            for label in ("first request", "second request"):
+                request_start = time.monotonic()
+                response = client.post(
+                    "/chat/invoke", json=body, headers=headers, timeout=args.timeout
+                )
+                response.raise_for_status()
+                marks[label] = time.monotonic() - request_start
+    finally:
+        process.terminate()
+        process.wait()
+    return marks
+
+
+def measure(args):
+    import httpx
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "stub.py"), "w") as file:
+            file.write(STUB.format(delay=args.delay_ms / 1000, dims=args.dims))
+        stub_port = free_port()
+        stub = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "stub:app", "--log-level", "warning"]
+            + ["--port", str(stub_port)],
+            cwd=directory,
+        )
+        key_file = os.path.join(directory, "key.txt")
+        with open(key_file, "w") as file:
+            file.write(TOKEN)
+        env = {
+            **os.environ,
+            "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY") or "stub",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+            "REDIS_URL": args.redis_url,
+            "CHROMA_HOST": args.chroma_host,
+            "CHROMA_PORT": str(args.chroma_port),
+            "KEY_FILE": key_file,
+            "BM25_INDEX_PATH": os.path.join(directory, "bm25"),
+            "BACKEND_CORS_ORIGINS": os.getenv("BACKEND_CORS_ORIGINS") or "*",
+            "LANGCHAIN_TRACING_V2": "false",
+        }
+        env.pop("ENVIRONMENT", None)
+
+        samples = {}
+        log_path = os.path.join(directory, "app.log")
+        try:
+            with httpx.Client(base_url=f"http://127.0.0.1:{stub_port}") as client:
+                wait_for(client, "/v1/models", time.monotonic() + args.timeout, stub)
+            imports = [import_time(args, env) for _ in range(args.runs)]
+            print(f"import app: {summarize(imports)}")
+            for i in range(args.runs):
+                # a cold embedding cache per run, like a new container
+                env["EMBED_CACHE_PATH"] = os.path.join(directory, f"embed-{i}.sqlite")
+                with open(log_path, "w") as log:
+                    try:
+                        marks = boot(args, env, log)
+                    except Exception:
+                        with open(log_path) as file:
+                            print(file.read()[-4000:])
+                        raise
+                for label, seconds in marks.items():
+                    samples.setdefault(label, []).append(seconds)
+        finally:
+            stub.terminate()
+            stub.wait()
+        for label, values in samples.items():
+            start = "" if label.endswith("request") else " from process start"
+            print(f"{label}{start}: {summarize(values)}")
+
+
+def add_arguments(parser):
+    parser.add_argument("--redis-url", default="redis://localhost:6379")
+    parser.add_argument("--chroma-host", default="localhost")
+    parser.add_argument("--chroma-port", type=int, default=8000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--delay-ms", type=float, default=50, help="stub response time")
+    parser.add_argument(
+        "--dims", type=int, default=1536, help="size of the collection's vectors"
+    )
+    parser.add_argument(
+        "--question", default="What is the latest consumer price index?"
+    )
+    parser.add_argument("--timeout", type=float, default=120)
+
+
+if __name__ == "__main__":
+    run(measure, __doc__, add_arguments)
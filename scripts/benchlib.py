@@ -0,0 +1,199 @@
+"""Shared helpers for the bench_*.py scripts.
+
+Every script measures the code under src/assistant. With --baseline REV it
+first exports that revision with git archive and runs the same measurement
+against it in a subprocess, so before and after numbers come from one
+command, e.g.
+
+    python scripts/bench_dc_meta.py --baseline HEAD~1
+
+Outputs are summarised with digest() so the two runs can be compared.
+"""
+
+import os
+import sys
+import json
+import socket
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIR = os.path.join(REPO_ROOT, "src", "assistant")
+
+
+def export_tree(rev: str) -> str:
+    """Extract src/assistant at rev into a temporary directory"""
+    target = tempfile.mkdtemp(prefix="bench-")
+    archive = subprocess.run(
+        ["git", "archive", rev, "src/assistant"],
+        cwd=REPO_ROOT,
+        check=True,
+        capture_output=True,
+    ).stdout
+    subprocess.run(["tar", "-x", "-C", target], input=archive, check=True)
+    return os.path.join(target, "src", "assistant")
+
+
+def digest(value) -> str:
+    """Short stable hash of a JSON-serialisable value"""
+    encoded = json.dumps(value, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()[:12]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """p50/p99/mean of samples given in seconds, in milliseconds"""
+    ordered = sorted(samples)
+    return {
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p99_ms": round(
+            ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3
+        ),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+    }
+
+
+def free_port() -> int:
+    """A port nothing listens on, for a server started by the script"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _RangeHandler(SimpleHTTPRequestHandler):
+    """Static files with single byte-range support, counting bytes sent"""
+
+    # keep-alive, so clients with a pool reuse their connections
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        self.range = None
+        header = self.headers.get("Range", "")
+        path = self.translate_path(self.path)
+        if not header.startswith("bytes=") or not os.path.isfile(path):
+            return super().send_head()
+        size = os.path.getsize(path)
+        start, _, end = header[len("bytes=") :].partition("-")
+        start, end = int(start), min(int(end or size - 1), size - 1)
+        file = open(path, "rb")
+        file.seek(start)
+        self.send_response(206)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.range = end - start + 1
+        return file
+
+    def end_headers(self):
+        self.send_header("Accept-Ranges", "bytes")
+        super().end_headers()
+
+    def copyfile(self, source, outputfile):
+        data = source.read(self.range) if self.range is not None else source.read()
+        self.server.bytes_sent += len(data)
+        outputfile.write(data)
+
+
+class FileServer:
+    """Serves a directory with range requests from a child process.
+
+    A server in the benchmark process would compete with the code under test
+    for the GIL. bytes_sent counts body bytes served, and is set by shutdown.
+    """
+
+    def __init__(self, directory: str):
+        self._process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "serve", directory],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        port = int(self._process.stdout.readline())
+        self.url = f"http://127.0.0.1:{port}"
+        self.bytes_sent = None
+
+    def shutdown(self) -> None:
+        # the child exits once its stdin closes, reporting the bytes it sent
+        out, _ = self._process.communicate()
+        self.bytes_sent = int(out)
+
+
+def serve_directory(directory: str) -> FileServer:
+    return FileServer(directory)
+
+
+def _serve(directory: str) -> None:
+    def handler(*args, **kwargs):
+        return _RangeHandler(*args, directory=directory, **kwargs)
+
+    # the default backlog of 5 drops concurrent connects into 1s retries
+    ThreadingHTTPServer.request_queue_size = 128
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.bytes_sent = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(server.server_address[1], flush=True)
+    sys.stdin.read()
+    server.shutdown()
+    print(server.bytes_sent, flush=True)
+
+
+def _without_baseline(argv: List[str]) -> List[str]:
+    rest, skip = [], False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == "--baseline":
+            skip = True
+        elif not arg.startswith("--baseline="):
+            rest.append(arg)
+    return rest
+
+
+def run(
+    measure: Callable[[argparse.Namespace], None],
+    description: str,
+    add_arguments: Optional[Callable[[argparse.ArgumentParser], None]] = None,
+    prepare_baseline: Optional[Callable[[str], None]] = None,
+) -> None:
+    """Parse arguments, run the baseline if asked, then measure this tree.
+
+    prepare_baseline gets the exported tree before it runs, for scripts that
+    need to patch around an incompatibility of an old revision.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--baseline", help="git revision to compare against")
+    parser.add_argument("--tree", default=SOURCE_DIR, help=argparse.SUPPRESS)
+    if add_arguments is not None:
+        add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.baseline:
+        tree = export_tree(args.baseline)
+        if prepare_baseline is not None:
+            prepare_baseline(tree)
+        print(f"== baseline {args.baseline}", flush=True)
+        try:
+            subprocess.run(
+                [sys.executable, sys.argv[0], *_without_baseline(sys.argv[1:])]
+                + ["--tree", tree],
+                check=True,
+            )
+        finally:
+            shutil.rmtree(os.path.dirname(os.path.dirname(tree)))
+        print("== current", flush=True)
+
+    sys.path.insert(0, args.tree)
+    measure(args)
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ["serve"]:
+    _serve(sys.argv[2])
@@ -1,5 +1,6 @@
-from fastapi import Depends, FastAPI, status
-from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Response, status
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager, suppress
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security.api_key import APIKey
 from fastapi_cache import FastAPICache
@@ -10,16 +11,21 @@ from redis import asyncio as aioredis
 from langserve import add_routes
 from langserve.schema import CustomUserType
 
-from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 
 from dotenv import load_dotenv
+import asyncio
+import json
 import logging
 import os
+import time
 
-from auth import APIKeyManager, get_token, get_master_token, key_manager
+from auth import APIKeyManager, get_token, get_master_token, key_manager, token_holder
 from schema import (
     ChatRequest,
+    ChatInput,
     GenerateMetaRequest,
+    GenerateMetaBatchRequest,
     HealthCheck,
     TokenUpdate,
     TokenUpdateResponse,
@@ -28,18 +34,38 @@ from schema import (
     GenerateMetaResponse,
     DatasetMetadata,
 )
-from chain import create_new_chain
-from generate_meta import build_generate_meta_graph, build_translation_keys
+
+# chains, clients and their heavy imports are built by the lifespan
+from startup import Services, build_services, warm_up
+from utils.index_version import aget_index_version, get_redis_url, watch_index_version
+from utils.executors import (
+    IO,
+    get_executor,
+    monitor_loop_lag,
+    run_io,
+    shutdown_executors,
+)
 
 load_dotenv()
 
 # maximum history of messages for memory
 MAX_MESSAGES = 5
+# graph runs in flight per batch request, and items per batch request
+DEFAULT_META_CONCURRENCY = 4
+DEFAULT_META_BATCH = 50
+DEFAULT_WARMUP_TIMEOUT = 60
+STARTUP_RETRY_SECONDS = 10
+
+logger = logging.getLogger(__name__)
 
 
 class EndpointFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
-        return record.args and len(record.args) >= 3 and record.args[2] != "/health"
+        return (
+            record.args
+            and len(record.args) >= 3
+            and record.args[2] not in ("/health", "/ready")
+        )
 
 
 logging.getLogger("uvicorn.access").addFilter(EndpointFilter())
@@ -50,14 +76,88 @@ class NewChatReqest(CustomUserType):
     messages: list
 
 
+async def degraded(step: str, awaitable) -> None:
+    """Await an optional startup step, logging a failure instead of raising"""
+    try:
+        await awaitable
+    except Exception as e:
+        logger.warning(f"{step} failed, serving degraded: {e!r}")
+
+
+async def cancel(task: asyncio.Task) -> None:
+    """Cancel a background task and wait until it has stopped"""
+    task.cancel()
+    with suppress(asyncio.CancelledError):
+        await task
+
+
+async def start_services(app: FastAPI, redis) -> None:
+    """Build the chains, sync the local indexes and warm up, then mark the
+    worker ready. Building is retried until it succeeds; /health answers
+    meanwhile. A failed index sync or warm-up leaves the worker ready but
+    degraded: requests fall back to chroma and the index watcher retries."""
+    start = time.perf_counter()
+    while app.state.services is None:
+        try:
+            app.state.services = await run_io(build_services, MAX_MESSAGES)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f"Startup failed, retrying in {STARTUP_RETRY_SECONDS}s")
+            await asyncio.sleep(STARTUP_RETRY_SECONDS)
+    services = app.state.services
+    listeners = [services.lexical_index.refresh]
+    if services.collection_mirror is not None:
+        listeners.append(services.collection_mirror.refresh)
+
+    # requests would fall back to chroma until the mirror is synced
+    synced = time.perf_counter()
+    try:
+        version = await aget_index_version(redis)
+    except Exception as e:
+        logger.warning(f"Reading the index version failed, serving degraded: {e!r}")
+    else:
+        for listener in listeners:
+            await degraded(listener.__qualname__, listener(version))
+    services.timings["indexes"] = time.perf_counter() - synced
+    if (os.getenv("WARMUP_ENABLED") or "1") == "1":
+        timeout = float(os.getenv("WARMUP_TIMEOUT") or DEFAULT_WARMUP_TIMEOUT)
+        await degraded("Warm-up", asyncio.wait_for(warm_up(services), timeout))
+
+    app.state.watch_task = asyncio.create_task(watch_index_version(redis, listeners))
+    app.state.ready = True
+    logger.info(
+        f"Ready in {time.perf_counter() - start:.2f}s: "
+        + ", ".join(f"{k} {v:.2f}s" for k, v in services.timings.items())
+    )
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    redis = await aioredis.from_url("redis://host.docker.internal:6381")
+    # library calls that fall back to the loop's executor share the io pool
+    asyncio.get_running_loop().set_default_executor(get_executor(IO))
+    lag_task = asyncio.create_task(monitor_loop_lag())
+    redis = await aioredis.from_url(get_redis_url())
     FastAPICache.init(RedisBackend(redis), prefix="")
+    token_task = asyncio.create_task(token_holder.watch(redis))
+    startup_task = asyncio.create_task(start_services(app, redis))
     yield
+    # wait for the tasks to stop so none is mid-call when the clients close,
+    # startup goes first as it is what creates the watch task
+    await cancel(startup_task)
+    if app.state.watch_task is not None:
+        await cancel(app.state.watch_task)
+    await cancel(token_task)
+    await cancel(lag_task)
+    if app.state.services is not None:
+        await app.state.services.clients.aclose()
+    shutdown_executors()
 
 
 app = FastAPI(lifespan=lifespan)
+app.state.services = None
+app.state.ready = False
+app.state.watch_task = None
 app.add_middleware(
     CORSMiddleware,
     allow_origins=os.getenv("BACKEND_CORS_ORIGINS"),
@@ -66,25 +166,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-rag_chain = create_new_chain()
-generate_meta_graph = build_generate_meta_graph()
+
+def get_services() -> Services:
+    """Chains and clients for a request, 503 until the worker is warmed up"""
+    if not app.state.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service is starting",
+        )
+    return app.state.services
+
+
+async def rag_chain(inputs):
+    # routes are registered at import, the chain only exists after startup
+    return app.state.services.rag_chain
+
 
 add_routes(
     app,
-    rag_chain,
+    RunnableLambda(rag_chain).with_types(input_type=ChatInput, output_type=str),
     path="/chat",
-    dependencies=[Depends(get_token)],
+    dependencies=[Depends(get_token), Depends(get_services)],
 )
 
 
 @app.post("/generate-meta", response_model=GenerateMetaResponse)
-async def generate_meta(payload: GenerateMetaRequest):
-    config = RunnableConfig(
+async def generate_meta(
+    payload: GenerateMetaRequest,
+    response: Response,
+    services: Services = Depends(get_services),
+):
+    input_data = payload.input_data
+    meta_cache = services.meta_cache
+    cache_key = None
+    if meta_cache is not None:
+        cache_key, cached = await meta_cache.lookup(input_data, payload.bypass_cache)
+        if cached is not None:
+            response.headers["X-Cache"] = "HIT"
+            return cached
+
+    res = await services.generate_meta_graph.ainvoke(
+        {"input_data": input_data}, config=generate_meta_config()
+    )
+    result = build_meta_response(res["answer"])
+    if cache_key is not None:
+        await meta_cache.store(cache_key, result)
+        response.headers["X-Cache"] = "MISS"
+    return result
+
+
+def generate_meta_config() -> RunnableConfig:
+    return RunnableConfig(
         metadata={"langsmith_project": os.getenv("LANGCHAIN_PROJECT_GENMETA")},
     )
-    input_data = payload.input_data
-    res = await generate_meta_graph.ainvoke({"input_data": input_data}, config=config)
-    dataset_meta = res["answer"]
+
+
+def build_meta_response(dataset_meta: DatasetMetadata) -> GenerateMetaResponse:
+    from generate_meta import build_translation_keys
+
     # post process - build translation keys
     trans_en, trans_ms = build_translation_keys(dataset_meta)
     dataset_meta.translations_en = trans_en
@@ -94,11 +233,109 @@ async def generate_meta(payload: GenerateMetaRequest):
     )
 
 
+# a batch fans out to many gpt-4o calls, so it takes the chat bearer token
+@app.post("/generate-meta/batch", dependencies=[Depends(get_token)])
+async def generate_meta_batch(
+    payload: GenerateMetaBatchRequest, services: Services = Depends(get_services)
+):
+    """Generate metadata for several datasets, streamed back as NDJSON.
+
+    Each line is {"index": i, "metadata": ...} or {"index": i, "error": ...}
+    in completion order, a failed item doesn't fail the batch. The last line
+    summarizes the batch and its throughput.
+    """
+    from generate_meta import agenerate_meta_batch
+
+    items = payload.items
+    meta_cache = services.meta_cache
+    max_batch = int(os.getenv("GENERATE_META_MAX_BATCH") or DEFAULT_META_BATCH)
+    if len(items) > max_batch:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"At most {max_batch} items per batch",
+        )
+    max_concurrency = int(
+        os.getenv("GENERATE_META_MAX_CONCURRENCY") or DEFAULT_META_CONCURRENCY
+    )
+    if payload.max_concurrency:
+        max_concurrency = max(1, min(payload.max_concurrency, max_concurrency))
+
+    async def lines():
+        start = time.perf_counter()
+        succeeded = failed = cached = 0
+        cache_keys = [None] * len(items)
+        pending = list(range(len(items)))
+        if meta_cache is not None:
+            lookups = await asyncio.gather(
+                *(meta_cache.lookup(item, payload.bypass_cache) for item in items)
+            )
+            pending = []
+            for index, (cache_key, hit) in enumerate(lookups):
+                if hit is not None:
+                    cached += 1
+                    line = {"index": index, **hit.model_dump(mode="json")}
+                    yield json.dumps(line) + "\n"
+                else:
+                    cache_keys[index] = cache_key
+                    pending.append(index)
+
+        if pending:
+            results = agenerate_meta_batch(
+                services.generate_meta_graph,
+                services.clients.embeddings(),
+                [items[index] for index in pending],
+                max_concurrency,
+                config=generate_meta_config(),
+            )
+            async for position, output in results:
+                index = pending[position]
+                if isinstance(output, Exception):
+                    failed += 1
+                    logger.warning(f"Generate-meta batch item {index} failed: {output}")
+                    line = {"index": index, "error": str(output) or repr(output)}
+                else:
+                    succeeded += 1
+                    result = build_meta_response(output)
+                    if cache_keys[index] is not None:
+                        await meta_cache.store(cache_keys[index], result)
+                    line = {"index": index, **result.model_dump(mode="json")}
+                yield json.dumps(line) + "\n"
+
+        seconds = time.perf_counter() - start
+        summary = {
+            "items": len(items),
+            "succeeded": succeeded + cached,
+            "failed": failed,
+            "cached": cached,
+            "seconds": round(seconds, 3),
+            "items_per_minute": round(len(items) / seconds * 60, 1)
+            if seconds
+            else None,
+        }
+        logger.info(f"Generate-meta batch: {summary}")
+        yield json.dumps({"summary": summary}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @app.get("/health", response_model=HealthCheck)
 def get_health():
     return HealthCheck(status="OK")
 
 
+@app.get(
+    "/ready",
+    summary="Readiness check for ELB, OK once the worker is warmed up",
+    response_description="Return HTTP Status Code 200 (OK), 503 while starting",
+    response_model=HealthCheck,
+)
+def get_ready(response: Response):
+    if not app.state.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return HealthCheck(status="STARTING")
+    return HealthCheck(status="OK")
+
+
 @app.post(
     "/auth-token",
     response_model=TokenUpdateResponse,
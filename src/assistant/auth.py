@@ -1,7 +1,13 @@
 from cryptography.fernet import Fernet
 import os
+import time
+import uuid
+import asyncio
+import logging
+from typing import Optional
 
 from utils.cache import cache
+from utils.executors import run_io
 
 from fastapi import Depends, status, HTTPException
 from fastapi.security.http import HTTPAuthorizationCredentials, HTTPBearer
@@ -9,6 +15,17 @@ from fastapi_cache import FastAPICache
 
 get_bearer_token = HTTPBearer(auto_error=False)
 
+# workers re-read the token when it is published here
+TOKEN_CHANNEL = "auth:token"
+# bounds how stale a worker can be if it misses an update
+DEFAULT_TOKEN_TTL = 300
+RECONNECT_SECONDS = 5
+# identifies this worker's own updates on the channel, pids repeat across
+# containers
+PUBLISHER_ID = uuid.uuid4().hex
+
+logger = logging.getLogger(__name__)
+
 
 class APIKeyManager:
     def __init__(self, key_file_path, encryption_key):
@@ -25,12 +42,17 @@ class APIKeyManager:
         decrypted_key = fernet.decrypt(encrypted_key).decode()
         return decrypted_key
 
-    async def update_key(self, api_key):
+    def write_key(self, api_key):
         # encrypted_key = self.encrypt_key(api_key)
         with open(self.key_file_path, "w") as file:
             file.write(api_key)
+
+    async def update_key(self, api_key):
+        await run_io(self.write_key, api_key)
         # invalidate cache
         await FastAPICache.clear(namespace="token")
+        token_holder.set(api_key)
+        await token_holder.publish()
 
     def get_key(self):
         if os.getenv("ENVIRONMENT") == "dev":
@@ -51,7 +73,86 @@ key_manager = APIKeyManager(
 
 @cache(namespace="token")
 async def retrieve_token() -> str:
-    return key_manager.get_key()
+    return await run_io(key_manager.get_key)
+
+
+class TokenHolder:
+    """Keeps the chat API token in memory so checking it needs no I/O.
+
+    The token is loaded through retrieve_token (redis, then the key file)
+    on first use and again once it is older than AUTH_TOKEN_TTL. Workers
+    share updates over redis pub/sub: update_key sets the token on the
+    worker that received it and publishes, every other worker drops its
+    copy and reloads on the next request.
+    """
+
+    def __init__(self, ttl: Optional[int] = None):
+        self.ttl = ttl or int(os.getenv("AUTH_TOKEN_TTL") or DEFAULT_TOKEN_TTL)
+        self._token: Optional[str] = None
+        self._expires = 0.0
+        self._lock = asyncio.Lock()
+        self._redis = None
+
+    def current(self) -> Optional[str]:
+        """The held token, None if it needs loading"""
+        if time.monotonic() < self._expires:
+            return self._token
+        return None
+
+    def set(self, token: Optional[str]) -> None:
+        self._token = token
+        # a missing key file is not held, so the next request retries it
+        self._expires = time.monotonic() + self.ttl if token else 0.0
+
+    def invalidate(self) -> None:
+        self._expires = 0.0
+
+    async def get(self) -> Optional[str]:
+        token = self.current()
+        if token is not None:
+            return token
+        async with self._lock:
+            # another request may have loaded it while this one waited
+            if (token := self.current()) is None:
+                token = await retrieve_token()
+                self.set(token)
+        return token
+
+    async def publish(self) -> None:
+        if self._redis is None:
+            return
+        try:
+            await self._redis.publish(TOKEN_CHANNEL, PUBLISHER_ID)
+        except Exception as e:
+            logger.warning(f"Token update publish failed: {e}")
+
+    async def watch(self, redis) -> None:
+        """Invalidate the held token whenever a worker publishes an update, forever.
+
+        The token is also invalidated whenever the subscription drops, since
+        updates may have been missed while it was down.
+        """
+        self._redis = redis
+        while True:
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(TOKEN_CHANNEL)
+                    async for message in pubsub.listen():
+                        # this worker already holds the token it published
+                        if (
+                            message["type"] == "message"
+                            and message["data"] != PUBLISHER_ID.encode()
+                        ):
+                            self.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Token update subscription failed: {e}")
+            self.invalidate()
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+
+token_holder = TokenHolder()
 
 
 async def get_master_token(
@@ -70,7 +171,7 @@ async def get_token(
     auth: HTTPAuthorizationCredentials = Depends(get_bearer_token),
 ) -> str:
     """Get API token for chat endpoint."""
-    saved_token = await retrieve_token()
+    saved_token = await token_holder.get()
     if auth is None or (token := auth.credentials) != saved_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
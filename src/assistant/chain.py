@@ -1,11 +1,11 @@
 import json
 import os
+import time
+import asyncio
+import logging
 from typing import Any, Dict, List, Optional
 
-import chromadb
-from chromadb.config import Settings
-from langchain_openai.chat_models import ChatOpenAI
-from langchain_openai.embeddings import OpenAIEmbeddings
+import numpy as np
 from langchain_core.prompts import PromptTemplate
 from langchain_core.prompts.chat import (
     ChatPromptTemplate,
@@ -15,13 +15,15 @@ from langchain_core.prompts.chat import (
 )
 from langchain.docstore.document import Document
 from langchain_core.retrievers import BaseRetriever
-from langchain.retrievers import EnsembleRetriever
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.vectorstores import VectorStore
 from langchain_core.runnables import (
+    RunnableBranch,
+    RunnableLambda,
     RunnablePassthrough,
     RunnableParallel,
 )
+from langchain_core.runnables.config import get_executor_for_config
 from langchain_core.messages import AIMessage, HumanMessage
 from langchain_chroma import Chroma
 
@@ -34,11 +36,69 @@ from prompts import (
     QUERY_REWRITE_PROMPT,
 )
 from schema import *
-from utils.templates import CATALOGUE_ID_TEMPLATE, CATALOGUE_ID_NOAPI_TEMPLATE
+from utils.templates import (
+    CATALOGUE_ID_TEMPLATE,
+    CATALOGUE_ID_NOAPI_TEMPLATE,
+    render_cache,
+)
+from utils.timing import pipeline_timing
+from utils.executors import run_io
+from utils.context import ContextBuilder, count_tokens, trim_history
+from utils.ranking import fuse, pad_candidates, rrf
+from utils.bm25 import BM25Index, tokenize
+from semantic_cache import SemanticCache
+from mirror import CollectionMirror, query_collection
+from router import TurnRouter
+from clients import ClientRegistry
+
+# retriever defaults, match Chroma's max_marginal_relevance_search
+DEFAULT_K = 4
+DEFAULT_FETCH_K = 20
+DEFAULT_LAMBDA_MULT = 0.5
+# share of the RRF weight given to BM25 rankings, at an even split the top
+# lexical and vector hits interleave
+DEFAULT_LEXICAL_WEIGHT = 0.5
+# "parallel" retrieves for the raw message while it is rewritten, "pipelined"
+# also retrieves for the rewrite when it differs from the raw message
+DEFAULT_RETRIEVAL_MODE = "parallel"
+# token jaccard at or above which a rewrite is treated as the same question
+DEFAULT_REWRITE_OVERLAP = 0.6
+
+logger = logging.getLogger(__name__)
+
+
+def rewrite_differs(query: str, rewritten: str, threshold: float) -> bool:
+    """Whether a rewrite changes the question enough to retrieve for it"""
+    original, new = set(tokenize(query)), set(tokenize(rewritten))
+    if not new or new == original:
+        return False
+    return len(original & new) / len(original | new) < threshold
+
+
+def merge_rankings(rankings: List[List[Document]]) -> List[Document]:
+    """RRF over ranked document lists, ties going to the earlier list"""
+    ids, docs = {}, []
+    id_rankings = []
+    for ranking in rankings:
+        id_ranking = []
+        for doc in ranking:
+            key = doc.id or doc.page_content
+            if key not in ids:
+                ids[key] = len(docs)
+                docs.append(doc)
+            id_ranking.append(ids[key])
+        id_rankings.append(id_ranking)
+    return [docs[i] for i in rrf(id_rankings)]
 
 
 class DocsRetriever(BaseRetriever):
-    vectorstore: VectorStore
+    vectorstore: Chroma
+    k: int = DEFAULT_K
+    fetch_k: int = DEFAULT_FETCH_K
+    lambda_mult: float = DEFAULT_LAMBDA_MULT
+    mirror: Optional[CollectionMirror] = None
+    lexical: Optional[BM25Index] = None
+    lexical_weight: float = DEFAULT_LEXICAL_WEIGHT
 
     class Config:
         arbitrary_types_allowed = True
@@ -48,114 +108,178 @@ class DocsRetriever(BaseRetriever):
         metadata = doc.metadata
         # if dc_meta source, inject catalogue name and id into open API guide
         if "dc_meta" in doc.metadata["source"]:
-            dc_meta = json.loads(metadata["header"])
-            if dc_meta["exclude_openapi"]:
-                template = CATALOGUE_ID_NOAPI_TEMPLATE
-            else:
-                template = CATALOGUE_ID_TEMPLATE
-            page_content = template.format(
-                subcategory=dc_meta["subcategory"],
-                category=dc_meta["category"],
-                id=dc_meta["id"],
-                description=dc_meta["description"],
-                data_methodology=dc_meta["data_methodology"],
-                update_frequency=dc_meta["update_frequency"],
-                # data_source=dc_meta["data_source"],
-                data_caveat=dc_meta["data_caveat"],
-            )
-            return page_content
+            if doc.id is None:
+                return self.render_dc_meta(doc)
+            return render_cache.get(("docs", doc.id), lambda: self.render_dc_meta(doc))
         else:
             return doc.page_content + "\n\nSource: " + metadata["source"]
 
+    @staticmethod
+    def render_dc_meta(doc) -> str:
+        dc_meta = json.loads(doc.metadata["header"])
+        if dc_meta["exclude_openapi"]:
+            template = CATALOGUE_ID_NOAPI_TEMPLATE
+        else:
+            template = CATALOGUE_ID_TEMPLATE
+        return template.format(
+            subcategory=dc_meta["subcategory"],
+            category=dc_meta["category"],
+            id=dc_meta["id"],
+            description=dc_meta["description"],
+            data_methodology=dc_meta["data_methodology"],
+            update_frequency=dc_meta["update_frequency"],
+            # data_source=dc_meta["data_source"],
+            data_caveat=dc_meta["data_caveat"],
+        )
+
+    def _fuse(self, queries, query_embeddings, results) -> List[Document]:
+        """MMR per query and RRF across queries over one batched query result,
+        plus BM25 rankings of the same queries when a lexical index is loaded"""
+        # chroma ids to dense integer ids for the ranking arrays
+        ids, docs = {}, []
+
+        def dense_id(chroma_id, text, metadata):
+            if chroma_id not in ids:
+                ids[chroma_id] = len(docs)
+                docs.append(
+                    Document(page_content=text, metadata=metadata or {}, id=chroma_id)
+                )
+            return ids[chroma_id]
+
+        candidate_ids = [
+            [dense_id(*record) for record in zip(*row)]
+            for row in zip(results["ids"], results["documents"], results["metadatas"])
+        ]
+
+        weights, lexical = None, []
+        if self.lexical is not None and self.lexical.loaded:
+            for query in queries:
+                hits = self.lexical.search(query, self.k)
+                lexical.append([dense_id(*self.lexical.get(i)) for i in hits])
+            # vector and lexical lists split the weight, evenly within each side
+            weights = [(1 - self.lexical_weight) / len(queries)] * len(queries)
+            weights += [self.lexical_weight / len(queries)] * len(queries)
+
+        candidates, valid = pad_candidates(results["embeddings"])
+        padded_ids = np.full(valid.shape, -1, dtype=np.int64)
+        for i, row in enumerate(candidate_ids):
+            padded_ids[i, : len(row)] = row
+        ranked = fuse(
+            np.asarray(query_embeddings, dtype=np.float32),
+            candidates,
+            padded_ids,
+            valid,
+            k=self.k,
+            lambda_mult=self.lambda_mult,
+            weights=weights,
+            extra=lexical,
+        )
+        # rendered into context by ContextBuilder, which also merges overlaps
+        return [docs[i] for i in ranked]
+
+    def _query(self, query_embeddings):
+        return query_collection(
+            self.vectorstore, query_embeddings, self.fetch_k, mirror=self.mirror
+        )
+
+    def fused_relevant_documents(self, queries: List[str]) -> List[Document]:
+        """Retrieve for several queries with one embedding call and one query,
+        returning a single fused ranking"""
+        embeddings = self.vectorstore.embeddings.embed_documents(queries)
+        return self._fuse(queries, embeddings, self._query(embeddings))
+
+    async def afused_relevant_documents(self, queries: List[str]) -> List[Document]:
+        embeddings = await self.vectorstore.embeddings.aembed_documents(queries)
+        # the chroma http client is sync and waits on the network, a mirror
+        # search is short and FAISS releases the GIL while it runs
+        results = await run_io(self._query, embeddings)
+        return self._fuse(queries, embeddings, results)
+
     def _get_relevant_documents(self, query):
-        docs = []
-        for doc in self.vectorstore.max_marginal_relevance_search(query, k=4):
-            content = self.get_page_content(doc)
-            docs.append(Document(page_content=content, metadata=doc.metadata))
-        return docs
+        return self.fused_relevant_documents([query])
 
     async def _aget_relevant_documents(self, query) -> List[Document]:
-        docs_similar = await self.vectorstore.amax_marginal_relevance_search(query, k=4)
-        docs = []
-        for doc in docs_similar:
-            content = self.get_page_content(doc)
-            docs.append(Document(page_content=content, metadata=doc.metadata))
-        return docs
+        return await self.afused_relevant_documents([query])
 
 
-def create_new_chain():
-    embedding_llm = OpenAIEmbeddings(model="text-embedding-3-small")
+def create_new_chain(
+    clients: Optional[ClientRegistry] = None,
+    mirror: Optional[CollectionMirror] = None,
+    lexical: Optional[BM25Index] = None,
+    max_messages: Optional[int] = None,
+    semantic_cache: Optional[bool] = None,
+):
+    """Build the chat chain. semantic_cache defaults to CHAT_CACHE_ENABLED."""
+    clients = clients or ClientRegistry()
+    embedding_llm = clients.embeddings()
 
-    llm = ChatOpenAI(
-        model="gpt-4.1",
+    llm = clients.chat_model(
+        "gpt-4.1",
         temperature=0,
         streaming=True,
         verbose=True,
     )
+    # query expansion and rewrite share one client
+    mini_llm = clients.chat_model("gpt-4.1-mini", temperature=0.7)
 
-    # init retriever
-    client = chromadb.HttpClient(
-        host=os.getenv("CHROMA_HOST"),
-        port=os.getenv("CHROMA_PORT"),
-        settings=Settings(),
-    )
+    db = clients.vectorstore()
 
-    db = Chroma(
-        client=client,
-        collection_name="dgmy_docs",
-        embedding_function=embedding_llm,
+    custom_docs_retriever = DocsRetriever(
+        vectorstore=db,
+        k=int(os.getenv("RETRIEVER_K") or DEFAULT_K),
+        fetch_k=int(os.getenv("RETRIEVER_FETCH_K") or DEFAULT_FETCH_K),
+        lambda_mult=float(os.getenv("RETRIEVER_LAMBDA_MULT") or DEFAULT_LAMBDA_MULT),
+        mirror=mirror,
+        lexical=lexical,
+        lexical_weight=float(os.getenv("BM25_WEIGHT") or DEFAULT_LEXICAL_WEIGHT),
     )
 
-    custom_docs_retriever = DocsRetriever(vectorstore=db)
-
     query_expand_prompt = ChatPromptTemplate.from_template(QUERY_EXPAND_PROMPT)
 
     generate_queries = (
         RunnablePassthrough()
         | query_expand_prompt
-        | ChatOpenAI(model="gpt-4.1-mini", temperature=0.7)
+        | mini_llm
         | StrOutputParser()
         | (lambda x: x.split("\n"))
         | (lambda x: [q for q in x if q.strip()])  # remove empty strings
     ).with_config({"run_name": "QueryExpand"})
 
-    ensemble_retriever_obj = EnsembleRetriever(
-        retrievers=[custom_docs_retriever], weights=[0.33, 0.33, 0.33]
-    )
-
-    def apply_rrf(docs: List[List[Document]]):
-        num_expected_lists = len(ensemble_retriever_obj.weights)
+    context_builder = ContextBuilder(render=custom_docs_retriever.get_page_content)
 
-        processed_docs = list(docs)
-        current_num_lists = len(processed_docs)
+    def format_context(docs: List[Document]) -> str:
+        return context_builder.build(docs)
 
-        if current_num_lists < num_expected_lists:
-            # pad with empty lists if fewer lists are provided than expected
-            processed_docs.extend(
-                [[] for _ in range(num_expected_lists - current_num_lists)]
-            )
-        elif current_num_lists > num_expected_lists:
-            # truncate if more lists are provided than expected
-            processed_docs = processed_docs[:num_expected_lists]
+    # embed and search the original plus expanded queries in one round-trip
+    # each, then fuse MMR and RRF over all of them in one ranking stage
+    def retrieve_all(inputs: Dict) -> List[Document]:
+        queries = [inputs["query"], *inputs["queries"]]
+        return custom_docs_retriever.fused_relevant_documents(queries)
 
-        # if all document lists are empty, return an empty string
-        if not processed_docs or not any(processed_docs):
-            return ""
+    async def aretrieve_all(inputs: Dict) -> List[Document]:
+        queries = [inputs["query"], *inputs["queries"]]
+        return await custom_docs_retriever.afused_relevant_documents(queries)
 
-        ranked_docs = ensemble_retriever_obj.weighted_reciprocal_rank(processed_docs)
-        return "\n\n".join([doc.page_content for doc in ranked_docs])
+    batch_retriever = RunnableLambda(retrieve_all, afunc=aretrieve_all).with_config(
+        {"run_name": "BatchRetriever"}
+    )
 
     retrieval_chain = (
         {"query": RunnablePassthrough()}
-        | generate_queries
+        | RunnablePassthrough.assign(queries=generate_queries)
         | RunnableParallel(
             {
-                "queries": RunnablePassthrough(),
-                "context": custom_docs_retriever.map() | apply_rrf,
+                "queries": itemgetter("queries"),
+                "context": batch_retriever | format_context,
             }
         )
     ).with_config({"run_name": "RetrievalChain"})
 
+    # the raw message plus its expansions, for the pipelined mode
+    expanded_retriever = (
+        RunnablePassthrough.assign(queries=generate_queries) | batch_retriever
+    ).with_config({"run_name": "SpeculativeRetriever"})
+
     multi_query_retriever_chain = (
         itemgetter("query") | retrieval_chain.pick(["context"]) | itemgetter("context")
     ).with_config({"run_name": "MultiQueryRetriever"})
@@ -169,7 +293,10 @@ def create_new_chain():
                 base_messages.append(HumanMessage(message["content"]))
             elif message["role"] == Role.ASSISTANT:
                 base_messages.append(AIMessage(message["content"]))
-        return {"history": base_messages, "query": messages[-1]["content"]}
+        return {
+            "history": trim_history(base_messages, max_messages),
+            "query": messages[-1]["content"],
+        }
 
     chat_prompt = ChatPromptTemplate.from_messages(
         [
@@ -179,7 +306,23 @@ def create_new_chain():
         ]
     )
 
-    qa_chain = chat_prompt | llm | StrOutputParser()
+    answer_llm_chain = chat_prompt | llm | StrOutputParser()
+
+    # token counts of the final prompt go into the answer run's metadata
+    def count_prompt_tokens(inputs: Dict):
+        messages = chat_prompt.format_messages(**inputs)
+        counts = {
+            "prompt_tokens": sum(count_tokens(m.content) for m in messages),
+            "context_tokens": count_tokens(inputs["context"]),
+            "history_tokens": sum(count_tokens(m.content) for m in inputs["history"]),
+        }
+        logger.info(
+            f"Prompt tokens: {counts['prompt_tokens']} "
+            f"(context {counts['context_tokens']}, history {counts['history_tokens']})"
+        )
+        return answer_llm_chain.with_config({"metadata": counts})
+
+    qa_chain = RunnableLambda(count_prompt_tokens).with_config({"run_name": "QA"})
 
     # query rewriting to handle low-context questions
     query_rewrite_prompt = ChatPromptTemplate.from_messages(
@@ -190,21 +333,155 @@ def create_new_chain():
         ]
     )
     query_rewrite_chain = (
-        query_rewrite_prompt
-        | ChatOpenAI(model="gpt-4.1-mini", temperature=0.7)
-        | StrOutputParser()
+        query_rewrite_prompt | mini_llm | StrOutputParser()
     ).with_config({"run_name": "QueryRewrite"})
 
-    rag_chain = (
-        format_messages
-        | RunnableParallel(
-            {
-                "context": multi_query_retriever_chain,
-                "query": query_rewrite_chain,
-                "history": itemgetter("history"),
-            }
+    retrieval_mode = os.getenv("RETRIEVAL_MODE") or DEFAULT_RETRIEVAL_MODE
+    rewrite_overlap = float(os.getenv("REWRITE_OVERLAP") or DEFAULT_REWRITE_OVERLAP)
+
+    # pipelined mode: retrieval for the raw message starts right away, and
+    # once the rewrite is known it gets its own retrieval only if it asks
+    # something else. both rankings are merged with RRF
+    def log_stages(timings: Dict[str, float]) -> None:
+        for label, seconds in timings.items():
+            pipeline_timing.observe(label, seconds)
+        logger.info(
+            "Pipelined retrieval: "
+            + ", ".join(f"{label} {s * 1000:.0f} ms" for label, s in timings.items())
         )
-        | qa_chain
-    ).with_config({"run_name": "RAGChain"})
+
+    def pipelined_output(inputs: Dict, rewritten: str, rankings) -> Dict:
+        return {
+            "context": format_context(merge_rankings(rankings)),
+            "query": rewritten,
+            "history": inputs["history"],
+        }
+
+    def pipelined_context(inputs: Dict, config) -> Dict:
+        start = time.perf_counter()
+        timings = {}
+
+        def timed(label, func, *args):
+            stage_start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                timings[label] = time.perf_counter() - stage_start
+
+        with get_executor_for_config(config) as executor:
+            speculative = executor.submit(
+                timed,
+                "speculative",
+                expanded_retriever.invoke,
+                {"query": inputs["query"]},
+                config,
+            )
+            rewritten = inputs.get("rewritten_query") or timed(
+                "rewrite", query_rewrite_chain.invoke, inputs, config
+            )
+            rankings = []
+            if rewrite_differs(inputs["query"], rewritten, rewrite_overlap):
+                rankings.append(
+                    timed("followup", custom_docs_retriever.invoke, rewritten, config)
+                )
+            rankings.append(speculative.result())
+        timings["total"] = time.perf_counter() - start
+        log_stages(timings)
+        return pipelined_output(inputs, rewritten, rankings)
+
+    async def apipelined_context(inputs: Dict, config) -> Dict:
+        start = time.perf_counter()
+        timings = {}
+
+        async def timed(label, coro):
+            stage_start = time.perf_counter()
+            try:
+                return await coro
+            finally:
+                timings[label] = time.perf_counter() - stage_start
+
+        speculative = asyncio.ensure_future(
+            timed(
+                "speculative",
+                expanded_retriever.ainvoke({"query": inputs["query"]}, config),
+            )
+        )
+        try:
+            rewritten = inputs.get("rewritten_query") or await timed(
+                "rewrite", query_rewrite_chain.ainvoke(inputs, config)
+            )
+            rankings = []
+            if rewrite_differs(inputs["query"], rewritten, rewrite_overlap):
+                rankings.append(
+                    await timed(
+                        "followup", custom_docs_retriever.ainvoke(rewritten, config)
+                    )
+                )
+            rankings.append(await speculative)
+        finally:
+            speculative.cancel()
+        timings["total"] = time.perf_counter() - start
+        log_stages(timings)
+        return pipelined_output(inputs, rewritten, rankings)
+
+    pipelined_retrieval = RunnableLambda(
+        pipelined_context, afunc=apipelined_context
+    ).with_config({"run_name": "PipelinedRetrieval"})
+
+    if semantic_cache is None:
+        semantic_cache = SemanticCache.enabled()
+    if semantic_cache:
+        # the cache matches on the rewritten query, so rewrite before retrieval,
+        # which puts the rewrite latency on every miss (see semantic_cache)
+        if retrieval_mode == "pipelined":
+            answer_chain = pipelined_retrieval | qa_chain
+        else:
+            answer_chain = (
+                RunnableParallel(
+                    {
+                        "context": multi_query_retriever_chain,
+                        "query": itemgetter("rewritten_query"),
+                        "history": itemgetter("history"),
+                    }
+                )
+                | qa_chain
+            )
+        answer_cache = SemanticCache(embedding_llm)
+        retrieval_answer_chain = RunnablePassthrough.assign(
+            rewritten_query=query_rewrite_chain
+        ) | answer_cache.wrap(answer_chain, query_key="rewritten_query")
+    elif retrieval_mode == "pipelined":
+        retrieval_answer_chain = pipelined_retrieval | qa_chain
+    else:
+        retrieval_answer_chain = (
+            RunnableParallel(
+                {
+                    "context": multi_query_retriever_chain,
+                    "query": query_rewrite_chain,
+                    "history": itemgetter("history"),
+                }
+            )
+            | qa_chain
+        )
+
+    if TurnRouter.enabled():
+        # greetings and acknowledgements skip rewrite, expansion and retrieval
+        router = TurnRouter(
+            embedding_llm if (os.getenv("ROUTER_EMBEDDINGS") or "0") == "1" else None
+        )
+        trivial_chain = (
+            RunnablePassthrough.assign(context=lambda _: "") | qa_chain
+        ).with_config({"run_name": "TrivialTurn"})
+        routed_chain = RunnableBranch(
+            (
+                RunnableLambda(router.is_trivial, afunc=router.ais_trivial),
+                trivial_chain,
+            ),
+            retrieval_answer_chain,
+        )
+    else:
+        routed_chain = retrieval_answer_chain
+
+    rag_chain = (format_messages | routed_chain).with_config({"run_name": "RAGChain"})
 
     return rag_chain
@@ -0,0 +1,131 @@
+"""Shared network clients for the api.
+
+The chat and generate-meta chains used to build their own Chroma client,
+embeddings and chat models, each with its own connection pools. The
+registry builds each of them once, with every OpenAI client on the same
+tuned httpx pools, and closes them all on shutdown.
+"""
+
+import os
+import logging
+from importlib.util import find_spec
+from typing import Dict, Optional, Tuple
+
+import chromadb
+import httpx
+import openai
+from chromadb.config import Settings
+from langchain_chroma import Chroma
+from langchain_openai.chat_models import ChatOpenAI
+from langchain_openai.embeddings import OpenAIEmbeddings
+
+from utils.embeddings import EMBEDDING_MODEL, CachedEmbeddings, get_embeddings
+from utils.executors import run_io
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE = 50
+# httpx drops idle connections after 5s, long enough to lose them between
+# requests on a quiet api and pay for a new TLS handshake
+DEFAULT_KEEPALIVE_EXPIRY = 60
+
+logger = logging.getLogger(__name__)
+
+
+class ClientRegistry:
+    """Builds network clients once and shares their connection pools.
+
+    Usage:
+        clients = ClientRegistry()
+        llm = clients.chat_model("gpt-4.1-mini", temperature=0.7)
+        db = clients.vectorstore()
+        ...
+        await clients.aclose()
+    """
+
+    def __init__(
+        self,
+        max_connections: Optional[int] = None,
+        max_keepalive: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        http2: Optional[bool] = None,
+    ):
+        limits = httpx.Limits(
+            max_connections=max_connections
+            or int(os.getenv("HTTP_MAX_CONNECTIONS") or DEFAULT_MAX_CONNECTIONS),
+            max_keepalive_connections=max_keepalive
+            or int(os.getenv("HTTP_MAX_KEEPALIVE") or DEFAULT_MAX_KEEPALIVE),
+            keepalive_expiry=keepalive_expiry
+            or float(os.getenv("HTTP_KEEPALIVE_EXPIRY") or DEFAULT_KEEPALIVE_EXPIRY),
+        )
+        if http2 is None:
+            http2 = (os.getenv("HTTP2_ENABLED") or "1") == "1"
+        if http2 and find_spec("h2") is None:
+            logger.warning("HTTP/2 needs the h2 package, using HTTP/1.1")
+            http2 = False
+        # openai's defaults keep its timeouts and redirect handling
+        self.http_client = openai.DefaultHttpxClient(limits=limits, http2=http2)
+        self.http_async_client = openai.DefaultAsyncHttpxClient(
+            limits=limits, http2=http2
+        )
+        self._chat_models: Dict[Tuple, ChatOpenAI] = {}
+        self._embeddings = None
+        self._chroma = None
+        self._vectorstores: Dict[str, Chroma] = {}
+
+    def chat_model(self, model: str, temperature: float = 0, **kwargs) -> ChatOpenAI:
+        """One ChatOpenAI per distinct configuration"""
+        key = (model, temperature, *sorted(kwargs.items()))
+        if key not in self._chat_models:
+            self._chat_models[key] = ChatOpenAI(
+                model=model,
+                temperature=temperature,
+                http_client=self.http_client,
+                http_async_client=self.http_async_client,
+                **kwargs,
+            )
+        return self._chat_models[key]
+
+    def embeddings(self) -> CachedEmbeddings:
+        if self._embeddings is None:
+            self._embeddings = get_embeddings(
+                underlying=OpenAIEmbeddings(
+                    model=EMBEDDING_MODEL,
+                    http_client=self.http_client,
+                    http_async_client=self.http_async_client,
+                )
+            )
+        return self._embeddings
+
+    def chroma(self) -> chromadb.ClientAPI:
+        # chromadb keeps its own keep-alive session per server
+        if self._chroma is None:
+            self._chroma = chromadb.HttpClient(
+                host=os.getenv("CHROMA_HOST"),
+                port=os.getenv("CHROMA_PORT"),
+                settings=Settings(),
+            )
+        return self._chroma
+
+    def vectorstore(self, collection_name: str = "dgmy_docs") -> Chroma:
+        if collection_name not in self._vectorstores:
+            self._vectorstores[collection_name] = Chroma(
+                client=self.chroma(),
+                collection_name=collection_name,
+                embedding_function=self.embeddings(),
+            )
+        return self._vectorstores[collection_name]
+
+    async def awarm(self) -> None:
+        """Open a connection to Chroma and to the OpenAI api before the first
+        request needs one. Listing models costs no tokens."""
+        await run_io(self.chroma().heartbeat)
+        # the client is only a view on the shared pool, nothing to close
+        openai_client = openai.AsyncOpenAI(http_client=self.http_async_client)
+        await openai_client.models.list()
+
+    async def aclose(self) -> None:
+        await self.http_async_client.aclose()
+        self.http_client.close()
+        if self._chroma is not None:
+            self._chroma.clear_system_cache()
+        logger.info("Closed shared clients")
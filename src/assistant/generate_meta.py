@@ -1,65 +1,116 @@
 import json
-import os
+import logging
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.vectorstores import VectorStore
-from langchain_openai.chat_models import ChatOpenAI
-from langchain_openai.embeddings import OpenAIEmbeddings
 from langchain_core.prompts.chat import ChatPromptTemplate
 from langchain.schema import Document
-import chromadb
 from langchain_chroma import Chroma
 from pydantic import BaseModel, Field
 from langgraph.graph import START, StateGraph
-from typing_extensions import List, TypedDict
-from chromadb.config import Settings
-import pandas as pd
+from typing_extensions import AsyncIterator, List, Optional, Tuple, TypedDict, Union
+import numpy as np
 from prompts import GENERATE_META_PROMPT, GENERATE_META_USER_PROMPT
 from schema import State, OutputState, DatasetMetadata
+from utils.ranking import batch_mmr, pad_candidates
+from utils.templates import DC_META_CONTEXT_TEMPLATE, render_cache
+from utils.timing import context_timing
+from utils.sampling import sample_frame
+from utils.executors import run_cpu, run_io
+from mirror import CollectionMirror, query_collection
+from clients import ClientRegistry
+
+logger = logging.getLogger(__name__)
+
+
+def query_string(input_data: dict) -> str:
+    """Text embedded to find similar datasets"""
+    return f"{input_data['title_en']} {input_data['description_en']}"
 
 
 class DCMetaRetriever(BaseRetriever):
     """Retriever for dataset metadata context"""
 
     vectorstore: VectorStore
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+    mirror: Optional[CollectionMirror] = None
 
     class Config:
         arbitrary_types_allowed = True
 
     def get_page_content(self, doc) -> str:
         """Create page_content to embed into context"""
-        metadata = doc.metadata
-        dc_meta = json.loads(metadata["header"])
-
-        page_content = f"""Dataset: {dc_meta["id"]}
-Description: {dc_meta["description"]}
-Methodology: {dc_meta["data_methodology"]}
-Caveat: {dc_meta["data_caveat"]}
-Data Fields: {dc_meta["col_meta_clean"]}"""
-        return page_content
+        if doc.id is None:
+            return self.render(doc)
+        return render_cache.get(("dc_meta", doc.id), lambda: self.render(doc))
+
+    @staticmethod
+    def render(doc) -> str:
+        dc_meta = json.loads(doc.metadata["header"])
+        return DC_META_CONTEXT_TEMPLATE.format(
+            id=dc_meta["id"],
+            description=dc_meta["description"],
+            data_methodology=dc_meta["data_methodology"],
+            data_caveat=dc_meta["data_caveat"],
+            col_meta_clean=dc_meta["col_meta_clean"],
+        )
 
-    def _get_relevant_documents(self, query):
+    def _select(self, embedding, results) -> List[Document]:
+        """MMR over the candidates, kept in candidate (similarity) order"""
+        candidates, valid = pad_candidates(results["embeddings"])
+        picks = batch_mmr(
+            np.asarray([embedding], dtype=np.float32),
+            candidates,
+            valid,
+            k=self.k,
+            lambda_mult=self.lambda_mult,
+        )[0]
         docs = []
-        for doc in self.vectorstore.max_marginal_relevance_search(
-            query, k=4, filter={"source": "dc_meta"}
-        ):
-            content = self.get_page_content(doc)
-            docs.append(Document(page_content=content, metadata=doc.metadata))
+        with context_timing.measure("dc_meta"):
+            for j in sorted(int(p) for p in picks if p >= 0):
+                doc = Document(
+                    page_content=results["documents"][0][j],
+                    metadata=results["metadatas"][0][j] or {},
+                    id=results["ids"][0][j],
+                )
+                content = self.get_page_content(doc)
+                docs.append(
+                    Document(page_content=content, metadata=doc.metadata, id=doc.id)
+                )
         return docs
 
-    async def _aget_relevant_documents(self, query) -> List[Document]:
-        docs_similar = await self.vectorstore.amax_marginal_relevance_search(
-            query, k=4, filter={"source": "dc_meta"}
+    def _search(self, embedding):
+        return query_collection(
+            self.vectorstore,
+            [embedding],
+            self.fetch_k,
+            where={"source": "dc_meta"},
+            mirror=self.mirror,
         )
-        docs = []
-        for doc in docs_similar:
-            content = self.get_page_content(doc)
-            docs.append(Document(page_content=content, metadata=doc.metadata))
-        return docs
 
+    def _get_relevant_documents(self, query):
+        embedding = self.vectorstore.embeddings.embed_query(query)
+        return self._select(embedding, self._search(embedding))
 
-def build_generate_meta_graph():
-    llm = ChatOpenAI(
-        model="gpt-4o",
+    async def _aget_relevant_documents(self, query) -> List[Document]:
+        embedding = await self.vectorstore.embeddings.aembed_query(query)
+        return await self.aget_by_vector(embedding)
+
+    async def aget_by_vector(self, embedding: List[float]) -> List[Document]:
+        """Retrieve for an already embedded query"""
+        # a chroma query or a short mirror search, both waiting outside the GIL
+        results = await run_io(self._search, embedding)
+        return self._select(embedding, results)
+
+
+def build_generate_meta_graph(
+    clients: Optional[ClientRegistry] = None,
+    mirror: Optional[CollectionMirror] = None,
+):
+    clients = clients or ClientRegistry()
+    llm = clients.chat_model(
+        "gpt-4o",
         temperature=0.5,
         streaming=True,
         verbose=True,
@@ -71,29 +122,21 @@ def build_generate_meta_graph():
         ]
     )
 
-    embedding_llm = OpenAIEmbeddings(model="text-embedding-3-small")
-
-    # init retriever
-    client = chromadb.HttpClient(
-        host=os.getenv("CHROMA_HOST"),
-        port=os.getenv("CHROMA_PORT"),
-        settings=Settings(),
-    )
-
-    db = Chroma(
-        client=client,
-        collection_name="dgmy_docs",
-        embedding_function=embedding_llm,
-    )
-    dc_meta_retriever = DCMetaRetriever(vectorstore=db)
+    db = clients.vectorstore()
+    dc_meta_retriever = DCMetaRetriever(vectorstore=db, mirror=mirror)
 
     async def retrieve(state: State):
         print("retrieve")
         input_data = state["input_data"]
-        query_string = f"{input_data['title_en']} {input_data['description_en']}"
-        retrieved_docs = await dc_meta_retriever.ainvoke(
-            query_string, kwargs={"filter": {"source": "dc_meta"}}
-        )
+        # batch requests embed every query up front
+        if state.get("query_embedding") is not None:
+            retrieved_docs = await dc_meta_retriever.aget_by_vector(
+                state["query_embedding"]
+            )
+        else:
+            retrieved_docs = await dc_meta_retriever.ainvoke(
+                query_string(input_data), kwargs={"filter": {"source": "dc_meta"}}
+            )
         return {"similar_datasets": retrieved_docs}
 
     async def generate(state: State):
@@ -102,14 +145,14 @@ def build_generate_meta_graph():
         similar_datasets = "\n\n".join(
             doc.page_content for doc in state["similar_datasets"]
         )
-        if input_data["link_csv"]:
-            df_sample = pd.read_csv(input_data["link_csv"])
-            sample_rows = df_sample.sample(10).to_markdown()
-        elif input_data["link_parquet"]:
-            df_sample = pd.read_parquet(input_data["link_parquet"])
-            sample_rows = df_sample.sample(10).to_markdown()
-        else:
-            sample_rows = ""
+        # streams only what the sample needs, off the event loop
+        sample = await run_io(
+            sample_frame,
+            input_data.get("link_csv"),
+            input_data.get("link_parquet"),
+            client=clients.http_client,
+        )
+        sample_rows = await run_cpu(sample.to_markdown) if sample is not None else ""
 
         chain = prompt | llm.with_structured_output(DatasetMetadata)
         res = await chain.ainvoke(
@@ -133,6 +176,33 @@ def build_generate_meta_graph():
     return graph
 
 
+async def agenerate_meta_batch(
+    graph,
+    embeddings,
+    items: List[dict],
+    max_concurrency: int,
+    config: Optional[dict] = None,
+) -> AsyncIterator[Tuple[int, Union[DatasetMetadata, Exception]]]:
+    """Run the graph over several inputs, yielding (index, result) as each
+    finishes. Queries are embedded in one call, a failed item yields its
+    exception instead of failing the batch."""
+    try:
+        vectors = await embeddings.aembed_documents([query_string(i) for i in items])
+    except Exception as e:
+        # each item then embeds its own query in the retrieve node
+        logger.warning(f"Batch embedding failed, embedding per item: {e}")
+        vectors = [None] * len(items)
+    inputs = [
+        {"input_data": item, "query_embedding": vector}
+        for item, vector in zip(items, vectors)
+    ]
+    config = {**(config or {}), "max_concurrency": max_concurrency}
+    async for index, output in graph.abatch_as_completed(
+        inputs, config, return_exceptions=True
+    ):
+        yield index, output if isinstance(output, Exception) else output["answer"]
+
+
 def build_translation_keys(dataset_meta: DatasetMetadata):
     trans_en = {}
     trans_ms = {}
@@ -6,127 +6,340 @@ For docs AI:
 3. Combine these two
 4. Dump into record manager as single index
 
-Downside is need to load and parse everything regardless.
+Documents are streamed: loaders yield chunks as files are fetched and parsed,
+and they are embedded and indexed in batches without holding the full set.
+
+Sources are fingerprinted first (git blob SHAs for mdx, content hash for
+parquet) and only those changed since the last successful run are loaded.
 """
 
 import os
+import json
+import time
+import asyncio
 import chromadb
 from chromadb.config import Settings
-import requests
-import pandas as pd
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Set
 from dotenv import load_dotenv
 
 from langchain_chroma import Chroma
 from langchain.indexes import SQLRecordManager, index
 from langchain.docstore.document import Document
-from langchain_openai.embeddings import OpenAIEmbeddings
 
 from loaders import MdxLoader, DashboardMetaLoader, DCMetaLoader
 from utils.helpers import send_telegram
+from utils.fetch import AsyncFetcher
+from utils.embeddings import get_embeddings
+from utils.embed_pipeline import EmbeddingPipeline
+from utils.index_version import bump_index_version, new_index_version
+from utils.bm25 import artifact_version, build_bm25, get_index_path
+from tracker import SourceTracker, fingerprint_file
 
 load_dotenv()
 
 print("GITHUB_REPO", os.getenv("GITHUB_REPO"))
 print("REC_MGR_CONN_STR", os.getenv("REC_MGR_CONN_STR"))
 
+LOCAL_MDX_REPO = "data-gov-my/datagovmy-ai"
+LOCAL_MDX_PATH = "data"
+DC_META_SOURCES = ["DC_META_PARQUET", "DC_METAFIELDS_PARQUET"]
+
 DOCS_MDX_FIELDS = ["header", "source"]
 DASH_META_FIELDS = ["name", "description", "category", "agency", "source"]
 
 
+async def aget_github_mdx(fetcher: AsyncFetcher, repo: str, folder_path: str) -> List:
+    """Get mdx files under folder_path from a single recursive git tree listing.
+
+    Returns:
+        files: list of dicts with path, sha (git blob sha) and download_url
+    """
+    ref = os.getenv("GITHUB_REF") or "HEAD"
+    commit = await fetcher.fetch_json(
+        f"https://api.github.com/repos/{repo}/commits/{ref}"
+    )
+    commit_sha = commit["sha"]
+    tree = await fetcher.fetch_json(
+        f"https://api.github.com/repos/{repo}/git/trees/{commit_sha}?recursive=1"
+    )
+    if tree.get("truncated"):
+        print(f"Warning: git tree listing for {repo} was truncated")
+
+    prefix = folder_path.strip("/") + "/"
+    files = []
+    for item in tree["tree"]:
+        path = item["path"]
+        if (
+            item["type"] == "blob"
+            and path.startswith(prefix)
+            and path.endswith(".en.mdx")
+        ):
+            files.append(
+                {
+                    "path": path,
+                    "sha": item["sha"],
+                    # pinned to the listed commit so the content matches the
+                    # blob sha recorded for it, the http cache keys on the path
+                    "download_url": f"https://raw.githubusercontent.com/{repo}/{commit_sha}/{path}",
+                }
+            )
+    return files
+
+
 def get_github_mdx(repo: str, folder_path: str, token: str) -> List:
-    """Recurisve function to get list of mdx files from git"""
-    api_url = f"https://api.github.com/repos/{repo}/contents/{folder_path}"
-    headers = {"Authorization": f"token {token}"}
-    response = requests.get(api_url, headers=headers)
-    response.raise_for_status()
-
-    contents = response.json()
-
-    # Initialize a list to store file paths
-    file_paths = []
-
-    for item in contents:
-        if item["type"] == "file" and item["name"].endswith(".en.mdx"):
-            file_paths.append(item["download_url"])
-        elif item["type"] == "dir":
-            # Recursively get files from subfolders
-            subfolder_path = f"{folder_path}/{item['name']}"
-            subfolder_files = get_github_mdx(repo, subfolder_path, token)
-            file_paths.extend(subfolder_files)
-
-    return file_paths
-
-
-def load_mdx_docs() -> List:
-    """Load documents for Docs Assistant"""
-    # load mdx files from git
-    mdx_loader = MdxLoader(
-        get_github_mdx(
-            os.getenv("GITHUB_REPO"),
-            os.getenv("GITHUB_PATH"),
-            os.getenv("GITHUB_TOKEN"),
+    """Get list of mdx files from git"""
+
+    async def _list():
+        async with AsyncFetcher(token) as fetcher:
+            return await aget_github_mdx(fetcher, repo, folder_path)
+
+    return asyncio.run(_list())
+
+
+def list_sources(tracker: SourceTracker) -> Dict:
+    """Fingerprint all ingest sources and compare against the last indexed run.
+
+    Returns:
+        plan: dict with per-source fingerprints, changed/unchanged/removed keys
+              and whether this is a full re-index
+    """
+    token = os.getenv("GITHUB_TOKEN")
+    mdx_files = {
+        "docs": get_github_mdx(
+            os.getenv("GITHUB_REPO"), os.getenv("GITHUB_PATH"), token
         ),
-        mdx_type="docs",
-    )
-    df_mdx_docs = mdx_loader.load()
+        "local": get_github_mdx(LOCAL_MDX_REPO, LOCAL_MDX_PATH, token),
+    }
 
-    # load local mdx files to augment
-    mdx_local_loader = MdxLoader(
-        get_github_mdx("data-gov-my/datagovmy-ai", "data", os.getenv("GITHUB_TOKEN")),
-        mdx_type="local",
-    )
-    df_mdx_local = mdx_local_loader.load()
+    stored = tracker.get_all()
+    fingerprints = {}
+    mtimes = {}
+    urls = {}
+    for mdx_type, files in mdx_files.items():
+        for file in files:
+            key = f"{mdx_type}:{file['path']}"
+            fingerprints[key] = file["sha"]
+            urls[key] = file["download_url"]
+    for parquet in DC_META_SOURCES:
+        key = f"parquet:{os.getenv(parquet)}"
+        fingerprints[key], mtimes[key] = fingerprint_file(
+            os.getenv(parquet), stored.get(key)
+        )
+
+    full = os.getenv("INGEST_FULL") == "1" or not stored
+    if full:
+        changed, unchanged, removed = list(fingerprints), [], []
+    else:
+        changed, unchanged, removed = tracker.diff(fingerprints)
 
-    # load DC metadata
-    dc_meta_loader = DCMetaLoader(
-        [os.getenv("DC_META_PARQUET"), os.getenv("DC_METAFIELDS_PARQUET")]
+    return {
+        "full": full,
+        "fingerprints": fingerprints,
+        "mtimes": mtimes,
+        "urls": urls,
+        "changed": changed,
+        "unchanged": unchanged,
+        "removed": removed,
+    }
+
+
+def print_summary(plan: Dict) -> None:
+    """Print per-run summary of processed and skipped sources"""
+    mode = "full" if plan["full"] else "incremental"
+    print(
+        f"Sources ({mode}): {len(plan['changed'])} to process, "
+        f"{len(plan['unchanged'])} skipped, {len(plan['removed'])} removed"
     )
-    df_dcmeta = dc_meta_loader.load()
-
-    # combine
-    dfm = pd.concat([df_mdx_docs, df_mdx_local, df_dcmeta], ignore_index=True)
-    docs = dfm.apply(
-        lambda row: Document(
-            page_content=row["content_embed"],
-            metadata={"header": row["header"], "source": row["source"]},
-        ),
-        axis=1,
-    ).tolist()
-    return docs
+    for source_type in ["docs", "local", "parquet"]:
+        prefix = f"{source_type}:"
+        n_changed = sum(key.startswith(prefix) for key in plan["changed"])
+        n_skipped = sum(key.startswith(prefix) for key in plan["unchanged"])
+        n_removed = sum(key.startswith(prefix) for key in plan["removed"])
+        print(
+            f"  {source_type}: {n_changed} processed, {n_skipped} skipped, "
+            f"{n_removed} removed"
+        )
 
 
-def run_index(docs, class_name):
-    # connect to chroma db vectorstore
+def removed_source_ids(removed: List[str]) -> List[str]:
+    """Map removed mdx source keys to the source ids used in the vector index"""
+    source_ids = []
+    for key in removed:
+        source_type, path = key.split(":", 1)
+        if source_type in ("docs", "local"):
+            loader = MdxLoader([], mdx_type=source_type)
+            source_ids.append(loader.get_relative_path(path)[:-7])
+    return source_ids
+
+
+def source_id(doc: Document) -> str:
+    """Record manager group of a doc: its file for mdx, its dataset for dc_meta"""
+    if doc.metadata["source"] == "dc_meta":
+        return f"dc_meta/{json.loads(doc.metadata['header'])['id']}"
+    return doc.metadata["source"]
+
+
+def remove_stale_dc_meta(chroma_db, record_manager, seen: Set[str]) -> int:
+    """Drop dc_meta docs of datasets that are no longer in the parquet.
+
+    Each dataset is its own source id, so incremental cleanup only covers the
+    datasets it was given and never sees the ones that disappeared.
+    """
+    stored = chroma_db.get(where={"source": "dc_meta"}, include=["metadatas"])
+    stale_keys = [
+        key
+        for key, metadata in zip(stored["ids"], stored["metadatas"])
+        if source_id(Document(page_content="", metadata=metadata)) not in seen
+    ]
+    if stale_keys:
+        chroma_db.delete(stale_keys)
+        record_manager.delete_keys(stale_keys)
+    return len(stale_keys)
+
+
+def track(docs: Iterable[Document], stage: str, every: int = 1000) -> Iterator:
+    """Pass documents through, printing progress and timing for a stage"""
+    start = time.perf_counter()
+    count = 0
+    for doc in docs:
+        count += 1
+        if count % every == 0:
+            print(f"[{stage}] {count} docs, {time.perf_counter() - start:.1f}s")
+        yield doc
+    print(f"[{stage}] done: {count} docs in {time.perf_counter() - start:.1f}s")
+
+
+def load_mdx_docs(plan: Dict) -> Iterator[Document]:
+    """Stream documents for Docs Assistant, only for sources that changed"""
+    changed = set(plan["changed"])
+
+    # load mdx files from git, and local mdx files to augment
+    for mdx_type in ["docs", "local"]:
+        urls = [
+            plan["urls"][key]
+            for key in plan["fingerprints"]
+            if key.startswith(f"{mdx_type}:") and key in changed
+        ]
+        if urls:
+            mdx_loader = MdxLoader(urls, mdx_type=mdx_type)
+            yield from track(mdx_loader.lazy_load(), f"mdx:{mdx_type}")
+
+    # load DC metadata - both parquets are needed if either changed
+    if any(key.startswith("parquet:") for key in changed):
+        dc_meta_loader = DCMetaLoader(
+            [os.getenv(p) for p in DC_META_SOURCES],
+            exclude_ids=[
+                i.strip()
+                for i in os.getenv("DC_META_EXCLUDE_IDS", "").split(",")
+                if i.strip()
+            ],
+        )
+        yield from track(dc_meta_loader.lazy_load(), "dc_meta")
+
+
+def get_vectorstore(embeddings) -> Chroma:
     print("Connecting to Chroma DB at", os.getenv("CHROMA_HOST"))
-    oai_embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
     client = chromadb.HttpClient(
         host=os.getenv("CHROMA_HOST"),
         port=os.getenv("CHROMA_PORT"),
         settings=Settings(),
     )
-    chroma_db = Chroma(
+    return Chroma(
         client=client,
         collection_name="dgmy_docs",
-        embedding_function=oai_embeddings,
+        embedding_function=embeddings,
+    )
+
+
+def build_lexical_index(chroma_db, version):
+    """Rebuild the BM25 artifact from the full collection contents"""
+    start = time.perf_counter()
+    ids, documents, metadatas = [], [], []
+    while True:
+        page = chroma_db.get(
+            include=["documents", "metadatas"], limit=5000, offset=len(ids)
+        )
+        if not page["ids"]:
+            break
+        ids.extend(page["ids"])
+        documents.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+    path = get_index_path()
+    build_bm25(ids, documents, metadatas, path, version)
+    print(
+        f"Built BM25 index over {len(ids)} docs at {path} "
+        f"in {time.perf_counter() - start:.1f}s"
     )
 
+
+def publish_index(chroma_db):
+    """Rebuild derived artifacts, then publish a new index version to the api"""
+    version = new_index_version()
+    try:
+        build_lexical_index(chroma_db, version)
+    except Exception as e:
+        print(f"Could not build BM25 index: {e}")
+    # invalidates cached answers in the api, a failure here only delays that
+    try:
+        print(f"Published index version {bump_index_version(version)}")
+    except Exception as e:
+        print(f"Could not publish index version: {e}")
+
+
+def run_index(docs, class_name, cleanup="full", removed_sources=None):
+    # connect to chroma db vectorstore
+    oai_embeddings = get_embeddings()
+    chroma_db = get_vectorstore(oai_embeddings)
+
     # initialise record manager
     conn_str = os.getenv("REC_MGR_CONN_STR")
     namespace = f"chroma/{class_name}"
     record_manager = SQLRecordManager(namespace, db_url=conn_str)
     record_manager.create_schema()
 
+    # drop sources whose files were deleted, incremental cleanup won't see them
+    removed_keys = []
+    if removed_sources:
+        removed_keys = record_manager.list_keys(group_ids=removed_sources)
+        if removed_keys:
+            chroma_db.delete(removed_keys)
+            record_manager.delete_keys(removed_keys)
+        print(f"Removed {len(removed_keys)} records for deleted sources")
+
+    # embed ahead of indexing in rate-limited batches, index then reads from cache
+    docs = EmbeddingPipeline(oai_embeddings).stream(docs)
+
+    seen_dc_meta = set()
+
+    def collect_dc_meta(docs):
+        for doc in docs:
+            if doc.metadata["source"] == "dc_meta":
+                seen_dc_meta.add(source_id(doc))
+            yield doc
+
     index_result = index(
-        docs, record_manager, chroma_db, cleanup="full", source_id_key="source"
+        track(collect_dc_meta(docs), "index"),
+        record_manager,
+        chroma_db,
+        cleanup=cleanup,
+        source_id_key=source_id,
     )
+    # full cleanup already dropped them, incremental needs the datasets listed
+    num_stale = 0
+    if seen_dc_meta and cleanup == "incremental":
+        num_stale = remove_stale_dc_meta(chroma_db, record_manager, seen_dc_meta)
+        print(f"Removed {num_stale} records for datasets no longer in the parquet")
     print(f"Current index contains: {len(record_manager.list_keys())} records")
+    print(f"Embedding cache: {oai_embeddings.stats()}")
     if (
         index_result["num_added"] > 0
         or index_result["num_updated"] > 0
         or index_result["num_deleted"] > 0
+        or removed_keys
+        or num_stale
     ):
         print(f"Vector index updated for {class_name}: {index_result}")
+        publish_index(chroma_db)
         # send_telegram(f"Vector index updated for {class_name}: {index_result}")
     else:
         print("No changes in vector index")
@@ -135,12 +348,36 @@ def run_index(docs, class_name):
 
 if __name__ == "__main__":
     try:
-        print("Loading MDX documents...")
-        mdx_docs = load_mdx_docs()
-        print(f"Loaded {len(mdx_docs)} documents")
+        class_name = os.getenv("DOCS_VINDEX")
+        tracker = SourceTracker(f"sources/{class_name}", os.getenv("REC_MGR_CONN_STR"))
+        tracker.create_schema()
+
+        print("Detecting changed sources...")
+        plan = list_sources(tracker)
+        print_summary(plan)
+
+        if not plan["changed"] and not plan["removed"]:
+            print("No source changes, skipping index")
+            if artifact_version(get_index_path()) is None:
+                print("BM25 index missing, building from the current collection")
+                publish_index(get_vectorstore(get_embeddings()))
+            exit(0)
 
-        print("Running index...")
-        run_index(mdx_docs, os.getenv("DOCS_VINDEX"))
+        # documents are loaded lazily and flow straight into indexing
+        print("Loading and indexing documents...")
+        mdx_docs = load_mdx_docs(plan)
+        run_index(
+            mdx_docs,
+            class_name,
+            # without the full document set, only clean up sources we reloaded
+            cleanup="full" if plan["full"] else "incremental",
+            removed_sources=removed_source_ids(plan["removed"]),
+        )
+        tracker.update(
+            {key: plan["fingerprints"][key] for key in plan["changed"]},
+            plan["mtimes"],
+        )
+        tracker.delete(plan["removed"])
         print("Index completed successfully")
     except Exception as e:
         print(f"Error in docs ingest: {e}")
@@ -2,22 +2,30 @@ from langchain.text_splitter import (
     MarkdownHeaderTextSplitter,
     RecursiveCharacterTextSplitter,
 )
+from langchain.docstore.document import Document
 import re
 import os
+import time
 import uuid
 import json
 import requests
+import multiprocessing
 import pandas as pd
+import pyarrow.compute as pc
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Protocol, List
+from typing import Dict, Iterable, Iterator, List, Optional, Protocol
 
+from utils.fetch import BlockingFetcher
 from utils.helpers import (
-    read_file_from_repo,
     extract_line_without_hash,
     clean_content,
-    parse_desc,
+    read_parquet_columns,
 )
 
+# [data_type] description, as parsed by utils.helpers.parse_desc
+DESC_PATTERN = r"^\[(\w+)\]\s*(.+)"
+
 
 class BaseLoader(Protocol):
     sources: List[str]
@@ -29,13 +37,163 @@ class BaseLoader(Protocol):
         """Validate data (needed?)"""
 
 
+# raw chunks removed from mdx before splitting, for certain corner cases
+RAW_CHUNKS_TO_REMOVE = [
+    re.compile(r'import Head from "next/head";', flags=re.DOTALL),
+    re.compile(r"<Head>.*?</Head>", flags=re.DOTALL),
+]
+HEADERS_TO_SPLIT_ON = [
+    # we're skipping H1 headers here due to clash with # comments in code blocks
+    # ("#", "header"),
+    ("##", "header"),
+    ("###", "header"),
+]
+CHUNK_SIZE = 1024
+CHUNK_OVERLAP = 128
+
+# exclude headers and sources
+EXCLUDE_HEADERS = {
+    "Using the AI Helper",
+    "Frequently Asked Questions",  # function def for FAQbox
+}
+EXCLUDE_SOURCES = {"ai-helper.en.mdx"}
+EXCLUDE_HEADER_SOURCES = {
+    ("Example Request", "static-api/opendosm.en.mdx"),
+    ("Request Query & Response Format", "static-api/opendosm.en.mdx"),
+    ("How to Find Available Resources", "static-api/opendosm.en.mdx"),
+}
+
+# splitters are built once per process (main or pool worker)
+_splitters = None
+
+
+def _init_splitters():
+    global _splitters
+    _splitters = (
+        MarkdownHeaderTextSplitter(headers_to_split_on=HEADERS_TO_SPLIT_ON),
+        RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+        ),
+    )
+
+
+def split_mdx(relative_path: str, markdown_input: str) -> List[Document]:
+    """Clean and split a single mdx file into chunks with header and source metadata"""
+    if _splitters is None:
+        _init_splitters()
+    markdown_splitter, text_splitter = _splitters
+
+    # clean raw input for certain corner cases
+    for remove_pattern in RAW_CHUNKS_TO_REMOVE:
+        markdown_input = remove_pattern.sub("", markdown_input)
+
+    md_header_splits = markdown_splitter.split_text(markdown_input)
+
+    # add file info to metadata
+    for split in md_header_splits:
+        split.metadata.update({"source": relative_path})
+
+    # char-level splits to breakdown larger mdx docs
+    docs = text_splitter.split_documents(md_header_splits)
+    for i, doc in enumerate(docs):
+        if "header" not in doc.metadata:
+            # handle H1 headers here
+            header = extract_line_without_hash(doc.page_content)
+            if header:
+                doc.metadata.update({"header": header})
+        doc.metadata["chunk_id"] = f"{relative_path}#{i}"
+    return docs
+
+
 class MdxLoader(BaseLoader):
     """Implementation of BaseLoader for MDX files."""
 
-    def __init__(self, sources: List[str], mdx_type: str):
+    def __init__(
+        self, sources: List[str], mdx_type: str, workers: Optional[int] = None
+    ):
         self.sources = sources
         self.mdx_type = mdx_type
-        # self.additional_param = additional_param
+        # number of processes used to parse and split, 1 keeps it in-process
+        self.workers = workers or int(os.getenv("MDX_WORKERS") or 1)
+        # number of files fetched and parsed per window when streaming
+        self.fetch_batch_size = int(os.getenv("MDX_FETCH_BATCH") or 64)
+
+    def get_relative_path(self, mdx_file_url: str) -> str:
+        """Source path of an mdx file, before .en.mdx is stripped"""
+        path = Path(mdx_file_url)
+        if self.mdx_type == "docs":
+            # docs mdx - take path after 'pages' in pages/data-catalogue/overview.en.mdx
+            pages_dir = next(p for p in path.parents if p.name == "pages")
+            return str(path.relative_to(pages_dir))
+        elif self.mdx_type == "local":
+            # local mdx - use filename?
+            return path.name
+
+    def split(
+        self,
+        sources: List[str],
+        markdown_inputs: List[str],
+        executor: Optional[ProcessPoolExecutor] = None,
+    ) -> List[Document]:
+        """Split files, fanning out over the process pool if one is given.
+
+        Chunks come back in source order, so output and chunk ids are the same
+        regardless of the number of workers.
+        """
+        relative_paths = [self.get_relative_path(url) for url in sources]
+        if executor is None or len(sources) <= 1:
+            split_docs = map(split_mdx, relative_paths, markdown_inputs)
+        else:
+            chunksize = max(1, len(sources) // (self.workers * 4))
+            split_docs = executor.map(
+                split_mdx, relative_paths, markdown_inputs, chunksize=chunksize
+            )
+        return [doc for docs in split_docs for doc in docs]
+
+    def iter_records(self) -> Iterator[Dict]:
+        """Fetch, split and process files one window at a time.
+
+        The next window is fetched in the background while the current one is
+        parsed, and records are yielded as soon as each window is done.
+        """
+        windows = [
+            self.sources[i : i + self.fetch_batch_size]
+            for i in range(0, len(self.sources), self.fetch_batch_size)
+        ]
+        if not windows:
+            return
+
+        pool = None
+        if self.workers > 1:
+            # the fetcher and embedding threads may already be running, and
+            # forking a threaded process can copy a held lock into the child
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=_init_splitters,
+            )
+        try:
+            # one connection pool for every window, fetched on its own thread
+            with BlockingFetcher(os.getenv("GITHUB_TOKEN")) as http:
+                next_inputs = http.submit_all(windows[0])
+                for i, window in enumerate(windows):
+                    markdown_inputs = next_inputs.result()
+                    if i + 1 < len(windows):
+                        next_inputs = http.submit_all(windows[i + 1])
+                    start = time.perf_counter()
+                    docs = self.split(window, markdown_inputs, pool)
+                    print(
+                        f"[mdx:{self.mdx_type}] window {i + 1}/{len(windows)}: "
+                        f"{len(window)} files, {len(docs)} chunks split in "
+                        f"{time.perf_counter() - start:.2f}s"
+                    )
+                    yield from self.process(docs)
+            print(
+                f"[mdx:{self.mdx_type}] fetched {len(self.sources)} files: {http.stats}"
+            )
+        finally:
+            if pool is not None:
+                pool.shutdown()
 
     def load(self) -> pd.DataFrame:
         """Load and process text data from file list.
@@ -44,103 +202,38 @@ class MdxLoader(BaseLoader):
             dfm: DataFrame of processed text content and metadata with
                  content_embed, uuid, metadata (header, source)
         """
-        raw_chunks_to_remove = ['import Head from "next/head";', r"<Head>.*?</Head>"]
-
-        chunk_size = 1024
-        chunk_overlap = 128
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size, chunk_overlap=chunk_overlap
-        )
-        all_splitted_text = []
-        for mdx_file_url in self.sources:
-            markdown_input = read_file_from_repo(
-                os.getenv("GITHUB_REPO"), os.getenv("GITHUB_TOKEN"), mdx_file_url
+        return pd.DataFrame(list(self.iter_records()))
+
+    def lazy_load(self) -> Iterator[Document]:
+        """Yield documents to index as files are fetched and parsed"""
+        for record in self.iter_records():
+            yield Document(
+                page_content=record["content_embed"],
+                metadata={"header": record["header"], "source": record["source"]},
             )
 
-            # clean raw input for certain corner cases
-            for remove_pattern in raw_chunks_to_remove:
-                markdown_input = re.sub(
-                    remove_pattern, "", markdown_input, flags=re.DOTALL
-                )
-
-            headers_to_split_on = [
-                # we're skipping H1 headers here due to clash with # comments in code blocks
-                # ("#", "header"),
-                ("##", "header"),
-                ("###", "header"),
-            ]
-
-            markdown_splitter = MarkdownHeaderTextSplitter(
-                headers_to_split_on=headers_to_split_on
-            )
-            md_header_splits = markdown_splitter.split_text(markdown_input)
-
-            # add file info to metadata
-            path = Path(mdx_file_url)
-            if self.mdx_type == "docs":
-                # docs mdx - take path after 'pages' in pages/data-catalogue/overview.en.mdx
-                pages_dir = next(p for p in path.parents if p.name == "pages")
-                relative_path = str(path.relative_to(pages_dir))
-            elif self.mdx_type == "local":
-                # local mdx - use filename?
-                relative_path = path.name
-
-            for i in range(len(md_header_splits)):
-                md_header_splits[i].metadata.update({"source": relative_path})
-
-            # char-level splits to breakdown larger mdx docs
-            recursive_md_header_splits = text_splitter.split_documents(md_header_splits)
-            all_splitted_text += recursive_md_header_splits
-
-        # split data for dataframe
-        df_data = []
-        for doc in all_splitted_text:
-            if "header" in doc.metadata:
-                pass
-            else:
-                # handle H1 headers here
-                header = extract_line_without_hash(doc.page_content)
-                if header:
-                    doc.metadata.update({"header": header})
-            df_data.append((doc.page_content, doc.metadata, doc))
-
-        dfm = pd.DataFrame(df_data, columns=["page_content", "metadata", "doc_object"])
-
-        # expand metadata dict to columns
-        dfm = pd.concat(
-            [dfm.drop("metadata", axis=1), dfm.metadata.apply(pd.Series)], axis=1
-        )
-        dfm = dfm.rename(columns={"Header": "header"})
-
-        # exclude headers and sources
-        to_exclude_headers = [
-            "Using the AI Helper",
-            "Frequently Asked Questions",  # function def for FAQbox
-        ]
-        to_exclude_source = ["ai-helper.en.mdx"]
-        to_exclude_header_source = [
-            ("Example Request", "static-api/opendosm.en.mdx"),
-            ("Request Query & Response Format", "static-api/opendosm.en.mdx"),
-            ("How to Find Available Resources", "static-api/opendosm.en.mdx"),
-        ]
-
-        dfm = dfm[~dfm.header.isin(to_exclude_headers)]
-        dfm = dfm[~dfm.source.isin(to_exclude_source)]
-        dfm = dfm[
-            dfm.apply(
-                lambda row: (row["header"], row["source"])
-                not in to_exclude_header_source,
-                axis=1,
-            )
-        ]
+    def process(self, docs: Iterable[Document]) -> Iterator[Dict]:
+        """Filter excluded chunks and build content to embed.
 
-        # strip .en.mdx from filename
-        dfm.source = dfm.source.str[:-7]
-        # content to embed is combo of header and page_content
-        dfm["content_embed"] = dfm.apply(
-            lambda row: row.header + " " + row.page_content, axis=1
-        ).apply(clean_content)
-        return dfm
+        Yields:
+            record: dict of page_content, metadata (header, source, chunk_id)
+                    and content_embed
+        """
+        for doc in docs:
+            header = doc.metadata.get("header")
+            source = doc.metadata["source"]
+            if (
+                header in EXCLUDE_HEADERS
+                or source in EXCLUDE_SOURCES
+                or (header, source) in EXCLUDE_HEADER_SOURCES
+            ):
+                continue
+            record = {"page_content": doc.page_content, **doc.metadata}
+            # strip .en.mdx from filename
+            record["source"] = source[:-7]
+            # content to embed is combo of header and page_content
+            record["content_embed"] = clean_content(header + " " + doc.page_content)
+            yield record
 
     def validate(self):
         # Implement the validation logic for MdxLoader
@@ -150,6 +243,9 @@ class MdxLoader(BaseLoader):
 class DashboardMetaLoader(BaseLoader):
     """Implementation of BaseLoader for Dashboard Metadata."""
 
+    # parquet columns used by load, only these are read
+    PARQUET_COLUMNS = ["name", "route", "agency", "category"]
+
     def __init__(self, desc_json: str, desc_parquet: str):
         self.desc_json = desc_json
         self.desc_parquet = desc_parquet
@@ -163,7 +259,7 @@ class DashboardMetaLoader(BaseLoader):
             dfm: DataFrame of processed text content and metadata with
                  content_embed, uuid, metadata (header, source)
         """
-        dfmeta_parquet = pd.read_parquet(self.desc_parquet)
+        dfmeta_parquet = read_parquet_columns(self.desc_parquet, self.PARQUET_COLUMNS)
         dfmeta_parquet = dfmeta_parquet.rename(columns={"name": "id"})
         # create the source column from routes
         dfmeta_parquet["source"] = dfmeta_parquet["route"]
@@ -191,8 +287,25 @@ class DashboardMetaLoader(BaseLoader):
 class DCMetaLoader(BaseLoader):
     """Implementation of BaseLoader for Data Catalogue Metadata."""
 
-    def __init__(self, sources: List[str]):
+    # parquet columns used by load, only these are read
+    META_COLUMNS = [
+        "id",
+        "dataset_begin",
+        "dataset_end",
+        "frequency",
+        "methodology_en",
+        "caveat_en",
+        "category_en",
+        "subcategory_en",
+        "description_en",
+        "data_source",
+        "exclude_openapi",
+    ]
+    METAFIELDS_COLUMNS = ["id", "var_name", "var_title_en", "var_description_en"]
+
+    def __init__(self, sources: List[str], exclude_ids: Optional[List[str]] = None):
         self.sources = sources
+        self.exclude_ids = exclude_ids or []
 
     def load(self):
         """Load and process text data from metadata parquet file.
@@ -202,48 +315,43 @@ class DCMetaLoader(BaseLoader):
         """
         meta_file = self.sources[0]
         metafields_file = self.sources[1]
-        dfmeta = pd.read_parquet(meta_file)
-        dfmeta_fields = pd.read_parquet(metafields_file)
+        # skip excluded datasets while scanning rather than after loading
+        id_filter = None
+        if self.exclude_ids:
+            id_filter = ~pc.field("id").isin(self.exclude_ids)
+        dfmeta = read_parquet_columns(meta_file, self.META_COLUMNS, id_filter)
+        dfmeta_fields = read_parquet_columns(
+            metafields_file, self.METAFIELDS_COLUMNS, id_filter
+        )
         dfmeta = dfmeta.merge(dfmeta_fields, on="id", suffixes=["", "_fields"])
         # dfmeta = dfmeta[~dfmeta.exclude_openapi]
         # dc_page_id is now id
 
         # parse column desc to extract datatype and descriptions
-        dfmeta[["col_data_type", "col_description"]] = dfmeta.var_description_en.apply(
-            parse_desc
-        ).apply(pd.Series)
+        parsed_desc = dfmeta.var_description_en.str.extract(DESC_PATTERN)
+        # keep None rather than NaN for unparsed descriptions, as parse_desc does
+        parsed_desc = parsed_desc.astype(object).where(parsed_desc.notna(), None)
+        dfmeta["col_data_type"] = parsed_desc[0]
+        dfmeta["col_description"] = parsed_desc[1]
+
+        # group column metadata in different formats, in a single pass
+        col_meta = pd.DataFrame(
+            {
+                "text": dfmeta.var_title_en.str.strip()
+                + " "
+                + dfmeta.var_description_en.str.strip(),
+                "record": dfmeta[
+                    ["var_name", "col_data_type", "col_description"]
+                ].to_dict(orient="records"),
+            },
+            index=dfmeta.index,
+        )
+        col_meta = col_meta.groupby(dfmeta["id"]).agg(list)
 
-        # group column metadata in different formats
         dfmeta_byfile = dfmeta.groupby("id").first()
-        dfmeta_byfile["col_meta"] = dfmeta.groupby("id", include_groups=False).apply(
-            lambda group_df: "\n".join(
-                group_df.apply(
-                    lambda row: row.var_title_en.strip()
-                    + " "
-                    + row.var_description_en.strip(),
-                    axis=1,
-                )
-            )
-        )
-        dfmeta_byfile["col_meta_clean"] = dfmeta.groupby(
-            "id", include_groups=False
-        ).apply(
-            lambda group_df: " ".join(
-                group_df.apply(
-                    lambda row: row.var_title_en.strip()
-                    + " "
-                    + row.var_description_en.strip(),
-                    axis=1,
-                )
-            )
-        )
-        dfmeta_byfile["col_meta_dict"] = dfmeta.groupby(
-            "id", include_groups=False
-        ).apply(
-            lambda group_df: group_df[
-                ["var_name", "col_data_type", "col_description"]
-            ].to_dict(orient="records")
-        )
+        dfmeta_byfile["col_meta"] = col_meta["text"].map("\n".join)
+        dfmeta_byfile["col_meta_clean"] = col_meta["text"].map(" ".join)
+        dfmeta_byfile["col_meta_dict"] = col_meta["record"]
 
         dfmeta_numcols = [
             "dataset_begin",
@@ -256,15 +364,10 @@ class DCMetaLoader(BaseLoader):
         dfmeta_byfile["date_range_int"] = (
             dfmeta_byfile["dataset_end"] - dfmeta_byfile["dataset_begin"]
         )
-        dfmeta_byfile["date_range"] = dfmeta_byfile.apply(
-            lambda row: (
-                str(int(row["dataset_begin"]))
-                if row.date_range_int == 0
-                else str(int(row["dataset_begin"]))
-                + "-"
-                + str(int(row["dataset_begin"]))
-            ),
-            axis=1,
+        # NOTE: multi-year ranges repeat dataset_begin, kept as-is to match indexed output
+        begin = dfmeta_byfile["dataset_begin"].astype(int).astype(str)
+        dfmeta_byfile["date_range"] = begin.where(
+            dfmeta_byfile["date_range_int"] == 0, begin + "-" + begin
         )
 
         dfmeta_byfile["frequency"] = dfmeta_byfile["frequency"].str.lower()
@@ -274,9 +377,6 @@ class DCMetaLoader(BaseLoader):
         to_drop = [
             "dataset_begin",
             "dataset_end",
-            "geography",
-            "demography",
-            "data_source_primary",
             "date_range_int",
             "var_name",  # machine name, we only need descriptive english - subcategory
             "col_data_type",
@@ -307,9 +407,10 @@ class DCMetaLoader(BaseLoader):
             "data_source",
             "col_meta_clean",
         ]
-        dfmeta_byfile["content_embed"] = dfmeta_byfile[cols_to_concat].apply(
-            lambda row: " ".join(row.values.astype(str)), axis=1
-        )
+        content_embed = dfmeta_byfile[cols_to_concat[0]].astype(str)
+        for col in cols_to_concat[1:]:
+            content_embed = content_embed + " " + dfmeta_byfile[col].astype(str)
+        dfmeta_byfile["content_embed"] = content_embed
 
         # format metadata into header for retriever
         metacols_for_header = [
@@ -324,17 +425,22 @@ class DCMetaLoader(BaseLoader):
             "exclude_openapi",
             "col_meta_clean",
         ]
-        dfmeta_byfile["header"] = dfmeta_byfile[metacols_for_header].to_dict(
-            orient="records"
-        )
-        dfmeta_byfile["header"] = dfmeta_byfile.apply(
-            lambda row: json.dumps(row.header), axis=1
-        )
+        headers = dfmeta_byfile[metacols_for_header].to_dict(orient="records")
+        dfmeta_byfile["header"] = [json.dumps(header) for header in headers]
 
         # use this to identify dc_meta in retriever
         dfmeta_byfile["source"] = "dc_meta"
         return dfmeta_byfile
 
+    def lazy_load(self) -> Iterator[Document]:
+        """Yield documents to index, the parquet files are loaded as a whole"""
+        dfm = self.load()
+        for content_embed, header in zip(dfm["content_embed"], dfm["header"]):
+            yield Document(
+                page_content=content_embed,
+                metadata={"header": header, "source": "dc_meta"},
+            )
+
     def validate(self):
         # Implement the validation logic for MetaLoader
         pass
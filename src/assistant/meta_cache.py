@@ -0,0 +1,143 @@
+"""Exact-match response cache for /generate-meta.
+
+Dataset drafts are often re-submitted unchanged. A response is reused when
+the normalized input, the linked source file (by ETag, or size and last
+modified time) and the index version all match, so an edited draft, a
+re-uploaded file or a reindex each produce a fresh generation.
+"""
+
+import os
+import json
+import hashlib
+import logging
+from typing import Dict, Optional, Tuple
+
+import httpx
+from fastapi_cache import FastAPICache
+
+from schema import GenerateMetaResponse
+from utils.index_version import aget_index_version
+
+DEFAULT_TTL = 24 * 60 * 60
+# bump when the prompt, model or response schema changes
+CACHE_VERSION = 1
+KEY_PREFIX = "metacache"
+SOURCE_TIMEOUT = 5
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_input(value):
+    """Strip strings and drop empty values so cosmetic edits share a key"""
+    if isinstance(value, dict):
+        normalized = {k: normalize_input(v) for k, v in value.items()}
+        return {k: v for k, v in normalized.items() if v not in (None, "", [], {})}
+    if isinstance(value, list):
+        return [normalize_input(v) for v in value]
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+
+def input_hash(input_data: Dict) -> str:
+    canonical = json.dumps(
+        normalize_input(input_data), sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+async def source_fingerprint(
+    link: str, http_client: Optional[httpx.AsyncClient] = None
+) -> Optional[str]:
+    """ETag, or size and modified time, of a linked file. None if unknown."""
+    if not link.startswith(("http://", "https://")):
+        try:
+            stat = os.stat(link)
+        except OSError:
+            return None
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    if http_client is None:
+        async with httpx.AsyncClient() as client:
+            return await source_fingerprint(link, client)
+    response = await http_client.head(
+        link, timeout=SOURCE_TIMEOUT, follow_redirects=True
+    )
+    response.raise_for_status()
+    headers = response.headers
+    if "etag" in headers:
+        return headers["etag"]
+    if "content-length" in headers:
+        return f"{headers['content-length']}:{headers.get('last-modified', '')}"
+    return None
+
+
+class MetaResponseCache:
+    """Caches GenerateMetaResponse in redis under a hash of its inputs.
+
+    Uses the redis client that the app lifespan hands to FastAPICache. Any
+    redis or source lookup failure is logged and treated as a miss.
+    """
+
+    def __init__(
+        self,
+        http_client: Optional[httpx.AsyncClient] = None,
+        ttl: Optional[int] = None,
+    ):
+        self.http_client = http_client
+        self.ttl = ttl or int(os.getenv("META_CACHE_TTL") or DEFAULT_TTL)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def enabled() -> bool:
+        return (os.getenv("META_CACHE_ENABLED") or "1") == "1"
+
+    def _redis(self):
+        return FastAPICache.get_backend().redis
+
+    async def key(self, input_data: Dict) -> Optional[str]:
+        """Cache key for a request, None when the source can't be fingerprinted"""
+        link = input_data.get("link_csv") or input_data.get("link_parquet")
+        source = ""
+        if link:
+            source = await source_fingerprint(link, self.http_client)
+            if source is None:
+                return None
+        version = await aget_index_version(self._redis())
+        digest = hashlib.sha256(
+            f"{CACHE_VERSION}:{input_hash(input_data)}:{source}".encode()
+        ).hexdigest()
+        return f"{KEY_PREFIX}:{version}:{digest}"
+
+    async def lookup(
+        self, input_data: Dict, bypass: bool = False
+    ) -> Tuple[Optional[str], Optional[GenerateMetaResponse]]:
+        """Find a cached response. A bypassed lookup still returns the key,
+        so the fresh response replaces the cached one.
+
+        Returns:
+            key (None if the request can't be cached), cached response or None
+        """
+        try:
+            key = await self.key(input_data)
+            if key is None or bypass:
+                return key, None
+            cached = await self._redis().get(key)
+        except Exception as e:
+            logger.warning(f"Generate-meta cache lookup failed: {e}")
+            return None, None
+        if cached is None:
+            self.misses += 1
+            return key, None
+        self.hits += 1
+        return key, GenerateMetaResponse.model_validate_json(cached)
+
+    async def store(self, key: str, response: GenerateMetaResponse) -> None:
+        try:
+            await self._redis().set(key, response.model_dump_json(), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Generate-meta cache store failed: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
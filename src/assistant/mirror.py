@@ -0,0 +1,205 @@
+"""In-process FAISS mirror of the Chroma collection.
+
+The collection is small and only changes when the ingest cron runs, so the
+api keeps a full copy in memory and answers retrieval queries locally. The
+mirror is rebuilt when the index version published by ingest changes; while
+it is missing or behind that version, callers fall back to Chroma.
+"""
+
+import os
+import time
+import logging
+from typing import Dict, List, Optional
+
+import chromadb
+import faiss
+import numpy as np
+from chromadb.config import Settings
+
+from utils.timing import LatencyStats
+from utils.executors import run_io
+
+# page size when copying the collection out of chroma
+SYNC_PAGE_SIZE = 5000
+
+logger = logging.getLogger(__name__)
+retrieval_latency = LatencyStats("retrieval", logger=logger)
+
+
+class _Snapshot:
+    """One immutable copy of the collection, swapped in whole on sync."""
+
+    def __init__(self, version, ids, documents, metadatas, vectors):
+        self.version = version
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        # the index holds the only copy of the (normalised) vectors
+        self.index = faiss.IndexFlatIP(vectors.shape[1])
+        self.index.add(_normalize(vectors))
+        # filtered sub-indices, built on first use per metadata value
+        self._subsets = {}
+
+    def vectors(self, positions: np.ndarray) -> np.ndarray:
+        if not len(positions):
+            return np.empty((0, self.index.d), dtype=np.float32)
+        return self.index.reconstruct_batch(positions)
+
+    def subset(self, key: str, value):
+        if (key, value) not in self._subsets:
+            positions = np.array(
+                [
+                    i
+                    for i, m in enumerate(self.metadatas)
+                    if (m or {}).get(key) == value
+                ],
+                dtype=np.int64,
+            )
+            index = faiss.IndexFlatIP(self.index.d)
+            if len(positions):
+                index.add(self.vectors(positions))
+            self._subsets[(key, value)] = (index, positions)
+        return self._subsets[(key, value)]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+
+class CollectionMirror:
+    """Read-only in-memory copy of a Chroma collection backed by FAISS.
+
+    query() returns results in the same shape as chromadb's
+    Collection.query, so retrievers can use either interchangeably.
+    """
+
+    def __init__(
+        self,
+        collection_name: str = "dgmy_docs",
+        client=None,
+    ):
+        self.collection_name = collection_name
+        self.client = client
+        self.latest_version = None
+        self._snapshot = None
+
+    @staticmethod
+    def enabled() -> bool:
+        return (os.getenv("MIRROR_ENABLED") or "1") == "1"
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._snapshot.version if self._snapshot else None
+
+    @property
+    def fresh(self) -> bool:
+        """True when the mirror holds the latest known index version"""
+        return self._snapshot is not None and self.version == self.latest_version
+
+    def _collection(self):
+        if self.client is None:
+            self.client = chromadb.HttpClient(
+                host=os.getenv("CHROMA_HOST"),
+                port=os.getenv("CHROMA_PORT"),
+                settings=Settings(),
+            )
+        return self.client.get_collection(self.collection_name)
+
+    def sync(self, version: str) -> None:
+        """Copy the whole collection out of Chroma and swap in a new index."""
+        start = time.perf_counter()
+        collection = self._collection()
+        ids, documents, metadatas, vectors = [], [], [], []
+        offset = 0
+        while True:
+            page = collection.get(
+                include=["embeddings", "documents", "metadatas"],
+                limit=SYNC_PAGE_SIZE,
+                offset=offset,
+            )
+            if not len(page["ids"]):
+                break
+            ids.extend(page["ids"])
+            documents.extend(page["documents"])
+            metadatas.extend(page["metadatas"])
+            vectors.append(np.asarray(page["embeddings"], dtype=np.float32))
+            offset += len(page["ids"])
+        if not ids:
+            raise RuntimeError(f"Collection {self.collection_name} is empty")
+        self._snapshot = _Snapshot(
+            version, ids, documents, metadatas, np.concatenate(vectors)
+        )
+        logger.info(
+            f"Mirrored {len(ids)} records of {self.collection_name} at index "
+            f"version {version} in {time.perf_counter() - start:.1f}s"
+        )
+
+    def query(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int,
+        where: Optional[Dict] = None,
+    ) -> Dict:
+        """Nearest neighbours by cosine similarity, shaped like Collection.query.
+
+        Only single-key equality filters are supported, e.g. {"source": "x"}.
+        """
+        snapshot = self._snapshot
+        if where:
+            ((key, value),) = where.items()
+            index, positions = snapshot.subset(key, value)
+        else:
+            index, positions = snapshot.index, None
+        if not index.ntotal:
+            # nothing matches the filter, faiss rejects k=0
+            return {
+                field: [[] for _ in query_embeddings]
+                for field in (
+                    "ids",
+                    "documents",
+                    "metadatas",
+                    "embeddings",
+                    "distances",
+                )
+            }
+        queries = _normalize(np.asarray(query_embeddings, dtype=np.float32))
+        scores, hits = index.search(queries, min(n_results, index.ntotal))
+        results = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+        results["distances"] = []
+        for row_scores, row in zip(scores, hits):
+            keep = row >= 0
+            row = row[keep] if positions is None else positions[row[keep]]
+            results["ids"].append([snapshot.ids[i] for i in row])
+            results["documents"].append([snapshot.documents[i] for i in row])
+            results["metadatas"].append([snapshot.metadatas[i] for i in row])
+            results["embeddings"].append(snapshot.vectors(row))
+            results["distances"].append((1 - row_scores[keep]).tolist())
+        return results
+
+    async def refresh(self, version: str) -> None:
+        """Rebuild the mirror for a new index version, for the version watcher."""
+        self.latest_version = version
+        if self.version != version:
+            await run_io(self.sync, version)
+
+
+def query_collection(
+    vectorstore,
+    query_embeddings,
+    n_results: int,
+    where: Optional[Dict] = None,
+    mirror: Optional[CollectionMirror] = None,
+) -> Dict:
+    """Query the mirror when it is fresh and Chroma otherwise, timing both."""
+    if mirror is not None and mirror.fresh:
+        with retrieval_latency.measure("mirror"):
+            return mirror.query(query_embeddings, n_results, where=where)
+    with retrieval_latency.measure("chroma"):
+        return vectorstore._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where,
+            include=["metadatas", "documents", "embeddings"],
+        )
@@ -0,0 +1,161 @@
+"""Routing of trivial conversational turns around retrieval.
+
+Greetings, thanks and acknowledgements ("ok", "terima kasih") never need
+query rewriting, expansion or retrieval. A cheap local classifier picks them
+out so the chat chain can answer them from the QA prompt alone.
+"""
+
+import os
+import re
+import logging
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_MAX_CHARS = 40
+DEFAULT_SIMILARITY = 0.9
+
+ROUTE_TRIVIAL = "trivial"
+ROUTE_RETRIEVAL = "retrieval"
+
+# whole-message phrases, english and malay
+TRIVIAL_PHRASES = frozenset(
+    [
+        "thank you",
+        "thank you very much",
+        "thanks a lot",
+        "good morning",
+        "good afternoon",
+        "good evening",
+        "good night",
+        "see you",
+        "got it",
+        "i see",
+        "all good",
+        "no problem",
+        "terima kasih",
+        "terima kasih banyak",
+        "selamat pagi",
+        "selamat tengah hari",
+        "selamat petang",
+        "selamat malam",
+        "sama sama",
+        "jumpa lagi",
+        "baiklah",
+        "assalamualaikum",
+    ]
+)
+# messages made up only of these tokens are trivial too, e.g. "ok thanks".
+# yes/no style answers are left out, they usually reply to a question from
+# the assistant and need the rewrite to make sense
+TRIVIAL_TOKENS = frozenset(
+    "hi hello hey hai helo thanks thank thx ty tq ok okay okey alright noted "
+    "cool great nice awesome perfect bye goodbye cheers baik faham salam "
+    "terima kasih banyak".split()
+)
+# prototypes for the optional embedding check
+PROTOTYPES = [
+    "thank you so much for your help",
+    "hello there",
+    "okay, understood",
+    "terima kasih atas bantuan anda",
+    "selamat pagi",
+    "baik, saya faham",
+]
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text: str) -> str:
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return re.sub(r"\s+", " ", text.replace("_", " ")).strip()
+
+
+class TurnRouter:
+    """Classifies the latest user message as trivial or needing retrieval.
+
+    Signals, cheapest first: message length, the EN/MS lexicon, then
+    (optionally) cosine similarity to prototype phrases using the shared
+    cached embeddings.
+    """
+
+    def __init__(
+        self,
+        embeddings: Optional[Embeddings] = None,
+        max_chars: Optional[int] = None,
+        similarity: Optional[float] = None,
+    ):
+        self.embeddings = embeddings
+        self.max_chars = max_chars or int(
+            os.getenv("ROUTER_MAX_CHARS") or DEFAULT_MAX_CHARS
+        )
+        self.similarity = similarity or float(
+            os.getenv("ROUTER_SIMILARITY") or DEFAULT_SIMILARITY
+        )
+        self._prototypes = None
+        self.counts = Counter()
+
+    @staticmethod
+    def enabled() -> bool:
+        return (os.getenv("ROUTER_ENABLED") or "1") == "1"
+
+    def _lexical(self, query: str) -> Tuple[Optional[str], str]:
+        """Route from length and lexicon alone, None if undecided"""
+        text = normalize(query)
+        if not text:
+            return ROUTE_TRIVIAL, "empty"
+        if len(text) > self.max_chars:
+            return ROUTE_RETRIEVAL, "length"
+        if text in TRIVIAL_PHRASES:
+            return ROUTE_TRIVIAL, "phrase"
+        if all(token in TRIVIAL_TOKENS for token in text.split()):
+            return ROUTE_TRIVIAL, "tokens"
+        return None, "lexicon"
+
+    def _record(self, route: str, reason: str, query: str) -> str:
+        self.counts[route] += 1
+        total = sum(self.counts.values())
+        share = self.counts[ROUTE_TRIVIAL] / total
+        logger.info(
+            f"Routed {len(query)}-char turn to {route} ({reason}), "
+            f"{share:.1%} of {total} turns skipped retrieval"
+        )
+        return route
+
+    def route(self, query: str) -> str:
+        route, reason = self._lexical(query)
+        return self._record(route or ROUTE_RETRIEVAL, reason, query)
+
+    async def aroute(self, query: str) -> str:
+        route, reason = self._lexical(query)
+        if route is None and self.embeddings is not None:
+            try:
+                if self._prototypes is None:
+                    self._prototypes = _unit(
+                        await self.embeddings.aembed_documents(PROTOTYPES)
+                    )
+                vector = _unit([await self.embeddings.aembed_query(query)])[0]
+                score = float(np.max(self._prototypes @ vector))
+                if score >= self.similarity:
+                    route, reason = ROUTE_TRIVIAL, f"prototype {score:.2f}"
+            except Exception as e:
+                logger.warning(f"Router embedding check failed: {e}")
+        return self._record(route or ROUTE_RETRIEVAL, reason, query)
+
+    def is_trivial(self, inputs: Dict) -> bool:
+        return self.route(inputs["query"]) == ROUTE_TRIVIAL
+
+    async def ais_trivial(self, inputs: Dict) -> bool:
+        return await self.aroute(inputs["query"]) == ROUTE_TRIVIAL
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counts)
+
+
+def _unit(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
@@ -2,7 +2,7 @@ from enum import StrEnum
 from pydantic import BaseModel, constr, Field, ConfigDict
 from typing_extensions import List, TypedDict
 from typing import Optional, Dict
-from langchain.schema import Document
+from langchain_core.documents import Document
 
 
 class Role(StrEnum):
@@ -28,6 +28,17 @@ class ChatRequest(BaseModel):
     messages: list[Message]
 
 
+# input type of the /chat runnable, langserve passes TypedDicts on as plain
+# dicts, which is what the chain's format_messages expects
+class ChatMessage(TypedDict):
+    role: Role
+    content: str
+
+
+class ChatInput(TypedDict):
+    messages: List[ChatMessage]
+
+
 class HealthCheck(BaseModel):
     status: str = "OK"
 
@@ -66,6 +77,7 @@ class DatasetMetadata(BaseModel):
 class State(TypedDict):
     input_data: dict
     similar_datasets: List[Document]
+    query_embedding: Optional[List[float]]
 
 
 class OutputState(TypedDict):
@@ -74,7 +86,16 @@ class OutputState(TypedDict):
 
 class GenerateMetaRequest(BaseModel):
     input_data: dict
+    # skip the cached response and regenerate, e.g. after a bad generation
+    bypass_cache: bool = False
 
 
 class GenerateMetaResponse(BaseModel):
     metadata: DatasetMetadata
+
+
+class GenerateMetaBatchRequest(BaseModel):
+    items: List[dict]
+    # capped by GENERATE_META_MAX_CONCURRENCY
+    max_concurrency: Optional[int] = None
+    bypass_cache: bool = False
@@ -0,0 +1,223 @@
+"""Semantic answer cache for the chat chain.
+
+Answers are stored in redis and matched on cosine similarity of the embedded
+(rewritten) query. Entries are bucketed by index version and a hash of the
+chat history, so an answer is only reused within the same conversation and
+every entry goes stale as soon as ingest publishes a new index version.
+
+Each bucket keeps a sorted set of its fields by last use. A lookup only
+scores the most recently used entries, and storing into a full bucket
+evicts the least recently used ones.
+
+Matching on the rewritten query has a cost: with the cache on, the chat chain
+rewrites the question before retrieval starts instead of alongside it, so
+every miss waits for the rewrite call as well. That is why the cache is
+opt-in (CHAT_CACHE_ENABLED=1), it pays off when repeat questions are common.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi_cache import FastAPICache
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from utils.embeddings import text_hash
+from utils.index_version import aget_index_version
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 1000
+# most recently used entries scored per lookup
+DEFAULT_SCAN_LIMIT = 200
+# text-embedding-3 vectors stay meaningful when truncated and renormalised, a
+# short prefix keeps each lookup small and is enough for near-duplicate matching
+KEY_DIMENSIONS = 256
+KEY_PREFIX = "chatcache"
+
+logger = logging.getLogger(__name__)
+
+
+def history_hash(history: List[BaseMessage]) -> str:
+    payload = json.dumps([[m.type, m.content] for m in history], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _key_vector(vector: List[float]) -> np.ndarray:
+    key = np.asarray(vector, dtype=np.float32)[:KEY_DIMENSIONS]
+    norm = np.linalg.norm(key)
+    return key / norm if norm else key
+
+
+def _chunks(text: str) -> List[str]:
+    """Split a cached answer into word chunks so it streams like a fresh one"""
+    return re.findall(r"\s*\S+\s*", text) or [text]
+
+
+class SemanticCache:
+    """Redis-backed cache of chat answers keyed on query similarity.
+
+    Uses the redis client that the app lifespan hands to FastAPICache. Any
+    redis failure is logged and treated as a miss, the cache never fails a
+    chat request.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: Optional[float] = None,
+        ttl: Optional[int] = None,
+        max_entries: Optional[int] = None,
+        scan_limit: Optional[int] = None,
+    ):
+        self.embeddings = embeddings
+        self.threshold = (
+            threshold
+            if threshold is not None
+            else float(os.getenv("CHAT_CACHE_THRESHOLD") or DEFAULT_THRESHOLD)
+        )
+        self.ttl = ttl or int(os.getenv("CHAT_CACHE_TTL") or DEFAULT_TTL)
+        self.max_entries = max_entries or int(
+            os.getenv("CHAT_CACHE_MAX_ENTRIES") or DEFAULT_MAX_ENTRIES
+        )
+        self.scan_limit = scan_limit or int(
+            os.getenv("CHAT_CACHE_SCAN_LIMIT") or DEFAULT_SCAN_LIMIT
+        )
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def enabled() -> bool:
+        return (os.getenv("CHAT_CACHE_ENABLED") or "0") == "1"
+
+    def _redis(self):
+        return FastAPICache.get_backend().redis
+
+    async def alookup(
+        self, query: str, history: List[BaseMessage]
+    ) -> Tuple[Optional[str], str, np.ndarray]:
+        """Find a cached answer for a query within its history bucket.
+
+        Returns:
+            answer (None on a miss), bucket, key vector of the query
+        """
+        vector = _key_vector(await self.embeddings.aembed_query(query))
+        redis = self._redis()
+        version = await aget_index_version(redis)
+        bucket = f"{KEY_PREFIX}:{version}:{history_hash(history)}"
+
+        recent = await redis.zrevrange(f"{bucket}:used", 0, self.scan_limit - 1)
+        if not recent:
+            return None, bucket, vector
+        stored = await redis.hmget(f"{bucket}:vectors", recent)
+        # entries from before a KEY_DIMENSIONS change are skipped
+        pairs = [
+            (f, v) for f, v in zip(recent, stored) if v and len(v) == vector.nbytes
+        ]
+        if not pairs:
+            return None, bucket, vector
+        fields = [f for f, _ in pairs]
+        matrix = np.frombuffer(b"".join(v for _, v in pairs), dtype=np.float32).reshape(
+            len(fields), -1
+        )
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None, bucket, vector
+
+        entry = await redis.hget(f"{bucket}:answers", fields[best])
+        if entry is None:
+            return None, bucket, vector
+        entry = json.loads(entry)
+        if entry["expires_at"] < time.time():
+            await self._aremove(redis, bucket, [fields[best]])
+            return None, bucket, vector
+        await redis.zadd(f"{bucket}:used", {fields[best]: time.time()})
+        return entry["answer"], bucket, vector
+
+    async def astore(
+        self, bucket: str, query: str, vector: np.ndarray, answer: str
+    ) -> None:
+        redis = self._redis()
+        field = text_hash(query)
+        entry = {"query": query, "answer": answer, "expires_at": time.time() + self.ttl}
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hset(f"{bucket}:vectors", field, vector.tobytes())
+            pipe.hset(f"{bucket}:answers", field, json.dumps(entry))
+            pipe.zadd(f"{bucket}:used", {field: time.time()})
+            for suffix in ("vectors", "answers", "used"):
+                pipe.expire(f"{bucket}:{suffix}", self.ttl)
+            pipe.zcard(f"{bucket}:used")
+            *_, size = await pipe.execute()
+        if size > self.max_entries:
+            evicted = await redis.zpopmin(f"{bucket}:used", size - self.max_entries)
+            await self._aremove(redis, bucket, [f for f, _ in evicted])
+
+    async def _aremove(self, redis, bucket: str, fields: List) -> None:
+        if not fields:
+            return
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hdel(f"{bucket}:vectors", *fields)
+            pipe.hdel(f"{bucket}:answers", *fields)
+            pipe.zrem(f"{bucket}:used", *fields)
+            await pipe.execute()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def wrap(self, answer_chain: Runnable, query_key: str = "query") -> Runnable:
+        """Put the cache in front of a chain that streams a string answer.
+
+        The chain input must carry the query to match on under query_key and
+        the chat history under "history". Hits are replayed as a stream through
+        a run tagged "cached", misses stream from answer_chain and are stored
+        once complete. The redis client is async, so a sync invoke skips the
+        cache and runs answer_chain directly; langserve serves /chat through
+        the async path.
+        """
+        replay = RunnableLambda(_chunks).with_config(
+            {
+                "run_name": "SemanticCacheHit",
+                "tags": ["cached"],
+                "metadata": {"cached": True},
+            }
+        )
+
+        async def acached(inputs: Dict, config: RunnableConfig) -> AsyncIterator[str]:
+            query, history = inputs[query_key], inputs["history"]
+            try:
+                answer, bucket, vector = await self.alookup(query, history)
+            except Exception as e:
+                logger.warning(f"Semantic cache lookup failed: {e}")
+                answer, bucket = None, None
+
+            if answer is not None:
+                self.hits += 1
+                for chunk in await replay.ainvoke(answer, config):
+                    yield chunk
+                return
+
+            self.misses += 1
+            chunks = []
+            async for chunk in answer_chain.astream(inputs, config):
+                chunks.append(chunk)
+                yield chunk
+            if bucket is not None:
+                try:
+                    await self.astore(bucket, query, vector, "".join(chunks))
+                except Exception as e:
+                    logger.warning(f"Semantic cache store failed: {e}")
+
+        def uncached(inputs: Dict, config: RunnableConfig) -> str:
+            return answer_chain.invoke(inputs, config)
+
+        return RunnableLambda(uncached, afunc=acached).with_config(
+            {"run_name": "SemanticCache"}
+        )
@@ -0,0 +1,163 @@
+"""Startup phase for the api workers.
+
+Importing langchain, langgraph, chromadb, faiss and pandas and building the
+chains takes seconds, and the first request after that used to pay for cold
+connections and first-call setup on top. The app now imports nothing heavy
+at module level. The lifespan builds everything here in a worker thread,
+opens the connection pools and runs one chat turn through a copy of the
+chain backed by local stubs, and only then reports the worker ready.
+"""
+
+import time
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+WARMUP_MESSAGES = [
+    {"role": "user", "content": "What is the latest consumer price index?"}
+]
+WARMUP_ANSWER = "Consumer price index\nInflation rate"
+# text-embedding-3-small, used when the collection is still empty
+DEFAULT_EMBEDDING_SIZE = 1536
+
+
+class Services:
+    """Chains and clients shared by the endpoints, built by build_services"""
+
+    def __init__(
+        self,
+        clients,
+        collection_mirror,
+        lexical_index,
+        rag_chain,
+        generate_meta_graph,
+        meta_cache,
+        max_messages: Optional[int] = None,
+    ):
+        self.clients = clients
+        self.collection_mirror = collection_mirror
+        self.lexical_index = lexical_index
+        self.rag_chain = rag_chain
+        self.generate_meta_graph = generate_meta_graph
+        self.meta_cache = meta_cache
+        self.max_messages = max_messages
+        # seconds per startup stage, reported by /ready
+        self.timings: Dict[str, float] = {}
+
+
+def build_services(max_messages: Optional[int] = None) -> Services:
+    """Import the heavy modules and build the chains. Blocking, run it in a
+    worker thread so the event loop keeps answering /health meanwhile."""
+    timings = {}
+    start = time.perf_counter()
+    from chain import create_new_chain
+    from clients import ClientRegistry
+    from generate_meta import build_generate_meta_graph
+    from meta_cache import MetaResponseCache
+    from mirror import CollectionMirror
+    from utils.bm25 import BM25Index
+
+    timings["imports"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # one set of connection pools for every chain, closed on shutdown
+    clients = ClientRegistry()
+    collection_mirror = (
+        CollectionMirror(client=clients.chroma())
+        if CollectionMirror.enabled()
+        else None
+    )
+    lexical_index = BM25Index()
+    lexical_index.load()
+    rag_chain = create_new_chain(
+        clients,
+        mirror=collection_mirror,
+        lexical=lexical_index,
+        max_messages=max_messages,
+    )
+    generate_meta_graph = build_generate_meta_graph(clients, mirror=collection_mirror)
+    meta_cache = (
+        MetaResponseCache(clients.http_async_client)
+        if MetaResponseCache.enabled()
+        else None
+    )
+    timings["build"] = time.perf_counter() - start
+    services = Services(
+        clients,
+        collection_mirror,
+        lexical_index,
+        rag_chain,
+        generate_meta_graph,
+        meta_cache,
+        max_messages=max_messages,
+    )
+    services.timings.update(timings)
+    return services
+
+
+class WarmupClients:
+    """Stands in for ClientRegistry in the warm-up chain.
+
+    Chroma is the real, shared client, so its pool is opened and the
+    retrieval path runs for real. Chat models and embeddings are local
+    stubs, so the warm-up spends no tokens and never writes fake vectors
+    to the embedding cache.
+    """
+
+    def __init__(self, clients):
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        self.clients = clients
+        stored = clients.vectorstore().get(limit=1, include=["embeddings"])
+        size = (
+            len(stored["embeddings"][0])
+            if len(stored["embeddings"])
+            else DEFAULT_EMBEDDING_SIZE
+        )
+        self._embeddings = DeterministicFakeEmbedding(size=size)
+
+    def chat_model(self, model: str, temperature: float = 0, **kwargs):
+        from langchain_core.language_models import FakeListChatModel
+
+        return FakeListChatModel(responses=[WARMUP_ANSWER])
+
+    def embeddings(self):
+        return self._embeddings
+
+    def vectorstore(self, collection_name: str = "dgmy_docs"):
+        from langchain_chroma import Chroma
+
+        return Chroma(
+            client=self.clients.chroma(),
+            collection_name=collection_name,
+            embedding_function=self._embeddings,
+        )
+
+
+async def warm_up(services: Services) -> None:
+    """Open the connection pools and run one chat turn on local stubs"""
+    from chain import create_new_chain
+    from utils.executors import run_io
+
+    start = time.perf_counter()
+    await services.clients.awarm()
+    services.timings["pools"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stubs = await run_io(WarmupClients, services.clients)
+    # same mirror, lexical index and caches as the real chain, no answer cache
+    chain = await run_io(
+        create_new_chain,
+        stubs,
+        mirror=services.collection_mirror,
+        lexical=services.lexical_index,
+        max_messages=services.max_messages,
+        semantic_cache=False,
+    )
+    async for _ in chain.astream(
+        {"messages": WARMUP_MESSAGES},
+        {"run_name": "WarmUp", "tags": ["warmup"]},
+    ):
+        pass
+    services.timings["warmup"] = time.perf_counter() - start
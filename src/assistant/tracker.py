@@ -0,0 +1,144 @@
+"""Change detection for ingest sources.
+
+Fingerprints (git blob SHAs for MDX files, content hashes for parquet files)
+are stored next to the record manager tables so a run can skip loading and
+parsing sources that have not changed since the last successful index.
+"""
+
+import os
+import time
+import hashlib
+import requests
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Column, Float, MetaData, String, Table, create_engine, select
+
+# seconds to wait on a HEAD request before treating the source as changed
+HEAD_TIMEOUT = 30
+
+
+class SourceTracker:
+    """Stores the last indexed fingerprint of each ingest source."""
+
+    def __init__(self, namespace: str, db_url: str):
+        self.namespace = namespace
+        self.engine = create_engine(db_url)
+        self.metadata = MetaData()
+        self.table = Table(
+            "source_fingerprints",
+            self.metadata,
+            Column("namespace", String, primary_key=True),
+            Column("source", String, primary_key=True),
+            Column("fingerprint", String, nullable=False),
+            Column("mtime", Float, nullable=True),
+            Column("updated_at", Float, nullable=False),
+        )
+
+    def create_schema(self) -> None:
+        self.metadata.create_all(self.engine)
+
+    def get_all(self) -> Dict[str, Tuple[str, Optional[float]]]:
+        """Return {source: (fingerprint, mtime)} for this namespace."""
+        query = select(
+            self.table.c.source, self.table.c.fingerprint, self.table.c.mtime
+        ).where(self.table.c.namespace == self.namespace)
+        with self.engine.connect() as conn:
+            return {
+                row.source: (row.fingerprint, row.mtime) for row in conn.execute(query)
+            }
+
+    def diff(self, current: Dict[str, str]) -> Tuple[List[str], List[str], List[str]]:
+        """Compare current fingerprints against stored ones.
+
+        Returns:
+            changed, unchanged, removed: lists of source keys
+        """
+        stored = self.get_all()
+        changed, unchanged = [], []
+        for source, fingerprint in current.items():
+            if (
+                fingerprint is not None
+                and stored.get(source, (None,))[0] == fingerprint
+            ):
+                unchanged.append(source)
+            else:
+                changed.append(source)
+        removed = [source for source in stored if source not in current]
+        return changed, unchanged, removed
+
+    def update(
+        self, fingerprints: Dict[str, str], mtimes: Optional[Dict[str, float]] = None
+    ) -> None:
+        """Record fingerprints for sources that were indexed successfully."""
+        mtimes = mtimes or {}
+        now = time.time()
+        with self.engine.begin() as conn:
+            for source, fingerprint in fingerprints.items():
+                if fingerprint is None:
+                    continue
+                where = (self.table.c.namespace == self.namespace) & (
+                    self.table.c.source == source
+                )
+                conn.execute(self.table.delete().where(where))
+                conn.execute(
+                    self.table.insert().values(
+                        namespace=self.namespace,
+                        source=source,
+                        fingerprint=fingerprint,
+                        mtime=mtimes.get(source),
+                        updated_at=now,
+                    )
+                )
+
+    def delete(self, sources: List[str]) -> None:
+        if not sources:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(
+                self.table.delete().where(
+                    (self.table.c.namespace == self.namespace)
+                    & (self.table.c.source.in_(sources))
+                )
+            )
+
+
+def fingerprint_file(
+    path: str, known: Optional[Tuple[str, Optional[float]]] = None
+) -> Tuple[Optional[str], Optional[float]]:
+    """Fingerprint a local or remote (http) file.
+
+    Local files are only re-hashed when their mtime differs from the stored one.
+    Remote files use the ETag, or Last-Modified plus Content-Length, from a HEAD
+    request. Returns (None, None) when no fingerprint can be computed, e.g. the
+    host is unreachable, which marks the source as changed.
+
+    Returns:
+        fingerprint, mtime
+    """
+    if path.startswith(("http://", "https://")):
+        try:
+            response = requests.head(path, allow_redirects=True, timeout=HEAD_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"Could not fingerprint {path}: {e}")
+            return None, None
+        if not response.ok:
+            return None, None
+        etag = response.headers.get("etag")
+        if etag:
+            return f"etag:{etag}", None
+        last_modified = response.headers.get("last-modified")
+        if last_modified:
+            length = response.headers.get("content-length", "")
+            return f"lm:{last_modified}:{length}", None
+        return None, None
+
+    if not os.path.exists(path):
+        return None, None
+    mtime = os.stat(path).st_mtime
+    if known and known[1] == mtime:
+        return known[0], mtime
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha.update(block)
+    return f"sha256:{sha.hexdigest()}", mtime
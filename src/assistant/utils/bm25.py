@@ -0,0 +1,187 @@
+import os
+import re
+import json
+import shutil
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.executors import run_io
+from utils.helpers import data_path
+
+DEFAULT_INDEX_PATH = data_path("bm25")
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+
+# keeps snake_case api parameters and dataset ids like fuelprice intact
+TOKEN_PATTERN = re.compile(r"[0-9a-z_]+")
+STOPWORDS = frozenset(
+    # english
+    "a an and are as at be by can do does for from how i in is it of on or "
+    "that the this to what when where which who why with you your "
+    # malay
+    "adakah apa bagaimana dalam dan dari di dengan ialah ini itu ke kepada "
+    "mana oleh pada saya untuk yang".split()
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_index_path() -> str:
+    return os.getenv("BM25_INDEX_PATH") or DEFAULT_INDEX_PATH
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def build_bm25(
+    ids: List[str],
+    documents: List[str],
+    metadatas: List[Dict],
+    path: str,
+    version: str,
+    k1: float = DEFAULT_K1,
+    b: float = DEFAULT_B,
+) -> None:
+    """Build a BM25 index and write it to path as memory-mappable arrays.
+
+    Postings are stored term-major in CSR form with the full BM25 weight of
+    each (term, document) pair precomputed, so a lookup is a sum of slices.
+    The directory is written aside and swapped in, readers never see a
+    partial index.
+    """
+    vocab = {}
+    terms, docs, counts = [], [], []
+    lengths = np.zeros(len(documents), dtype=np.float32)
+    for i, text in enumerate(documents):
+        tokens = tokenize(text or "")
+        lengths[i] = len(tokens)
+        for term, count in Counter(tokens).items():
+            terms.append(vocab.setdefault(term, len(vocab)))
+            docs.append(i)
+            counts.append(count)
+    terms = np.asarray(terms, dtype=np.int64)
+    docs = np.asarray(docs, dtype=np.int32)
+    counts = np.asarray(counts, dtype=np.float32)
+
+    order = np.argsort(terms, kind="stable")
+    terms, docs, counts = terms[order], docs[order], counts[order]
+    df = np.bincount(terms, minlength=len(vocab))
+    n_docs = len(documents)
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+    avgdl = lengths.mean() if n_docs else 0.0
+    norm = k1 * (1 - b + b * lengths[docs] / (avgdl or 1))
+    weights = (idf[terms] * counts * (k1 + 1) / (counts + norm)).astype(np.float32)
+    indptr = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "indptr.npy"), indptr)
+    np.save(os.path.join(tmp_path, "postings.npy"), docs)
+    np.save(os.path.join(tmp_path, "weights.npy"), weights)
+    with open(os.path.join(tmp_path, "vocab.json"), "w") as file:
+        json.dump(vocab, file)
+    with open(os.path.join(tmp_path, "docs.json"), "w") as file:
+        json.dump({"ids": ids, "documents": documents, "metadatas": metadatas}, file)
+    # meta goes last, its presence marks a complete index
+    with open(os.path.join(tmp_path, "meta.json"), "w") as file:
+        json.dump({"version": version, "n_docs": n_docs, "k1": k1, "b": b}, file)
+
+    old_path = f"{path}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def artifact_version(path: str) -> Optional[str]:
+    try:
+        with open(os.path.join(path, "meta.json"), "r") as file:
+            return json.load(file)["version"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+
+
+class _Arrays:
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), "r") as file:
+            self.version = json.load(file)["version"]
+        self.indptr = np.load(os.path.join(path, "indptr.npy"), mmap_mode="r")
+        self.postings = np.load(os.path.join(path, "postings.npy"), mmap_mode="r")
+        self.weights = np.load(os.path.join(path, "weights.npy"), mmap_mode="r")
+        with open(os.path.join(path, "vocab.json"), "r") as file:
+            self.vocab = json.load(file)
+        with open(os.path.join(path, "docs.json"), "r") as file:
+            docs = json.load(file)
+        self.ids = docs["ids"]
+        self.documents = docs["documents"]
+        self.metadatas = docs["metadatas"]
+
+
+class BM25Index:
+    """Read side of the BM25 artifact that ingest writes.
+
+    Usage:
+        bm25 = BM25Index()
+        bm25.load()
+        hits = bm25.search("fuelprice api", k=4)
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or get_index_path()
+        self._arrays = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._arrays is not None
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._arrays.version if self._arrays else None
+
+    def load(self) -> bool:
+        """Load (or reload) the index from disk, False if there is none yet."""
+        if artifact_version(self.path) is None:
+            return False
+        self._arrays = _Arrays(self.path)
+        logger.info(
+            f"Loaded BM25 index version {self.version} "
+            f"({len(self._arrays.ids)} docs, {len(self._arrays.vocab)} terms)"
+        )
+        return True
+
+    async def refresh(self, version: str) -> None:
+        """Reload if ingest wrote a newer index, for the index version watcher."""
+        if artifact_version(self.path) != self.version:
+            await run_io(self.load)
+
+    def search(self, query: str, k: int) -> List[int]:
+        """Positions of the top k documents for query, best first."""
+        arrays = self._arrays
+        scores = np.zeros(len(arrays.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            row = arrays.vocab.get(term)
+            if row is None:
+                continue
+            start, end = arrays.indptr[row], arrays.indptr[row + 1]
+            # each document appears once per posting list
+            scores[arrays.postings[start:end]] += arrays.weights[start:end]
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        # stable on position so ties rank the same on every call
+        return hits[np.lexsort((hits, -scores[hits]))].tolist()
+
+    def get(self, position: int) -> Tuple[str, str, Dict]:
+        """(id, document, metadata) of the document at a position"""
+        arrays = self._arrays
+        return (
+            arrays.ids[position],
+            arrays.documents[position],
+            arrays.metadatas[position],
+        )
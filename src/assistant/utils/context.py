@@ -0,0 +1,149 @@
+import os
+import logging
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+import tiktoken
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, BaseMessage
+
+from utils.timing import context_timing
+
+DEFAULT_CONTEXT_TOKENS = 4000
+DEFAULT_HISTORY_TOKENS = 2000
+# shortest shared run of characters treated as a chunk overlap, well under
+# the text splitter's chunk_overlap so partial overlaps still join
+MIN_OVERLAP_CHARS = 20
+SEPARATOR = "\n\n"
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def get_encoding() -> tiktoken.Encoding:
+    # gpt-4.1 models use o200k_base
+    return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode_ordinary(text))
+
+
+def merge_overlap(first: str, second: str) -> Optional[str]:
+    """Join two chunks of one section if they overlap, None if they don't.
+
+    Covers duplicates, one chunk containing the other, and consecutive
+    chunks that share the text splitter overlap in either order.
+    """
+    if second in first:
+        return first
+    if first in second:
+        return second
+    for head, tail in ((first, second), (second, first)):
+        prefix = tail[:MIN_OVERLAP_CHARS]
+        start = head.find(prefix)
+        while start != -1:
+            if tail.startswith(head[start:]):
+                return head[:start] + tail
+            start = head.find(prefix, start + 1)
+    return None
+
+
+def trim_history(
+    history: List[BaseMessage],
+    max_messages: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+) -> List[BaseMessage]:
+    """Keep the most recent messages that fit both limits.
+
+    The trimmed history never opens with an assistant message, which would
+    answer a question the model can no longer see.
+    """
+    max_tokens = max_tokens or int(
+        os.getenv("HISTORY_TOKEN_BUDGET") or DEFAULT_HISTORY_TOKENS
+    )
+    if max_messages is not None:
+        history = history[max(len(history) - max_messages, 0) :]
+    kept, tokens = [], 0
+    for message in reversed(history):
+        tokens += count_tokens(message.content)
+        if tokens > max_tokens:
+            break
+        kept.append(message)
+    kept.reverse()
+    while kept and isinstance(kept[0], AIMessage):
+        kept.pop(0)
+    return kept
+
+
+class ContextBuilder:
+    """Renders ranked documents into a context string under a token budget.
+
+    Chunks sharing a source and header are merged into the highest ranked
+    of them first, so overlapping splits of one section are sent once.
+    Sections are then added in rank order while they fit; one that doesn't
+    is skipped in favour of smaller ones further down.
+
+    Usage:
+        builder = ContextBuilder(render=retriever.get_page_content)
+        context = builder.build(docs)
+    """
+
+    def __init__(
+        self,
+        render: Callable[[Document], str],
+        budget: Optional[int] = None,
+    ):
+        self.render = render
+        self.budget = budget or int(
+            os.getenv("CONTEXT_TOKEN_BUDGET") or DEFAULT_CONTEXT_TOKENS
+        )
+        # load the encoding at startup rather than on the first request
+        get_encoding()
+
+    def _sections(self, docs: List[Document]) -> List[Document]:
+        groups: Dict[Tuple, List[List[Document]]] = {}
+        # sections in rank order of their best chunk, each a one-item list so
+        # a merge can swap the document in place
+        sections = []
+        for doc in docs:
+            key = (doc.metadata.get("source"), doc.metadata.get("header"))
+            group = groups.setdefault(key, [])
+            for section in group:
+                merged = merge_overlap(section[0].page_content, doc.page_content)
+                if merged is not None:
+                    if merged != section[0].page_content:
+                        # rendered text is cached by id, a merged chunk has none
+                        section[0] = Document(
+                            page_content=merged, metadata=section[0].metadata
+                        )
+                    break
+            else:
+                group.append([doc])
+                sections.append(group[-1])
+        return [section[0] for section in sections]
+
+    def build(self, docs: List[Document]) -> str:
+        with context_timing.measure("docs"):
+            sections = self._sections(docs)
+            parts, tokens = [], 0
+            separator_tokens = count_tokens(SEPARATOR)
+            for section in sections:
+                text = self.render(section)
+                cost = count_tokens(text) + (separator_tokens if parts else 0)
+                if tokens + cost <= self.budget:
+                    parts.append(text)
+                    tokens += cost
+            if not parts and sections:
+                # even the best section alone is over budget, send what fits
+                encoding = get_encoding()
+                text = self.render(sections[0])
+                parts.append(
+                    encoding.decode(encoding.encode_ordinary(text)[: self.budget])
+                )
+                tokens = self.budget
+        logger.debug(
+            f"Context: {len(docs)} docs, {len(sections)} sections, "
+            f"{len(parts)} used, {tokens}/{self.budget} tokens"
+        )
+        return SEPARATOR.join(parts)
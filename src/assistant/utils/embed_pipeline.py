@@ -0,0 +1,239 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import tiktoken
+from langchain_core.documents import Document
+
+from utils.embeddings import CachedEmbeddings
+
+DEFAULT_BATCH_TOKENS = 100_000
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TOKENS_PER_MINUTE = 1_000_000
+DEFAULT_MAX_RETRIES = 6
+# documents per embedding window when streaming into the index
+DEFAULT_WINDOW = 1000
+# openai embeddings endpoint limit on inputs per request
+MAX_BATCH_INPUTS = 2048
+
+
+async def _cancel_pending() -> None:
+    """Cancel every other task on the running loop and wait for them to exit"""
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _windows(items: Iterable, size: int) -> Iterator[List]:
+    window = []
+    for item in items:
+        window.append(item)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+class TokenRateLimiter:
+    """Async limiter on tokens spent over a sliding one minute window."""
+
+    def __init__(self, tokens_per_minute: int):
+        self.tokens_per_minute = tokens_per_minute
+        self._events = deque()
+        self._used = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._events and now - self._events[0][0] >= 60:
+                    self._used -= self._events.popleft()[1]
+                # always let a batch through on an empty window, even if oversized
+                if not self._events or self._used + tokens <= self.tokens_per_minute:
+                    self._events.append((now, tokens))
+                    self._used += tokens
+                    return
+                await asyncio.sleep(60 - (now - self._events[0][0]))
+
+
+class EmbeddingPipeline:
+    """Embed texts into the embedding cache ahead of indexing.
+
+    Texts are packed into token-budgeted batches, embedded several at a time
+    under a tokens-per-minute limit, and each batch is retried with backoff on
+    its own. Finished batches are written to the embedding cache as they
+    complete, so the cache doubles as a checkpoint: a rerun after a crash or
+    timeout only embeds what is still missing.
+    """
+
+    def __init__(
+        self,
+        embeddings: CachedEmbeddings,
+        batch_tokens: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        encoding: Optional[tiktoken.Encoding] = None,
+    ):
+        self.embeddings = embeddings
+        self.batch_tokens = batch_tokens or int(
+            os.getenv("EMBED_BATCH_TOKENS") or DEFAULT_BATCH_TOKENS
+        )
+        self.concurrency = concurrency or int(
+            os.getenv("EMBED_CONCURRENCY") or DEFAULT_CONCURRENCY
+        )
+        self.tokens_per_minute = tokens_per_minute or int(
+            os.getenv("EMBED_TOKENS_PER_MINUTE") or DEFAULT_TOKENS_PER_MINUTE
+        )
+        self.max_retries = (
+            max_retries
+            if max_retries is not None
+            else int(os.getenv("EMBED_MAX_RETRIES") or DEFAULT_MAX_RETRIES)
+        )
+        # text-embedding-3 models use cl100k_base
+        self.encoding = encoding or tiktoken.get_encoding("cl100k_base")
+        self.totals = {}
+
+    def pack(self, texts: List[str]) -> List[Dict]:
+        """Pack texts into batches under the token and input count limits.
+
+        Returns:
+            batches: list of dicts with texts and their total tokens
+        """
+        batches = []
+        current, current_tokens = [], 0
+        for text in texts:
+            tokens = len(self.encoding.encode_ordinary(text))
+            if current and (
+                current_tokens + tokens > self.batch_tokens
+                or len(current) >= MAX_BATCH_INPUTS
+            ):
+                batches.append({"texts": current, "tokens": current_tokens})
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            batches.append({"texts": current, "tokens": current_tokens})
+        return batches
+
+    async def _embed_batch(
+        self, batch: Dict, limiter: TokenRateLimiter, semaphore: asyncio.Semaphore
+    ) -> int:
+        """Embed one batch with retries, returning the number of retries used"""
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                await limiter.acquire(batch["tokens"])
+                try:
+                    await self.embeddings.aembed_documents(batch["texts"])
+                    return attempt
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        raise
+                    delay = min(2**attempt, 60) + random.random()
+                    print(
+                        f"Embedding batch of {len(batch['texts'])} failed ({e}), "
+                        f"retrying in {delay:.1f}s"
+                    )
+                    await asyncio.sleep(delay)
+
+    async def arun(
+        self, texts: List[str], limiter: Optional[TokenRateLimiter] = None
+    ) -> Dict:
+        """Embed uncached texts, adding to the pipeline totals.
+
+        Raises RuntimeError if any batch still fails after retries; finished
+        batches are already checkpointed in the cache by then.
+        """
+        limiter = limiter or TokenRateLimiter(self.tokens_per_minute)
+        missing = self.embeddings.uncached(texts)
+        batches = self.pack(missing)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(
+            *(self._embed_batch(batch, limiter, semaphore) for batch in batches),
+            return_exceptions=True,
+        )
+
+        failed = [r for r in results if isinstance(r, Exception)]
+        done = [b for b, r in zip(batches, results) if not isinstance(r, Exception)]
+        stats = {
+            "texts": len(texts),
+            "cached": len(set(texts)) - len(missing),
+            "embedded": sum(len(b["texts"]) for b in done),
+            "tokens": sum(b["tokens"] for b in done),
+            "batches": len(batches),
+            "failed_batches": len(failed),
+            "retries": sum(r for r in results if isinstance(r, int)),
+        }
+        for key, value in stats.items():
+            self.totals[key] = self.totals.get(key, 0) + value
+        if failed:
+            raise RuntimeError(
+                f"{len(failed)} of {len(batches)} embedding batches failed"
+            ) from failed[0]
+        return stats
+
+    def report(self, elapsed: float) -> Dict:
+        """Print throughput over the pipeline totals"""
+        totals = dict(self.totals)
+        totals["seconds"] = round(elapsed, 2)
+        totals["docs_per_s"] = (
+            round(totals.get("embedded", 0) / elapsed, 1) if elapsed else 0.0
+        )
+        totals["tokens_per_s"] = (
+            round(totals.get("tokens", 0) / elapsed, 1) if elapsed else 0.0
+        )
+        print(
+            f"Embedded {totals.get('embedded', 0)} docs "
+            f"({totals.get('tokens', 0)} tokens) in {elapsed:.1f}s: "
+            f"{totals['docs_per_s']} docs/s, {totals['tokens_per_s']} tokens/s "
+            f"({totals.get('cached', 0)} already cached, "
+            f"{totals.get('failed_batches', 0)} batches failed)"
+        )
+        return totals
+
+    def stream(
+        self, docs: Iterable[Document], window: Optional[int] = None
+    ) -> Iterator[Document]:
+        """Embed documents window by window while passing them downstream.
+
+        Each window is embedded while the previous one is consumed, so fetching,
+        parsing, embedding and indexing overlap. A single event loop runs in a
+        background thread for the whole stream, keeping the async http clients
+        and rate limiter on one loop.
+        """
+        window = window or int(os.getenv("EMBED_WINDOW") or DEFAULT_WINDOW)
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        limiter = TokenRateLimiter(self.tokens_per_minute)
+        start = time.perf_counter()
+
+        def submit(batch):
+            texts = [doc.page_content for doc in batch]
+            return asyncio.run_coroutine_threadsafe(self.arun(texts, limiter), loop)
+
+        try:
+            pending = None
+            for batch in _windows(docs, window):
+                future = submit(batch)
+                if pending:
+                    pending[1].result()
+                    yield from pending[0]
+                pending = (batch, future)
+            if pending:
+                pending[1].result()
+                yield from pending[0]
+        finally:
+            # a consumer that stops early leaves a window in flight
+            asyncio.run_coroutine_threadsafe(_cancel_pending(), loop).result()
+            self.report(time.perf_counter() - start)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
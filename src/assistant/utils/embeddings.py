@@ -0,0 +1,227 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai.embeddings import OpenAIEmbeddings
+
+from utils.executors import run_io
+from utils.helpers import data_path
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+DEFAULT_CACHE_PATH = data_path("embeddings.sqlite")
+DEFAULT_MAX_ENTRIES = 500_000
+# last_used is only rewritten once it is this stale, eviction needs no finer order
+TOUCH_INTERVAL = 3600
+# inserted rows between COUNT(*) checks, unless the cap may have been crossed
+EVICT_CHECK_EVERY = 10_000
+
+# sqlite caps the number of bound parameters per statement
+_QUERY_CHUNK = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite store of float32 vectors keyed on (model, sha256(text)).
+
+    Rows carry a last-used timestamp; once the table grows past max_entries
+    the least recently used rows are evicted. Hits only refresh timestamps
+    older than TOUCH_INTERVAL, queued and written in batches, and the table
+    is only counted every EVICT_CHECK_EVERY inserts or when it may be full.
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # shared between ingest and the api, so let sqlite serialise writers
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        # hashes hit since the last flush, by model
+        self._touched: Dict[str, set] = {}
+        self._inserted = 0
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+            )
+            (self._count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        """Return vectors for the hashes present in the cache, marking them used."""
+        found = {}
+        stale_before = time.time() - TOUCH_INTERVAL
+        with self._lock:
+            touched = self._touched.setdefault(model, set())
+            for i in range(0, len(hashes), _QUERY_CHUNK):
+                chunk = hashes[i : i + _QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector, last_used FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *chunk],
+                ).fetchall()
+                for key, vector, last_used in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+                    if last_used < stale_before:
+                        touched.add(key)
+            if sum(map(len, self._touched.values())) >= _QUERY_CHUNK:
+                with self._conn:
+                    self._flush_touched()
+        return found
+
+    def contains(self, model: str, hashes: List[str]) -> set:
+        """Return the subset of hashes present in the cache."""
+        present = set()
+        with self._lock:
+            for i in range(0, len(hashes), _QUERY_CHUNK):
+                chunk = hashes[i : i + _QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *chunk],
+                ).fetchall()
+                present.update(key for (key,) in rows)
+        return present
+
+    def put_many(self, model: str, vectors: Dict[str, List[float]]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                [
+                    (model, key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                    for key, vector in vectors.items()
+                ],
+            )
+            self._flush_touched()
+            self._count += len(vectors)
+            self._inserted += len(vectors)
+            self._evict()
+
+    def flush(self) -> None:
+        """Write queued last-used updates"""
+        with self._lock, self._conn:
+            self._flush_touched()
+
+    def _flush_touched(self) -> None:
+        now = time.time()
+        for model, touched in self._touched.items():
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(now, model, key) for key in touched],
+            )
+            touched.clear()
+
+    def _evict(self) -> None:
+        # _count only sees this process's inserts, recount now and then
+        if self._count <= self.max_entries and self._inserted < EVICT_CHECK_EVERY:
+            return
+        (self._count,) = self._conn.execute(
+            "SELECT COUNT(*) FROM embeddings"
+        ).fetchone()
+        self._inserted = 0
+        if self._count > self.max_entries:
+            # evict a tenth more than needed so the next puts skip the count
+            keep = self.max_entries - self.max_entries // 10
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (self._count - keep,),
+            )
+            self._count = keep
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated texts from an EmbeddingCache.
+
+    Works with any Embeddings implementation, so tests can pass a fake one.
+    """
+
+    def __init__(self, underlying: Embeddings, model: str, cache: EmbeddingCache):
+        self.underlying = underlying
+        self.model = model
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, texts: List[str]):
+        hashes = [text_hash(text) for text in texts]
+        found = self.cache.get_many(self.model, list(set(hashes)))
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key not in found:
+                missing[key] = text
+        self.hits += sum(key in found for key in hashes)
+        self.misses += len(missing)
+        return hashes, found, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes, found, missing = self._lookup(texts)
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            new = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model, new)
+            found.update(new)
+        return [found[key] for key in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # sqlite calls may wait on the ingest writer, keep them off the event loop
+        hashes, found, missing = await run_io(self._lookup, texts)
+        if missing:
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            new = dict(zip(missing.keys(), vectors))
+            await run_io(self.cache.put_many, self.model, new)
+            found.update(new)
+        return [found[key] for key in hashes]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def uncached(self, texts: List[str]) -> List[str]:
+        """Unique texts that have no cached vector yet."""
+        unique = {text_hash(text): text for text in texts}
+        present = self.cache.contains(self.model, list(unique))
+        return [text for key, text in unique.items() if key not in present]
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def get_embeddings(
+    model: str = EMBEDDING_MODEL, underlying: Optional[Embeddings] = None
+) -> CachedEmbeddings:
+    """Build the cached embedding model shared by ingest and the api."""
+    if underlying is None:
+        underlying = OpenAIEmbeddings(model=model)
+    cache = EmbeddingCache(
+        os.getenv("EMBED_CACHE_PATH") or DEFAULT_CACHE_PATH,
+        int(os.getenv("EMBED_CACHE_MAX_ENTRIES") or DEFAULT_MAX_ENTRIES),
+    )
+    return CachedEmbeddings(underlying, model, cache)
@@ -0,0 +1,82 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Callable, Dict, Optional, TypeVar
+
+from langchain_core.runnables.config import run_in_executor
+
+from utils.timing import LatencyStats
+
+DEFAULT_CPU_WORKERS = os.cpu_count() or 1
+# python's own default for the loop executor
+DEFAULT_IO_WORKERS = min(32, DEFAULT_CPU_WORKERS + 4)
+DEFAULT_LAG_INTERVAL = 0.5
+DEFAULT_LAG_WARN_MS = 100
+
+IO = "io"
+CPU = "cpu"
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+
+# how late the event loop wakes up, sampled by monitor_loop_lag
+loop_lag = LatencyStats("event loop lag", logger=logger)
+
+
+def get_executor(kind: str) -> ThreadPoolExecutor:
+    """Shared pool for blocking I/O (files, sync http, sqlite) or CPU work
+    (pandas, numpy, FAISS), sized by IO_WORKERS and CPU_WORKERS."""
+    if kind not in _executors:
+        if kind == IO:
+            workers = int(os.getenv("IO_WORKERS") or DEFAULT_IO_WORKERS)
+        else:
+            workers = int(os.getenv("CPU_WORKERS") or DEFAULT_CPU_WORKERS)
+        _executors[kind] = ThreadPoolExecutor(workers, thread_name_prefix=kind)
+    return _executors[kind]
+
+
+async def run_io(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking I/O call off the event loop"""
+    # contextvars carry the tracing callbacks into the worker thread
+    return await run_in_executor(
+        get_executor(IO), copy_context().run, func, *args, **kwargs
+    )
+
+
+async def run_cpu(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run CPU-bound work off the event loop"""
+    return await run_in_executor(
+        get_executor(CPU), copy_context().run, func, *args, **kwargs
+    )
+
+
+def shutdown_executors(wait: bool = False) -> None:
+    for executor in _executors.values():
+        executor.shutdown(wait=wait, cancel_futures=True)
+    _executors.clear()
+
+
+async def monitor_loop_lag(
+    interval: Optional[float] = None, warn_ms: Optional[float] = None
+) -> None:
+    """Measure how late the event loop wakes from a sleep, forever.
+
+    Lag is anything blocking the loop: a slow sync call in an async path
+    delays every other request on the worker by the same amount. Lag over
+    LOOP_LAG_WARN_MS is logged as a warning to alert on.
+    """
+    interval = interval or float(os.getenv("LOOP_LAG_INTERVAL") or DEFAULT_LAG_INTERVAL)
+    warn_ms = warn_ms or float(os.getenv("LOOP_LAG_WARN_MS") or DEFAULT_LAG_WARN_MS)
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - start - interval, 0.0)
+        loop_lag.observe("lag", lag)
+        if lag * 1000 > warn_ms:
+            logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms")
@@ -0,0 +1,212 @@
+import os
+import json
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from utils.helpers import data_path
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_CACHE_DIR = data_path("http_cache")
+RAW_HOST = "raw.githubusercontent.com"
+
+
+def cache_key(url: str) -> str:
+    """Key of url in the http cache.
+
+    Raw file urls are pinned to a commit, the key drops it so a file keeps
+    one entry across commits and an unchanged one revalidates with a 304.
+    """
+    parts = urlsplit(url)
+    if parts.netloc != RAW_HOST:
+        return url
+    segments = parts.path.split("/")
+    # /{owner}/{repo}/{ref}/{path}
+    if len(segments) < 5:
+        return url
+    del segments[3]
+    return f"{parts.scheme}://{parts.netloc}{'/'.join(segments)}"
+
+
+class HttpCache:
+    """On-disk cache of response bodies and their validators, one file per URL."""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, url: str) -> Path:
+        return self.cache_dir / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def get(self, url: str) -> Optional[Dict]:
+        try:
+            with open(self._path(url), "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def set(self, url: str, etag: Optional[str], last_modified: Optional[str], body):
+        entry = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "body": body,
+        }
+        # write then rename so a killed run never leaves a half-written entry
+        path = self._path(url)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, path)
+
+
+class AsyncFetcher:
+    """Connection-pooled async HTTP fetcher with conditional GET support.
+
+    Responses are stored with their ETag/Last-Modified headers, so repeat
+    requests for unchanged URLs come back as 304s and are served from disk.
+
+    Usage:
+        async with AsyncFetcher(token) as fetcher:
+            texts = await fetcher.fetch_all(urls)
+    """
+
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        cache_dir: Optional[str] = None,
+        timeout: float = 30.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        key: Callable[[str], str] = cache_key,
+    ):
+        self.token = token
+        self.concurrency = concurrency or int(
+            os.getenv("FETCH_CONCURRENCY") or DEFAULT_CONCURRENCY
+        )
+        self.cache = HttpCache(
+            cache_dir or os.getenv("FETCH_CACHE_DIR") or DEFAULT_CACHE_DIR
+        )
+        self.timeout = timeout
+        self.transport = transport
+        self.key = key
+        self.stats = {"requests": 0, "not_modified": 0, "downloaded": 0}
+        self._client = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        headers = {"Authorization": f"token {self.token}"} if self.token else {}
+        self._client = httpx.AsyncClient(
+            headers=headers,
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency,
+            ),
+            follow_redirects=True,
+            transport=self.transport,
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._client.aclose()
+        self._client = None
+
+    async def fetch(self, url: str) -> str:
+        """Fetch url as text, revalidating against the local cache."""
+        key = self.key(url)
+        cached = self.cache.get(key)
+        headers = {}
+        if cached:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        async with self._semaphore:
+            response = await self._client.get(url, headers=headers)
+        self.stats["requests"] += 1
+
+        if response.status_code == 304 and cached:
+            self.stats["not_modified"] += 1
+            return cached["body"]
+
+        response.raise_for_status()
+        self.stats["downloaded"] += 1
+        self.cache.set(
+            key,
+            response.headers.get("etag"),
+            response.headers.get("last-modified"),
+            response.text,
+        )
+        return response.text
+
+    async def fetch_json(self, url: str):
+        return json.loads(await self.fetch(url))
+
+    async def fetch_all(self, urls: List[str]) -> List[str]:
+        """Fetch all urls concurrently, returning bodies in the order given."""
+        return await asyncio.gather(*(self.fetch(url) for url in urls))
+
+
+class BlockingFetcher:
+    """AsyncFetcher for synchronous callers, on its own event loop thread.
+
+    Every fetch_all call shares one connection pool until close, instead of
+    paying for a new client and event loop per call.
+
+    Usage:
+        with BlockingFetcher(token) as fetcher:
+            texts = fetcher.fetch_all(urls)
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._fetcher = AsyncFetcher(*args, **kwargs)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def submit_all(self, urls: List[str]) -> Future:
+        """Start fetching urls in the background, bodies come from result()"""
+        return asyncio.run_coroutine_threadsafe(
+            self._fetcher.fetch_all(urls), self._loop
+        )
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return self._fetcher.stats
+
+    def __enter__(self):
+        self._thread.start()
+        self._run(self._fetcher.__aenter__())
+        return self
+
+    async def _aclose(self, *exc):
+        # an early exit can leave a prefetch running, cancel it before closing
+        pending = [
+            task for task in asyncio.all_tasks() if task is not asyncio.current_task()
+        ]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await self._fetcher.__aexit__(*exc)
+
+    def __exit__(self, *exc):
+        try:
+            self._run(self._aclose(*exc))
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+
+    def fetch_all(self, urls: List[str]) -> List[str]:
+        return self.submit_all(urls).result()
@@ -1,8 +1,26 @@
 import re
 import os
 import ast
+from pathlib import Path
 from typing import List, Optional
+import httpx
 import requests
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from utils.sampling import RangeFile
+
+# seconds per request when ingest reads a remote parquet file
+PARQUET_TIMEOUT = 60
+
+# data/ next to the code, the cron runs ingest from $HOME rather than the app dir
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+
+def data_path(*parts: str) -> str:
+    """Default location of a cache or index file under the package data dir"""
+    return str(DATA_DIR.joinpath(*parts))
 
 
 # Text Utils
@@ -23,13 +41,21 @@ def extract_line_without_hash(markdown_string: str) -> Optional[str]:
     return None
 
 
+# runs of heading markers and newlines, collapsed to a space if the run has a newline
+# (same result as removing all # and then collapsing newline runs)
+HEADING_NEWLINE_PATTERN = re.compile(r"[#\n]+")
+# TODO: config this remove list
+CONTENT_TO_REMOVE = ['<FAQBox title="', '">', "</FAQBox>"]
+
+
+def _replace_heading_newline(match: re.Match) -> str:
+    return " " if "\n" in match.group() else ""
+
+
 def clean_content(text: str) -> str:
     """Remove newlines and other cleaning for better embeddings generation"""
-    # TODO: config this remove list
-    to_remove = ['<FAQBox title="', '">', "</FAQBox>"]
-    text = re.sub(r"#+", "", text)  # remove headings
-    text = re.sub(r"\n+", " ", text)  # remove newlines
-    for string in to_remove:
+    text = HEADING_NEWLINE_PATTERN.sub(_replace_heading_newline, text)
+    for string in CONTENT_TO_REMOVE:
         text = text.replace(string, "")
     return text.strip()
 
@@ -75,22 +101,29 @@ def send_telegram(message: str) -> None:
         r = requests.get(url=tf_url, data=params)
 
 
-def read_file_from_repo(repo: str, token: str, file_url: str):
-    """Read file from GitHub repo.
+def read_parquet_columns(
+    source: str, columns: List[str], filters: Optional[pc.Expression] = None
+) -> pd.DataFrame:
+    """Read a projection of a parquet file with pyarrow.
+
+    Only the listed columns are decoded, and filters is pushed down to the
+    scan so non-matching row groups and rows are skipped.
 
     Args:
-        repo (str): GitHub repo name
-        token (str): GitHub token
-        file_url (str): url to file in repo
+        source (str): local path, s3:// uri or http(s) url
+        columns (List[str]): columns to read
+        filters (pc.Expression): optional row filter
 
     Returns:
-        str: file content
+        pd.DataFrame: projected and filtered data
     """
-
-    headers = {"Authorization": f"token {token}"}
-
-    # Send the request
-    response = requests.get(file_url, headers=headers)
-    response.raise_for_status()
-
-    return response.text
+    if source.startswith(("http://", "https://")):
+        # range requests fetch the footer and the projected column chunks
+        # only. No byte limit: ingest needs the whole projection, and a host
+        # without range support is downloaded whole as before
+        with httpx.Client(follow_redirects=True) as client:
+            source_file = RangeFile(client, source, timeout=PARQUET_TIMEOUT)
+            table = pq.read_table(source_file, columns=columns, filters=filters)
+    else:
+        table = pq.read_table(source, columns=columns, filters=filters)
+    return table.to_pandas()
@@ -0,0 +1,70 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+import redis
+
+DEFAULT_REDIS_URL = "redis://host.docker.internal:6381"
+INDEX_VERSION_KEY = "index:version"
+DEFAULT_POLL_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+
+def get_redis_url() -> str:
+    return os.getenv("REDIS_URL") or DEFAULT_REDIS_URL
+
+
+def new_index_version() -> str:
+    return str(time.time_ns())
+
+
+def bump_index_version(version: Optional[str] = None) -> str:
+    """Publish a new index version after ingest changes the vector index.
+
+    Anything derived from index contents (cached answers, local mirrors) is
+    keyed on this value and goes stale as soon as it changes.
+    """
+    version = version or new_index_version()
+    client = redis.Redis.from_url(get_redis_url())
+    try:
+        client.set(INDEX_VERSION_KEY, version)
+    finally:
+        client.close()
+    return version
+
+
+async def aget_index_version(client) -> str:
+    """Read the current index version with an asyncio redis client."""
+    version = await client.get(INDEX_VERSION_KEY)
+    return version.decode() if version else "0"
+
+
+async def watch_index_version(
+    client,
+    listeners: List[Callable[[str], Awaitable[None]]],
+    poll_seconds: Optional[int] = None,
+) -> None:
+    """Call every listener with the new version whenever ingest publishes one.
+
+    A version is only marked seen once all listeners handled it, so a failed
+    refresh is retried on the next poll.
+    """
+    poll_seconds = poll_seconds or int(
+        os.getenv("INDEX_POLL_SECONDS") or DEFAULT_POLL_SECONDS
+    )
+    seen = None
+    while True:
+        try:
+            version = await aget_index_version(client)
+            if version != seen:
+                for listener in listeners:
+                    await listener(version)
+                seen = version
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Index version refresh failed: {e}")
+        await asyncio.sleep(poll_seconds)
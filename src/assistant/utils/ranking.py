@@ -0,0 +1,145 @@
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# reciprocal rank fusion constant, as in langchain's EnsembleRetriever
+RRF_C = 60
+
+
+def pad_candidates(
+    candidates: Sequence[Sequence[Sequence[float]]],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Stack per-query candidate embeddings into one zero-padded array.
+
+    Returns:
+        vectors: (queries, fetch_k, dims) float32 array
+        valid: (queries, fetch_k) bool mask of real candidates
+    """
+    width = max((len(c) for c in candidates), default=0)
+    dims = next((len(c[0]) for c in candidates if len(c)), 0)
+    vectors = np.zeros((len(candidates), width, dims), dtype=np.float32)
+    valid = np.zeros((len(candidates), width), dtype=bool)
+    for i, c in enumerate(candidates):
+        if len(c):
+            vectors[i, : len(c)] = c
+            valid[i, : len(c)] = True
+    return vectors, valid
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.sqrt(np.einsum("...d,...d->...", vectors, vectors))[..., None]
+    # zero vectors (and padding) stay zero, giving a similarity of 0
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def batch_mmr(
+    queries: np.ndarray,
+    candidates: np.ndarray,
+    valid: Optional[np.ndarray] = None,
+    k: int = 4,
+    lambda_mult: float = 0.5,
+) -> np.ndarray:
+    """Maximal marginal relevance for every query at once.
+
+    Picks the same candidates as langchain's per-query
+    maximal_marginal_relevance, but runs each selection step as one array
+    operation across all queries.
+
+    Args:
+        queries: (queries, dims) query embeddings
+        candidates: (queries, fetch_k, dims) candidate embeddings per query
+        valid: (queries, fetch_k) mask of real candidates, for padded input
+        k: number of candidates to select per query
+        lambda_mult: 1 for pure relevance, 0 for maximum diversity
+
+    Returns:
+        (queries, k) candidate indices in selection order, -1 where a query
+        has fewer than k candidates
+    """
+    n_queries, width = candidates.shape[:2]
+    if valid is None:
+        valid = np.ones((n_queries, width), dtype=bool)
+    selected = np.full((n_queries, k), -1, dtype=np.int64)
+    if width == 0 or k <= 0:
+        return selected
+
+    unit = _normalize(candidates.astype(np.float32, copy=False))
+    query_unit = _normalize(queries.astype(np.float32))
+    # batched matmul goes through BLAS, einsum would not
+    to_query = np.matmul(unit, query_unit[:, :, None])[:, :, 0]
+    between = np.matmul(unit, unit.transpose(0, 2, 1))
+
+    rows = np.arange(n_queries)
+    available = valid.copy()
+    scores = np.where(available, to_query, -np.inf)
+    redundancy = np.full((n_queries, width), -np.inf, dtype=np.float32)
+    for step in range(k):
+        if step:
+            scores = lambda_mult * to_query - (1 - lambda_mult) * redundancy
+            scores = np.where(available, scores, -np.inf)
+        best = np.argmax(scores, axis=1)
+        active = available[rows, best]
+        selected[active, step] = best[active]
+        available[rows[active], best[active]] = False
+        redundancy = np.maximum(redundancy, between[rows, :, best])
+    return selected
+
+
+def rrf(
+    rankings: Sequence[np.ndarray],
+    weights: Optional[Sequence[float]] = None,
+    c: int = RRF_C,
+) -> np.ndarray:
+    """Weighted reciprocal rank fusion over rankings of integer ids.
+
+    Ties keep the order in which ids first appear across the rankings, which
+    matches EnsembleRetriever.weighted_reciprocal_rank.
+
+    Returns:
+        fused ids, best first
+    """
+    rankings = [np.asarray(r, dtype=np.int64) for r in rankings]
+    rankings = [r[r >= 0] for r in rankings]
+    if not rankings or not any(len(r) for r in rankings):
+        return np.empty(0, dtype=np.int64)
+    if weights is None:
+        weights = [1 / len(rankings)] * len(rankings)
+
+    ids = np.concatenate(rankings)
+    contributions = np.concatenate(
+        [w / (np.arange(1, len(r) + 1) + c) for r, w in zip(rankings, weights)]
+    )
+    unique, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+    scores = np.bincount(inverse, weights=contributions)
+    order = np.lexsort((first, -scores))
+    return unique[order]
+
+
+def fuse(
+    queries: np.ndarray,
+    candidates: np.ndarray,
+    candidate_ids: np.ndarray,
+    valid: Optional[np.ndarray] = None,
+    k: int = 4,
+    lambda_mult: float = 0.5,
+    weights: Optional[Sequence[float]] = None,
+    extra: Optional[Sequence[Sequence[int]]] = None,
+) -> List[int]:
+    """MMR per query then RRF across queries, on integer document ids.
+
+    MMR picks are ranked in candidate (similarity) order, as Chroma's MMR
+    search returns them.
+
+    Args:
+        candidate_ids: (queries, fetch_k) integer document id of each candidate
+        weights: one per query, then one per extra ranking
+        extra: rankings from other retrievers (e.g. lexical) to fuse in
+
+    Returns:
+        fused document ids, best first
+    """
+    picks = np.sort(batch_mmr(queries, candidates, valid, k, lambda_mult), axis=1)
+    rows = np.arange(len(picks))[:, None]
+    ranked = np.where(picks >= 0, candidate_ids[rows, np.maximum(picks, 0)], -1)
+    return rrf([*ranked, *(extra or [])], weights).tolist()
@@ -0,0 +1,289 @@
+import io
+import os
+import logging
+from typing import Iterator, Optional
+
+import httpx
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+DEFAULT_SAMPLE_ROWS = 10
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_ROW_GROUPS = 3
+CSV_CHUNK_ROWS = 50_000
+TIMEOUT = 30
+
+logger = logging.getLogger(__name__)
+
+
+def get_max_bytes() -> int:
+    return int(os.getenv("SAMPLE_MAX_BYTES") or DEFAULT_MAX_BYTES)
+
+
+def _is_remote(link: str) -> bool:
+    return link.startswith(("http://", "https://"))
+
+
+class _ByteStream(io.RawIOBase):
+    """File object over an iterator of byte chunks, cut at max_bytes.
+
+    The cut falls on the last newline inside the limit, so the csv parser
+    never sees a partial row.
+    """
+
+    def __init__(self, chunks: Iterator[bytes], max_bytes: int):
+        self._chunks = chunks
+        self._buffer = b""
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.truncated = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer and not self.truncated:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            if self.bytes_read + len(chunk) > self.max_bytes:
+                chunk = chunk[: self.max_bytes - self.bytes_read]
+                chunk = chunk[: chunk.rfind(b"\n") + 1]
+                self.truncated = True
+            self.bytes_read += len(chunk)
+            self._buffer = chunk
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+class RangeFile(io.RawIOBase):
+    """Seekable read-only file over HTTP range requests, for the parquet reader.
+
+    Raises once more than max_bytes have been fetched in total, if given.
+    Servers that don't advertise range support or a length get a single
+    download instead, held in memory and bounded by max_bytes the same way.
+    """
+
+    def __init__(
+        self,
+        client: httpx.Client,
+        url: str,
+        max_bytes: Optional[int] = None,
+        timeout: float = TIMEOUT,
+    ):
+        self.client = client
+        self.url = url
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.bytes_read = 0
+        self._position = 0
+        self._data = None
+        response = client.head(url, timeout=timeout, follow_redirects=True)
+        response.raise_for_status()
+        length = response.headers.get("content-length")
+        if response.headers.get("accept-ranges") == "bytes" and length is not None:
+            self.size = int(length)
+        else:
+            self._data = self._download()
+            self.size = len(self._data)
+
+    @property
+    def buffered(self) -> bool:
+        """True when the whole file was downloaded up front"""
+        return self._data is not None
+
+    def _download(self) -> bytes:
+        chunks = []
+        with self.client.stream(
+            "GET", self.url, timeout=self.timeout, follow_redirects=True
+        ) as response:
+            response.raise_for_status()
+            for chunk in response.iter_bytes():
+                self.bytes_read += len(chunk)
+                if self.max_bytes is not None and self.bytes_read > self.max_bytes:
+                    raise ValueError(
+                        f"{self.url} does not support range requests and is "
+                        f"over {self.max_bytes} bytes"
+                    )
+                chunks.append(chunk)
+        return b"".join(chunks)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._position = max(0, min(offset, self.size))
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), self.size - self._position)
+        if size <= 0:
+            return 0
+        if self._data is not None:
+            buffer[:size] = self._data[self._position : self._position + size]
+            self._position += size
+            return size
+        if self.max_bytes is not None and self.bytes_read + size > self.max_bytes:
+            raise ValueError(
+                f"Sampling {self.url} would read over {self.max_bytes} bytes"
+            )
+        end = self._position + size - 1
+        response = self.client.get(
+            self.url,
+            headers={"Range": f"bytes={self._position}-{end}"},
+            timeout=self.timeout,
+            follow_redirects=True,
+        )
+        response.raise_for_status()
+        data = response.content[:size]
+        buffer[: len(data)] = data
+        self.bytes_read += len(data)
+        self._position += len(data)
+        return len(data)
+
+
+def _reservoir(chunks: Iterator[pd.DataFrame], n: int, rng) -> pd.DataFrame:
+    """Uniform sample of n rows over a stream of frames.
+
+    Each row gets a random key and the n smallest keys are kept, the
+    vectorised equivalent of reservoir sampling. Rows come out in key
+    order, i.e. shuffled like DataFrame.sample.
+    """
+    reservoir, keys = None, np.empty(0)
+    for chunk in chunks:
+        chunk_keys = rng.random(len(chunk))
+        if reservoir is None:
+            reservoir, keys = chunk, chunk_keys
+        else:
+            reservoir = pd.concat([reservoir, chunk])
+            keys = np.concatenate([keys, chunk_keys])
+        if len(reservoir) > n:
+            keep = np.argpartition(keys, n)[:n]
+            reservoir, keys = reservoir.iloc[keep], keys[keep]
+    if reservoir is None:
+        return pd.DataFrame()
+    return reservoir.iloc[np.argsort(keys)]
+
+
+def sample_csv(
+    link: str,
+    n: int = DEFAULT_SAMPLE_ROWS,
+    max_bytes: Optional[int] = None,
+    client: Optional[httpx.Client] = None,
+    rng=None,
+) -> pd.DataFrame:
+    """Sample n rows of a csv, streaming it in chunks up to max_bytes"""
+    max_bytes = max_bytes or get_max_bytes()
+    rng = rng or np.random.default_rng()
+    if not _is_remote(link):
+        with open(link, "rb") as file:
+            stream = _ByteStream(iter(lambda: file.read(1 << 20), b""), max_bytes)
+            return _sample_stream(link, stream, n, rng)
+
+    if client is None:
+        with httpx.Client() as client:
+            return sample_csv(link, n, max_bytes, client, rng)
+    with client.stream("GET", link, timeout=TIMEOUT, follow_redirects=True) as response:
+        response.raise_for_status()
+        stream = _ByteStream(response.iter_bytes(), max_bytes)
+        return _sample_stream(link, stream, n, rng)
+
+
+def _sample_stream(link: str, stream: _ByteStream, n: int, rng) -> pd.DataFrame:
+    reader = pd.read_csv(io.BufferedReader(stream), chunksize=CSV_CHUNK_ROWS)
+    with reader:
+        sample = _reservoir(reader, n, rng)
+    if stream.truncated:
+        logger.info(f"Sampled the first {stream.bytes_read} bytes of {link}")
+    return sample
+
+
+def sample_parquet(
+    link: str,
+    n: int = DEFAULT_SAMPLE_ROWS,
+    max_bytes: Optional[int] = None,
+    client: Optional[httpx.Client] = None,
+    rng=None,
+    row_groups: int = DEFAULT_ROW_GROUPS,
+) -> pd.DataFrame:
+    """Sample n rows of a parquet file from a few random row groups.
+
+    Only the footer and the chosen row groups are read, with range requests
+    for remote files. Row groups are picked at random among those that fit
+    in max_bytes together.
+    """
+    max_bytes = max_bytes or get_max_bytes()
+    rng = rng or np.random.default_rng()
+    if _is_remote(link) and client is None:
+        with httpx.Client() as client:
+            return sample_parquet(link, n, max_bytes, client, rng, row_groups)
+    if _is_remote(link):
+        source = RangeFile(client, link, max_bytes)
+    else:
+        source = link
+    parquet = pq.ParquetFile(source)
+    metadata = parquet.metadata
+    if metadata.num_row_groups == 0:
+        return pd.DataFrame()
+
+    sizes = [
+        sum(
+            metadata.row_group(i).column(j).total_compressed_size
+            for j in range(metadata.num_columns)
+        )
+        for i in range(metadata.num_row_groups)
+    ]
+    budget = max_bytes
+    if isinstance(source, RangeFile) and not source.buffered:
+        # the footer came out of the same budget
+        budget -= source.bytes_read
+    chosen, total = [], 0
+    for i in rng.permutation(metadata.num_row_groups):
+        if total + sizes[i] <= budget:
+            chosen.append(int(i))
+            total += sizes[i]
+        if len(chosen) == row_groups:
+            break
+    if not chosen:
+        raise ValueError(f"Every row group of {link} is over {max_bytes} bytes")
+    chosen.sort()
+
+    frame = parquet.read_row_groups(chosen).to_pandas()
+    # keep file-wide row numbers, as sampling the whole frame would show
+    offsets = np.concatenate(
+        [[0], np.cumsum([metadata.row_group(i).num_rows for i in range(len(sizes))])]
+    )
+    frame.index = np.concatenate(
+        [np.arange(offsets[i], offsets[i + 1]) for i in chosen]
+    )
+    return frame.sample(min(n, len(frame)), random_state=rng)
+
+
+def sample_frame(
+    link_csv: Optional[str] = None,
+    link_parquet: Optional[str] = None,
+    n: int = DEFAULT_SAMPLE_ROWS,
+    client: Optional[httpx.Client] = None,
+) -> Optional[pd.DataFrame]:
+    """Sample rows of whichever file is linked, None without a link.
+
+    Blocking, run it in a worker thread from async code.
+    """
+    if link_csv:
+        return sample_csv(link_csv, n, client=client)
+    if link_parquet:
+        return sample_parquet(link_parquet, n, client=client)
+    return None
@@ -1,3 +1,11 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+# bump whenever a template below changes, cached renders are keyed on it
+TEMPLATE_VERSION = 1
+RENDER_CACHE_SIZE = 4096
+
 CATALOGUE_ID_TEMPLATE = """### Querying {subcategory} {category} data from the Data Catalogue API
 
 To query specifc data from the Data Catalgoue API, you need to specify the `id` parameter in your request URL.
@@ -24,3 +32,44 @@ Dataset page: https://data.gov.my/data-catalogue/{id}
 Note that this data catalogue is not available through OpenAPI as the nature of the data makes it unsuitable for API access. However, you can access the full dataset through the provided download link in the dataset page.
 
 To discover all other available datasets, visit the [Data Catalogue page](https://data.gov.my/data-catalogue)."""
+
+
+DC_META_CONTEXT_TEMPLATE = """Dataset: {id}
+Description: {description}
+Methodology: {data_methodology}
+Caveat: {data_caveat}
+Data Fields: {col_meta_clean}"""
+
+
+class RenderCache:
+    """Bounded LRU of rendered context strings.
+
+    Keys combine a document id with TEMPLATE_VERSION, so a template change
+    never serves stale renders. Document ids from the index are content
+    hashes, which makes (id, version) enough to identify a render.
+    """
+
+    def __init__(self, maxsize: int = RENDER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._renders = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, render: Callable[[], str]) -> str:
+        key = (key, TEMPLATE_VERSION)
+        with self._lock:
+            if key in self._renders:
+                self._renders.move_to_end(key)
+                self.hits += 1
+                return self._renders[key]
+        text = render()
+        with self._lock:
+            self.misses += 1
+            self._renders[key] = text
+            if len(self._renders) > self.maxsize:
+                self._renders.popitem(last=False)
+        return text
+
+
+render_cache = RenderCache()
@@ -0,0 +1,66 @@
+import time
+import logging
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import numpy as np
+
+DEFAULT_WINDOW = 1000
+DEFAULT_LOG_EVERY = 100
+
+
+class LatencyStats:
+    """Rolling latency samples per label, logging p50/p99 every so often.
+
+    Usage:
+        stats = LatencyStats("retrieval")
+        with stats.measure("mirror"):
+            ...
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int = DEFAULT_WINDOW,
+        log_every: int = DEFAULT_LOG_EVERY,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self.name = name
+        self.log_every = log_every
+        self.logger = logger or logging.getLogger(__name__)
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._counts = defaultdict(int)
+
+    def observe(self, label: str, seconds: float) -> None:
+        self.logger.debug(f"{self.name} [{label}]: {seconds * 1000:.3f} ms")
+        self._samples[label].append(seconds)
+        self._counts[label] += 1
+        if self.log_every and self._counts[label] % self.log_every == 0:
+            summary = self.summary(label)
+            self.logger.info(
+                f"{self.name} latency [{label}]: p50 {summary['p50_ms']:.2f} ms, "
+                f"p99 {summary['p99_ms']:.2f} ms over {summary['count']} calls"
+            )
+
+    @contextmanager
+    def measure(self, label: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(label, time.perf_counter() - start)
+
+    def summary(self, label: str) -> Dict[str, float]:
+        samples = np.asarray(self._samples[label], dtype=np.float64) * 1000
+        if not len(samples):
+            return {"count": 0, "p50_ms": 0.0, "p99_ms": 0.0}
+        p50, p99 = np.percentile(samples, [50, 99])
+        return {"count": len(samples), "p50_ms": float(p50), "p99_ms": float(p99)}
+
+
+# time spent rendering retrieved documents into context, per request
+context_timing = LatencyStats("context build")
+
+# per-stage latency of the pipelined rewrite and retrieval path
+pipeline_timing = LatencyStats("retrieval pipeline")
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# modules under src/assistant import each other by their flat names
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src", "assistant")
+)
@@ -0,0 +1,72 @@
+import time
+import asyncio
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from utils.embeddings import CachedEmbeddings, EmbeddingCache
+from utils.embed_pipeline import EmbeddingPipeline
+
+
+class SlowEmbeddings(DeterministicFakeEmbedding):
+    """Fake async embedding model, the first batch takes delay seconds and
+    every later one takes ten times as long"""
+
+    delay: float = 0.0
+    batches: List[List[str]] = []
+    cancelled: int = 0
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.batches.append(list(texts))
+        try:
+            await asyncio.sleep(self.delay * (10 if len(self.batches) > 1 else 1))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return self.embed_documents(texts)
+
+
+class WordEncoding:
+    """Stands in for tiktoken's encoding, one token per word, no download"""
+
+    def encode_ordinary(self, text: str) -> List[str]:
+        return text.split()
+
+
+def pipeline(tmp_path, delay=0.0):
+    underlying = SlowEmbeddings(size=8, delay=delay, batches=[])
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+    embeddings = CachedEmbeddings(underlying, "fake", cache)
+    embed = EmbeddingPipeline(embeddings, concurrency=2, encoding=WordEncoding())
+    return embed, underlying
+
+
+def documents(n):
+    return [Document(page_content=f"doc {i}") for i in range(n)]
+
+
+def test_stream_embeds_every_window_and_keeps_order(tmp_path):
+    embed, underlying = pipeline(tmp_path)
+
+    docs = list(embed.stream(documents(5), window=2))
+
+    assert [doc.page_content for doc in docs] == [f"doc {i}" for i in range(5)]
+    assert sorted(text for batch in underlying.batches for text in batch) == [
+        f"doc {i}" for i in range(5)
+    ]
+    assert embed.totals["embedded"] == 5
+
+
+def test_stream_cancels_the_window_in_flight_on_early_exit(tmp_path):
+    embed, underlying = pipeline(tmp_path, delay=0.1)
+    stream = embed.stream(documents(6), window=2)
+
+    next(stream)
+    start = time.perf_counter()
+    stream.close()
+
+    # the second window was being embedded, and is not waited for
+    assert time.perf_counter() - start < 0.5
+    assert underlying.cancelled == 1
+    assert len(underlying.batches) == 2
@@ -0,0 +1,119 @@
+import asyncio
+from typing import List
+
+import numpy as np
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import utils.embeddings as embeddings
+from utils.embeddings import (
+    DEFAULT_CACHE_PATH,
+    EmbeddingCache,
+    CachedEmbeddings,
+    get_embeddings,
+    text_hash,
+)
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Fake embedding model that records every batch it is asked to embed"""
+
+    calls: List[List[str]] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls.append(list(texts))
+        return super().embed_documents(texts)
+
+
+def cached(tmp_path, max_entries=1000):
+    underlying = CountingEmbeddings(size=8, calls=[])
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"), max_entries)
+    return CachedEmbeddings(underlying, "fake", cache), underlying
+
+
+def test_repeated_texts_are_embedded_once(tmp_path):
+    model, underlying = cached(tmp_path)
+
+    first = model.embed_documents(["a", "b", "a"])
+    second = model.embed_documents(["b", "c"])
+
+    assert underlying.calls == [["a", "b"], ["c"]]
+    # stored as float32
+    assert first[0] == first[2]
+    np.testing.assert_allclose(first[0], underlying.embed_query("a"), rtol=1e-6)
+    np.testing.assert_allclose(second[0], first[1], rtol=1e-6)
+    assert model.stats() == {"hits": 1, "misses": 3}
+
+
+def test_async_path_shares_the_cache(tmp_path):
+    model, underlying = cached(tmp_path)
+    model.embed_documents(["a"])
+
+    vectors = asyncio.run(model.aembed_documents(["a", "b"]))
+
+    assert underlying.calls == [["a"], ["b"]]
+    np.testing.assert_allclose(
+        vectors, underlying.embed_documents(["a", "b"]), rtol=1e-6
+    )
+
+
+def test_vectors_survive_a_restart(tmp_path):
+    model, _ = cached(tmp_path)
+    model.embed_documents(["a", "b"])
+
+    reopened, underlying = cached(tmp_path)
+    reopened.embed_documents(["a", "b"])
+
+    assert underlying.calls == []
+    assert reopened.uncached(["a", "b", "c"]) == ["c"]
+
+
+def test_hits_only_touch_stale_rows_in_batches(tmp_path, monkeypatch):
+    model, _ = cached(tmp_path)
+    model.embed_documents(["a", "b"])
+    cache = model.cache
+
+    # fresh rows are not rewritten on a hit
+    model.embed_documents(["a"])
+    assert cache._touched["fake"] == set()
+
+    monkeypatch.setattr(embeddings, "TOUCH_INTERVAL", -1)
+    model.embed_documents(["a"])
+    assert cache._touched["fake"] == {text_hash("a")}
+
+    cache.flush()
+    assert cache._touched["fake"] == set()
+
+
+def test_least_recently_used_rows_are_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(embeddings, "TOUCH_INTERVAL", -1)
+    model, _ = cached(tmp_path, max_entries=10)
+    model.embed_documents([f"old {i}" for i in range(5)])
+    model.embed_documents([f"kept {i}" for i in range(5)])
+    # a hit makes the old rows recent again
+    model.embed_documents(["old 0"])
+
+    model.embed_documents(["new"])
+
+    # evicted down to 90% of the cap, from the rows not used since
+    assert len(model.cache) == 9
+    kept = ["old 0", "new"] + [f"kept {i}" for i in range(5)]
+    assert model.uncached(kept) == []
+    assert len(model.uncached([f"old {i}" for i in range(1, 5)])) == 2
+
+
+def test_blank_env_vars_use_defaults(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBED_CACHE_PATH", "")
+    monkeypatch.setenv("EMBED_CACHE_MAX_ENTRIES", "")
+    monkeypatch.setattr(
+        embeddings, "DEFAULT_CACHE_PATH", str(tmp_path / "embeddings.sqlite")
+    )
+
+    model = get_embeddings(underlying=CountingEmbeddings(size=8, calls=[]))
+
+    assert model.cache.path == str(tmp_path / "embeddings.sqlite")
+    assert model.cache.max_entries == embeddings.DEFAULT_MAX_ENTRIES
+
+
+def test_default_path_does_not_depend_on_cwd():
+    assert DEFAULT_CACHE_PATH.endswith("src/assistant/data/embeddings.sqlite")
@@ -0,0 +1,127 @@
+import asyncio
+
+import httpx
+
+from utils.fetch import DEFAULT_CONCURRENCY, AsyncFetcher, BlockingFetcher, cache_key
+
+
+class FakeGitHub:
+    """Local stand-in for the raw file host, serving ETags and 304s"""
+
+    def __init__(self, files, delays=None):
+        self.files = files
+        self.delays = delays or {}
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delays.get(request.url.path, 0))
+        finally:
+            self.in_flight -= 1
+        body = self.files.get(request.url.path)
+        if body is None:
+            return httpx.Response(404)
+        etag = f'"{hash(body)}"'
+        if request.headers.get("if-none-match") == etag:
+            return httpx.Response(304, headers={"etag": etag})
+        return httpx.Response(200, text=body, headers={"etag": etag})
+
+
+def fetch_all(server, urls, cache_dir, concurrency=4):
+    async def run():
+        async with AsyncFetcher(
+            concurrency=concurrency,
+            cache_dir=str(cache_dir),
+            transport=httpx.MockTransport(server),
+        ) as fetcher:
+            return await fetcher.fetch_all(urls), fetcher.stats
+
+    return asyncio.run(run())
+
+
+def test_fetch_all_keeps_order_and_caps_concurrency(tmp_path):
+    files = {f"/{i}.mdx": f"file {i}" for i in range(10)}
+    # earlier files finish last
+    delays = {f"/{i}.mdx": 0.01 * (10 - i) for i in range(10)}
+    server = FakeGitHub(files, delays)
+    urls = [f"https://raw.test/{i}.mdx" for i in range(10)]
+
+    bodies, stats = fetch_all(server, urls, tmp_path, concurrency=3)
+
+    assert bodies == [f"file {i}" for i in range(10)]
+    assert len(server.requests) == 10
+    assert server.max_in_flight == 3
+    assert stats == {"requests": 10, "not_modified": 0, "downloaded": 10}
+
+
+def test_unchanged_files_are_revalidated_and_served_from_cache(tmp_path):
+    files = {"/a.mdx": "a", "/b.mdx": "b"}
+    server = FakeGitHub(files)
+    urls = ["https://raw.test/a.mdx", "https://raw.test/b.mdx"]
+    fetch_all(server, urls, tmp_path)
+
+    files["/b.mdx"] = "b changed"
+    server.requests.clear()
+    bodies, stats = fetch_all(server, urls, tmp_path)
+
+    assert bodies == ["a", "b changed"]
+    assert all("if-none-match" in r.headers for r in server.requests)
+    assert stats == {"requests": 2, "not_modified": 1, "downloaded": 1}
+
+
+def test_raw_files_keep_their_cache_entry_across_commits(tmp_path):
+    files = {"/org/repo/c1/pages/a.mdx": "a", "/org/repo/c2/pages/a.mdx": "a"}
+    server = FakeGitHub(files)
+    fetch_all(
+        server, ["https://raw.githubusercontent.com/org/repo/c1/pages/a.mdx"], tmp_path
+    )
+
+    server.requests.clear()
+    bodies, stats = fetch_all(
+        server, ["https://raw.githubusercontent.com/org/repo/c2/pages/a.mdx"], tmp_path
+    )
+
+    assert bodies == ["a"]
+    assert server.requests[0].url.path == "/org/repo/c2/pages/a.mdx"
+    assert stats["not_modified"] == 1
+    assert cache_key("https://raw.test/c1/a.mdx") == "https://raw.test/c1/a.mdx"
+
+
+def test_concurrency_env_var_blank_uses_default(tmp_path, monkeypatch):
+    monkeypatch.setenv("FETCH_CONCURRENCY", "")
+    fetcher = AsyncFetcher(cache_dir=str(tmp_path))
+    assert fetcher.concurrency == DEFAULT_CONCURRENCY
+
+
+def test_blocking_fetcher_reuses_one_client_across_windows(tmp_path):
+    files = {f"/{i}.mdx": f"file {i}" for i in range(6)}
+    server = FakeGitHub(files)
+    urls = [f"https://raw.test/{i}.mdx" for i in range(6)]
+
+    with BlockingFetcher(
+        cache_dir=str(tmp_path), transport=httpx.MockTransport(server)
+    ) as fetcher:
+        client = fetcher._fetcher._client
+        first = fetcher.submit_all(urls[:3])
+        second = fetcher.fetch_all(urls[3:])
+        assert fetcher._fetcher._client is client
+        bodies = first.result() + second
+
+    assert bodies == [f"file {i}" for i in range(6)]
+    assert fetcher.stats["requests"] == 6
+
+
+def test_blocking_fetcher_cancels_pending_fetch_on_exit(tmp_path):
+    server = FakeGitHub({"/slow.mdx": "slow"}, {"/slow.mdx": 5})
+
+    with BlockingFetcher(
+        cache_dir=str(tmp_path), transport=httpx.MockTransport(server)
+    ) as fetcher:
+        pending = fetcher.submit_all(["https://raw.test/slow.mdx"])
+
+    assert pending.cancelled()
@@ -0,0 +1,38 @@
+import uuid
+
+import chromadb
+import numpy as np
+import pytest
+
+from mirror import CollectionMirror
+
+
+@pytest.fixture()
+def mirror():
+    client = chromadb.EphemeralClient()
+    name = f"docs-{uuid.uuid4().hex}"
+    collection = client.create_collection(name)
+    rng = np.random.default_rng(0)
+    collection.add(
+        ids=[f"id{i}" for i in range(20)],
+        embeddings=rng.normal(size=(20, 8)).tolist(),
+        documents=[f"chunk {i}" for i in range(20)],
+        metadatas=[{"source": f"docs/{i % 4}"} for i in range(20)],
+    )
+    mirror = CollectionMirror(name, client=client)
+    mirror.sync("1")
+    return mirror
+
+
+def test_filtered_query_returns_only_matching_records(mirror):
+    results = mirror.query([[1.0] * 8], 3, where={"source": "docs/1"})
+
+    assert len(results["ids"][0]) == 3
+    assert all(m["source"] == "docs/1" for m in results["metadatas"][0])
+
+
+def test_filter_without_matches_returns_empty_rows(mirror):
+    results = mirror.query([[1.0] * 8, [0.5] * 8], 3, where={"source": "missing"})
+
+    for key in ("ids", "documents", "metadatas", "embeddings", "distances"):
+        assert results[key] == [[], []]
@@ -0,0 +1,138 @@
+import uuid
+import asyncio
+import hashlib
+from typing import List
+
+import chromadb
+import numpy as np
+import pytest
+from langchain.retrievers import EnsembleRetriever
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+
+from chain import DocsRetriever
+
+QUERIES = [
+    "how to call the api",
+    "catalogue id for population",
+    "what is dosm",
+    "gdp quarterly",
+]
+
+
+class StubEmbeddings(Embeddings):
+    """Deterministic unit vectors per text, counting embedding calls"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).normal(size=32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+
+@pytest.fixture()
+def store():
+    embeddings = StubEmbeddings()
+    vectorstore = Chroma(
+        client=chromadb.EphemeralClient(),
+        collection_name=f"docs-{uuid.uuid4().hex}",
+        embedding_function=embeddings,
+    )
+    texts = [f"chunk {i} about topic {i % 17}" for i in range(300)]
+    vectorstore.add_texts(
+        texts, metadatas=[{"source": f"docs/{i % 40}"} for i in range(300)]
+    )
+
+    collection = vectorstore._collection
+    query = collection.query
+    queries = []
+
+    def counting_query(*args, **kwargs):
+        queries.append(kwargs)
+        return query(*args, **kwargs)
+
+    collection.query = counting_query
+    vectorstore._chroma_collection = collection
+    embeddings.calls = 0
+    return vectorstore, embeddings, queries
+
+
+def per_query_mmr(vectorstore, retriever, queries) -> List[str]:
+    """The previous path: Chroma's MMR search per query, fused with RRF"""
+    rankings = [
+        vectorstore.max_marginal_relevance_search(
+            query,
+            k=retriever.k,
+            fetch_k=retriever.fetch_k,
+            lambda_mult=retriever.lambda_mult,
+        )
+        for query in queries
+    ]
+    ensemble = EnsembleRetriever(
+        retrievers=[vectorstore.as_retriever()] * len(queries),
+        weights=[1 / len(queries)] * len(queries),
+    )
+    return [doc.page_content for doc in ensemble.weighted_reciprocal_rank(rankings)]
+
+
+def contents(docs) -> List[str]:
+    return [doc.page_content for doc in docs]
+
+
+def test_batch_embeds_and_queries_once(store):
+    vectorstore, embeddings, queries = store
+    retriever = DocsRetriever(vectorstore=vectorstore)
+
+    retriever.fused_relevant_documents(QUERIES)
+
+    assert embeddings.calls == 1
+    assert len(queries) == 1
+    assert len(queries[0]["query_embeddings"]) == len(QUERIES)
+    assert queries[0]["n_results"] == retriever.fetch_k
+
+
+def test_async_batch_embeds_and_queries_once(store):
+    vectorstore, embeddings, queries = store
+    retriever = DocsRetriever(vectorstore=vectorstore)
+
+    asyncio.run(retriever.afused_relevant_documents(QUERIES))
+
+    assert embeddings.calls == 1
+    assert len(queries) == 1
+
+
+def test_fused_ranking_matches_per_query_mmr(store):
+    vectorstore, _, _ = store
+    retriever = DocsRetriever(vectorstore=vectorstore)
+    expected = per_query_mmr(vectorstore, retriever, QUERIES)
+
+    assert contents(retriever.fused_relevant_documents(QUERIES)) == expected
+    assert (
+        contents(asyncio.run(retriever.afused_relevant_documents(QUERIES))) == expected
+    )
+
+
+def test_single_query_matches_mmr_search(store):
+    vectorstore, _, _ = store
+    retriever = DocsRetriever(vectorstore=vectorstore)
+
+    for query in QUERIES:
+        expected = vectorstore.max_marginal_relevance_search(
+            query,
+            k=retriever.k,
+            fetch_k=retriever.fetch_k,
+            lambda_mult=retriever.lambda_mult,
+        )
+        assert contents(retriever.invoke(query)) == contents(expected)
@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+import pytest
+import httpx
+
+from utils.sampling import RangeFile, sample_csv, sample_parquet
+
+# rows per fixture file, from a single row group to many
+SIZES = [5, 2_000, 100_000]
+ROW_GROUP_ROWS = 10_000
+
+
+class FileHost:
+    """Serves local files like an object store, optionally without ranges"""
+
+    def __init__(self, directory, ranges=True):
+        self.directory = directory
+        self.ranges = ranges
+        self.bytes_sent = 0
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        path = self.directory / request.url.path.lstrip("/")
+        if not path.exists():
+            return httpx.Response(404)
+        body = path.read_bytes()
+        headers = {"accept-ranges": "bytes"} if self.ranges else {}
+        if request.method == "HEAD":
+            if self.ranges:
+                headers["content-length"] = str(len(body))
+            return httpx.Response(200, headers=headers)
+        header = request.headers.get("range", "")
+        if self.ranges and header.startswith("bytes="):
+            start, _, end = header[len("bytes=") :].partition("-")
+            body = body[int(start) : int(end) + 1]
+            status = 206
+        else:
+            status = 200
+        self.bytes_sent += len(body)
+        return httpx.Response(status, content=body, headers=headers)
+
+
+def frame(rows):
+    rng = np.random.default_rng(rows)
+    return pd.DataFrame(
+        {
+            "id": np.arange(rows),
+            "value": rng.normal(size=rows),
+            "label": [f"row {i}" for i in range(rows)],
+        }
+    )
+
+
+@pytest.fixture()
+def files(tmp_path):
+    for rows in SIZES:
+        data = frame(rows)
+        data.to_csv(tmp_path / f"{rows}.csv", index=False)
+        data.to_parquet(tmp_path / f"{rows}.parquet", row_group_size=ROW_GROUP_ROWS)
+    return tmp_path
+
+
+def client(host):
+    return httpx.Client(transport=httpx.MockTransport(host))
+
+
+@pytest.mark.parametrize("rows", SIZES)
+@pytest.mark.parametrize("ranges", [True, False])
+def test_remote_parquet_sample_matches_local(files, rows, ranges):
+    host = FileHost(files, ranges=ranges)
+    local = sample_parquet(str(files / f"{rows}.parquet"), rng=np.random.default_rng(0))
+
+    remote = sample_parquet(
+        f"https://data.test/{rows}.parquet",
+        client=client(host),
+        rng=np.random.default_rng(0),
+    )
+
+    pd.testing.assert_frame_equal(remote, local)
+    assert len(remote) == min(10, rows)
+
+
+def test_remote_parquet_reads_only_the_chosen_row_groups(files):
+    host = FileHost(files)
+    size = (files / "100000.parquet").stat().st_size
+
+    sample_parquet(
+        "https://data.test/100000.parquet", client=client(host), row_groups=2
+    )
+
+    # 2 of 10 row groups plus the footer
+    assert host.bytes_sent < size * 0.4
+
+
+def test_range_file_without_range_support_downloads_once(files):
+    host = FileHost(files, ranges=False)
+    data = (files / "2000.parquet").read_bytes()
+
+    source = RangeFile(client(host), "https://data.test/2000.parquet")
+    source.seek(-8, 2)
+
+    assert source.buffered
+    assert source.read(8) == data[-8:]
+    assert [request.method for request in host.requests] == ["HEAD", "GET"]
+
+
+def test_range_file_without_range_support_is_bounded(files):
+    host = FileHost(files, ranges=False)
+
+    with pytest.raises(ValueError, match="over 1000 bytes"):
+        RangeFile(client(host), "https://data.test/100000.parquet", max_bytes=1000)
+
+
+@pytest.mark.parametrize("rows", SIZES)
+def test_remote_csv_sample_matches_local(files, rows):
+    host = FileHost(files)
+    local = sample_csv(str(files / f"{rows}.csv"), rng=np.random.default_rng(0))
+
+    remote = sample_csv(
+        f"https://data.test/{rows}.csv",
+        client=client(host),
+        rng=np.random.default_rng(0),
+    )
+
+    pd.testing.assert_frame_equal(remote, local)
+
+
+def test_csv_sample_stops_at_max_bytes_on_a_row_boundary(files):
+    host = FileHost(files)
+    max_bytes = 50_000
+
+    sample = sample_csv(
+        "https://data.test/100000.csv",
+        n=100_000,
+        max_bytes=max_bytes,
+        client=client(host),
+    )
+
+    expected = frame(100_000)
+    assert 0 < len(sample) < 100_000
+    assert sample.notna().all().all()
+    # every sampled row is complete and from the start of the file
+    pd.testing.assert_frame_equal(
+        sample.sort_values("id").reset_index(drop=True),
+        expected.iloc[: len(sample)],
+        check_exact=False,
+    )
+
+
+def test_default_client_is_closed(files, monkeypatch):
+    host = FileHost(files)
+    opened = []
+
+    class Client(httpx.Client):
+        def __init__(self, **kwargs):
+            super().__init__(transport=httpx.MockTransport(host), **kwargs)
+            opened.append(self)
+
+    monkeypatch.setattr(httpx, "Client", Client)
+
+    sample_csv("https://data.test/5.csv")
+    sample_parquet("https://data.test/5.parquet")
+
+    assert len(opened) == 2
+    assert all(client.is_closed for client in opened)
+
+
+def test_ingest_parquet_read_ignores_the_sampling_limit(files, monkeypatch):
+    from utils.helpers import read_parquet_columns
+
+    host = FileHost(files, ranges=False)
+    monkeypatch.setenv("SAMPLE_MAX_BYTES", "1000")
+
+    class Client(httpx.Client):
+        def __init__(self, **kwargs):
+            super().__init__(transport=httpx.MockTransport(host), **kwargs)
+
+    monkeypatch.setattr(httpx, "Client", Client)
+
+    frame_read = read_parquet_columns("https://data.test/100000.parquet", ["id"])
+
+    assert frame_read["id"].tolist() == list(range(100_000))
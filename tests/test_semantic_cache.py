@@ -0,0 +1,20 @@
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from semantic_cache import DEFAULT_THRESHOLD, SemanticCache
+
+
+def test_explicit_zero_threshold_is_kept(monkeypatch):
+    monkeypatch.setenv("CHAT_CACHE_THRESHOLD", "0.5")
+
+    cache = SemanticCache(DeterministicFakeEmbedding(size=8), threshold=0.0)
+
+    assert cache.threshold == 0.0
+
+
+def test_threshold_falls_back_to_env_then_default(monkeypatch):
+    embeddings = DeterministicFakeEmbedding(size=8)
+    monkeypatch.setenv("CHAT_CACHE_THRESHOLD", "0.5")
+    assert SemanticCache(embeddings).threshold == 0.5
+
+    monkeypatch.setenv("CHAT_CACHE_THRESHOLD", "")
+    assert SemanticCache(embeddings).threshold == DEFAULT_THRESHOLD